@@ -0,0 +1,272 @@
+"""
+Admission control for Whisper and Claude work.
+
+Each kind of heavy work gets a fixed number of concurrency slots. Work beyond
+them waits in a bounded FIFO queue that reports each entry's position; once
+the queue is full, new work is turned away at once with ServerBusy instead of
+piling up. A resident-memory watermark holds queued work back while the
+process (and its Whisper workers) is already using too much memory, so a
+burst of parents cannot push the server into swap. One slot is always
+allowed to run, so a high watermark slows the queue down but never stalls it.
+"""
+import math
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Optional
+
+# First guess at how long a slot is held, until real jobs have been timed
+INITIAL_ESTIMATE_SECONDS = 5.0
+# Weight of the newest job in the running average of slot hold times
+AVERAGE_WEIGHT = 0.2
+MAX_RETRY_AFTER_SECONDS = 300
+
+
+def rss_mb(child_pids: Iterable[int] = ()) -> Optional[float]:
+    """
+    Resident memory of this process plus the given children, in MB
+
+    Returns:
+        The total, or None if it cannot be measured on this platform
+    """
+    try:
+        page_size = os.sysconf("SC_PAGE_SIZE")
+        total = 0
+        for pid in ["self", *child_pids]:
+            try:
+                with open(f"/proc/{pid}/statm") as f:
+                    total += int(f.read().split()[1]) * page_size
+            except (OSError, ValueError, IndexError):
+                if pid == "self":
+                    raise
+        return total / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+    total = 0
+    for pid in [os.getpid(), *child_pids]:
+        try:
+            total += psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            pass
+    return total / (1024 * 1024)
+
+
+def default_watermark_mb() -> float:
+    """Three quarters of physical memory, or 0 (no watermark) if unknown"""
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") * 0.75 / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return 0.0
+
+
+class ServerBusy(Exception):
+    def __init__(self, message: str, retry_after: float):
+        """
+        New work was turned away because the queue is full
+
+        Args:
+            message: Explanation for the user
+            retry_after: Suggested seconds to wait before trying again
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, name: str, slots: int, queue_limit: int, rss_watermark_mb: float = 0.0,
+                 rss: Callable[[], Optional[float]] = rss_mb):
+        """
+        Concurrency slots with a bounded waiting queue
+
+        Args:
+            name: Kind of work, used in messages ("whisper", "claude")
+            slots: Work items allowed to run at once
+            queue_limit: Work items allowed to wait; more are rejected
+            rss_watermark_mb: Start nothing new (beyond one running item)
+                while resident memory is above this; 0 disables the check
+            rss: Measures current resident memory in MB
+        """
+        self.name = name
+        self.slots = max(1, slots)
+        self.queue_limit = max(0, queue_limit)
+        self.rss_watermark_mb = rss_watermark_mb
+        self._rss = rss
+        self._waiting: "OrderedDict[str, Callable[[], None]]" = OrderedDict()
+        self._running: Dict[str, float] = {}
+        self._average_seconds = INITIAL_ESTIMATE_SECONDS
+        self.rejected = 0
+        self.held_for_memory = 0
+        self._lock = threading.Lock()
+
+    def _memory_ok(self) -> bool:
+        if not self.rss_watermark_mb or not self._running:
+            return True
+        rss = self._rss()
+        if rss is None or rss < self.rss_watermark_mb:
+            return True
+        self.held_for_memory += 1
+        return False
+
+    def _take_startable(self) -> list:
+        """Move waiting work into free slots; returns the start callbacks to run"""
+        starts = []
+        while self._waiting and len(self._running) < self.slots and self._memory_ok():
+            key, start = self._waiting.popitem(last=False)
+            self._running[key] = time.monotonic()
+            starts.append(start)
+        return starts
+
+    def _retry_after(self) -> float:
+        return self.retry_after(len(self._waiting) + len(self._running))
+
+    def retry_after(self, backlog: int) -> float:
+        """Suggested wait in seconds for work behind this many items"""
+        estimate = self._average_seconds * backlog / self.slots
+        return min(MAX_RETRY_AFTER_SECONDS, max(1, math.ceil(estimate)))
+
+    def reject(self, waiting: int) -> ServerBusy:
+        """
+        Count work turned away by a queue kept elsewhere, such as a shared one
+
+        Args:
+            waiting: Items already in that queue
+
+        Returns:
+            The error to raise
+        """
+        with self._lock:
+            self.rejected += 1
+        return ServerBusy(f"Too busy right now: {waiting} {self.name} requests are already waiting",
+                          self.retry_after(waiting))
+
+    def _busy(self) -> ServerBusy:
+        return ServerBusy(f"Too busy right now: {len(self._waiting)} {self.name} requests are already waiting",
+                          self._retry_after())
+
+    @staticmethod
+    def _run(starts: list):
+        for start in starts:
+            start()
+
+    def submit(self, key: str, start: Callable[[], None], priority: bool = False) -> int:
+        """
+        Run start() in a free slot now, or queue it until one frees up
+
+        start() is called without any lock held, on this thread or on the
+        thread that releases the slot it gets. Whoever runs the work must call
+        release(key) once it is finished.
+
+        Args:
+            key: Unique id for the work, e.g. a job id
+            start: Starts the work; must not block or raise
+            priority: Work that was already accepted, such as the second half
+                of a chained job, goes to the front and is never rejected
+
+        Returns:
+            0 if the work started, otherwise its position in the queue
+
+        Raises:
+            ServerBusy: The queue is full
+        """
+        error = None
+        position = 0
+        with self._lock:
+            starts = self._take_startable()
+            if len(self._running) < self.slots and not self._waiting and self._memory_ok():
+                self._running[key] = time.monotonic()
+                starts.append(start)
+            elif priority or len(self._waiting) < self.queue_limit:
+                self._waiting[key] = start
+                if priority:
+                    self._waiting.move_to_end(key, last=False)
+                position = self._position(key)
+            else:
+                self.rejected += 1
+                error = self._busy()
+        self._run(starts)
+        if error is not None:
+            raise error
+        return position
+
+    def release(self, key: str):
+        """Give back the slot held by key and start whatever fits next"""
+        with self._lock:
+            started = self._running.pop(key, None)
+            if started is not None:
+                held = time.monotonic() - started
+                self._average_seconds += AVERAGE_WEIGHT * (held - self._average_seconds)
+            starts = self._take_startable()
+        self._run(starts)
+
+    def withdraw(self, key: str) -> bool:
+        """Drop queued work before it starts; False if it is not waiting"""
+        with self._lock:
+            return self._waiting.pop(key, None) is not None
+
+    def _position(self, key: str) -> Optional[int]:
+        for position, waiting_key in enumerate(self._waiting, start=1):
+            if waiting_key == key:
+                return position
+        return None
+
+    def position(self, key: str) -> Optional[int]:
+        """1-based place in the queue, or None if the work is not waiting"""
+        with self._lock:
+            return self._position(key)
+
+    def check(self):
+        """
+        Fail fast, before accepting an upload or a stream, if new work would be rejected
+
+        Raises:
+            ServerBusy: The queue is full
+        """
+        with self._lock:
+            if len(self._waiting) >= self.queue_limit and (self._waiting or len(self._running) >= self.slots):
+                self.rejected += 1
+                raise self._busy()
+
+    @contextmanager
+    def slot(self, timeout: Optional[float] = None, priority: bool = False):
+        """
+        Hold a slot for the enclosed block, queueing like any other work
+
+        For callers that do the work on their own thread instead of handing
+        it to a pool.
+
+        Args:
+            timeout: Seconds to wait for a slot; None waits for as long as it takes
+            priority: Go to the front of the queue and never be rejected
+
+        Raises:
+            ServerBusy: The queue is full, or no slot freed up within timeout
+        """
+        key = uuid.uuid4().hex
+        ready = threading.Event()
+        self.submit(key, ready.set, priority=priority)
+        if not ready.wait(timeout) and self.withdraw(key):
+            raise ServerBusy(f"Timed out waiting for a free {self.name} slot", self._retry_after())
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "slots": self.slots,
+                "running": len(self._running),
+                "waiting": len(self._waiting),
+                "queue_limit": self.queue_limit,
+                "rejected": self.rejected,
+                "held_for_memory": self.held_for_memory,
+                "average_seconds": round(self._average_seconds, 2),
+            }
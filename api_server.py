@@ -0,0 +1,459 @@
+"""
+HTTP/JSON API for the storybook pipeline, for integrations such as a patient portal.
+
+Runs on an ASGI event loop (FastAPI + uvicorn). Request handlers never block:
+Whisper runs in the job executor's worker processes (where each model stays
+loaded between requests) and Claude calls on its thread pool, sharing one
+MedicalTranslator, and therefore one Claude client and its caches, across
+every request. Work beyond the executor's free slots waits in a bounded
+queue (the job reports its queue_position); once that queue is full, new work
+is turned away immediately with 503 and a Retry-After header.
+
+/v1/stream is a WebSocket for live recordings: the client sends PCM frames
+as they are captured and gets partial and final transcripts back while it
+talks, then the story as it is written.
+
+Usage:
+    uvicorn api_server:app --host 0.0.0.0 --port 8000
+    python api_server.py --port 8000
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import tempfile
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, Query, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+from admission_control import ServerBusy
+from instrumentation import render_prometheus
+from job_executor import Job, get_job_executor
+from medical_translator import MedicalTranslator
+from story_exporter import BOOK_TITLE, EXPORT_FORMATS, PDF_LANGUAGES, get_shared_exporter, pdf_supported
+from story_languages import DEFAULT_LANGUAGE, STORY_LANGUAGES
+from story_store import HISTORY_PAGE_SIZE, get_shared_store
+from storybook_formatter import ChapterBookWriter, StorybookFormatter
+
+STORY_STYLES = ["friendly", "adventure", "magical", "superhero"]
+
+# Longest a request with wait=true is held open before it gets the job id instead
+MAX_WAIT_SECONDS = 120.0
+
+# Whisper model for live streams; small models keep partial transcripts quick
+STREAM_MODEL_SIZE = os.getenv("STREAM_WHISPER_MODEL", "base")
+# Longest live recording accepted
+MAX_STREAM_SECONDS = 15 * 60
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("API_MAX_UPLOAD_MB", "50")) * 1024 * 1024
+
+# Why a PDF export was refused
+PDF_UNSUPPORTED = "PDF fonts cannot show every story's script; use format=html or format=epub"
+
+app = FastAPI(title="Medical Storybook API", version="1.0")
+
+
+class StoryRequest(BaseModel):
+    text: str
+    style: str = "friendly"
+    languages: List[str] = [DEFAULT_LANGUAGE]
+    book_id: Optional[str] = None
+    wait: bool = True
+
+
+class ExportRequest(BaseModel):
+    stories: List[str]
+    format: str = "html"
+    style: str = "friendly"
+    title: Optional[str] = None
+
+
+def _translator() -> MedicalTranslator:
+    """One translator (Claude client, caches, glossary) for the whole process"""
+    if getattr(app.state, "translator", None) is None:
+        app.state.translator = MedicalTranslator()
+    return app.state.translator
+
+
+def _check_style(style: str):
+    if style not in STORY_STYLES:
+        raise HTTPException(status_code=422, detail=f"Unknown style {style!r}; choose one of {STORY_STYLES}")
+
+
+def _check_languages(languages: List[str]):
+    unknown = [code for code in languages if code not in STORY_LANGUAGES]
+    if unknown or not languages:
+        raise HTTPException(status_code=422,
+                            detail=f"Unknown languages {unknown}; choose from {list(STORY_LANGUAGES)}")
+
+
+def _job_body(job: Job) -> Dict:
+    body = {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": job.progress,
+        "queue_position": get_job_executor().queue_position(job.id),
+        "error": job.error,
+        "timing": job.timing(),
+    }
+    if job.status == "done":
+        body["result"] = job.result
+        if "story_id" in job.meta:
+            body["story_id"] = job.meta["story_id"]
+    return body
+
+
+async def _wait_for(job: Job, timeout: float) -> bool:
+    """Wait on the event loop, without holding a thread, until the job finishes"""
+    loop = asyncio.get_running_loop()
+    finished = loop.create_future()
+
+    def on_done(_job: Job):
+        loop.call_soon_threadsafe(lambda: finished.done() or finished.set_result(True))
+
+    job.add_done_callback(on_done)
+    try:
+        await asyncio.wait_for(finished, timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+def _save_to_book(job: Job, book_id: str, style: str):
+    """Job callback that files a finished story in the story store"""
+    if job.status != "done":
+        return
+    original = job.result.get("transcript") or job.meta.get("original", "")
+    # A multilingual job may come back without some of the languages it asked for
+    languages = list(job.result.get("stories", {})) or job.meta.get("languages")
+    job.meta["story_id"] = get_shared_store().add(
+        book_id, job.result["formatted"], original=original, style=style, languages=languages
+    )
+
+
+async def _respond(job: Job, wait: bool) -> JSONResponse:
+    if wait and await _wait_for(job, MAX_WAIT_SECONDS):
+        status = 200 if job.status == "done" else 500
+        return JSONResponse(_job_body(job), status_code=status)
+    return JSONResponse(_job_body(job), status_code=202, headers={"Location": f"/v1/jobs/{job.id}"})
+
+
+@app.exception_handler(ServerBusy)
+async def server_busy(request, exc: ServerBusy):
+    """A full queue turns new work away right away instead of letting it pile up"""
+    return JSONResponse({"detail": str(exc)}, status_code=503,
+                        headers={"Retry-After": str(math.ceil(exc.retry_after))})
+
+
+@app.get("/health")
+async def health():
+    executor = get_job_executor()
+    return {"status": "ok", "jobs": executor.stats(), "admission": executor.admission_stats()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics; populated when STORYBOOK_METRICS=1"""
+    return render_prometheus()
+
+
+@app.post("/v1/stories")
+async def create_story(request: StoryRequest):
+    """Turn medical text into a story; with wait=false, returns a job id right away"""
+    _check_style(request.style)
+    _check_languages(request.languages)
+    if not request.text.strip():
+        raise HTTPException(status_code=422, detail="text is empty")
+    executor = get_job_executor()
+    if request.languages == [DEFAULT_LANGUAGE]:
+        job_id = executor.submit_story(
+            _translator(), request.text, request.style,
+            StorybookFormatter().story_templates, meta={"original": request.text}
+        )
+    else:
+        # Every language comes from one request; the result adds the raw story per language
+        job_id = executor.submit_multilingual_story(
+            _translator(), request.text, request.style, request.languages,
+            StorybookFormatter().story_templates,
+            meta={"original": request.text, "languages": request.languages}
+        )
+    job = executor.get(job_id)
+    if request.book_id:
+        job.add_done_callback(lambda finished: _save_to_book(finished, request.book_id, request.style))
+    return await _respond(job, request.wait)
+
+
+@app.post("/v1/stories/audio")
+async def create_story_from_audio(
+    audio: UploadFile = File(...),
+    style: str = Form("friendly"),
+    book_id: Optional[str] = Form(None),
+    wait: bool = Form(False),
+):
+    """Transcribe an uploaded recording and turn it into a story"""
+    _check_style(style)
+    # Turn the upload away before reading it if it would be rejected anyway
+    get_job_executor().check_capacity(transcription=True)
+
+    suffix = os.path.splitext(audio.filename or "")[1] or ".wav"
+    handle, audio_path = tempfile.mkstemp(suffix=suffix)
+    size = 0
+    try:
+        with os.fdopen(handle, "wb") as f:
+            while True:
+                chunk = await audio.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail="Recording is too large")
+                f.write(chunk)
+    except BaseException:
+        os.unlink(audio_path)
+        raise
+
+    executor = get_job_executor()
+    try:
+        job_id = executor.submit_audio_story(
+            audio_path, _translator(), style,
+            templates=StorybookFormatter().story_templates, delete_after=True
+        )
+    except BaseException:
+        # The job owns the file only once it is submitted
+        if os.path.exists(audio_path):
+            os.unlink(audio_path)
+        raise
+    job = executor.get(job_id)
+    if book_id:
+        job.add_done_callback(lambda finished: _save_to_book(finished, book_id, style))
+    return await _respond(job, wait)
+
+
+@app.get("/v1/jobs/{job_id}")
+async def job_status(job_id: str, wait: float = Query(0.0, ge=0.0, le=MAX_WAIT_SECONDS)):
+    """Status, progress (the story so far) and, once done, the result of a job"""
+    job = get_job_executor().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    if wait and not job.done:
+        await _wait_for(job, wait)
+    return _job_body(job)
+
+
+@app.delete("/v1/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    executor = get_job_executor()
+    if executor.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return {"id": job_id, "cancelled": executor.cancel(job_id)}
+
+
+@app.websocket("/v1/stream")
+async def stream_audio(websocket: WebSocket):
+    """
+    Live recording in, transcripts and story out
+
+    Client messages:
+        {"type": "start", "sample_rate": 16000, "encoding": "pcm_s16le", "style": "friendly", "book_id": null}
+        binary frames of mono PCM audio
+        {"type": "stop"}
+
+    Server messages:
+        {"type": "ready"}
+        {"type": "partial", "text", "transcript"} while the current phrase is spoken
+        {"type": "final", "text", "transcript"} once a phrase is committed
+        {"type": "transcript", "text"} after stop
+        {"type": "story_delta", "text"} as Claude writes
+        {"type": "story", "story", "formatted", "story_id"} at the end
+        {"type": "error", "detail"}
+    """
+    # numpy comes with the transcriber; loaded here so plain HTTP workers start faster
+    from streaming_transcriber import ENCODINGS, StreamingTranscriber
+
+    await websocket.accept()
+    try:
+        start = await websocket.receive_json()
+        style = start.get("style", "friendly")
+        encoding = start.get("encoding", "pcm_s16le")
+        sample_rate = int(start.get("sample_rate", 16000))
+        book_id = start.get("book_id")
+        if start.get("type") != "start" or style not in STORY_STYLES or encoding not in ENCODINGS or sample_rate <= 0:
+            raise ValueError(f"Expected a start message with a style in {STORY_STYLES} "
+                             f"and an encoding in {sorted(ENCODINGS)}")
+        get_job_executor().check_capacity(transcription=True)
+    except (ValueError, KeyError, TypeError) as e:
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        await websocket.close(code=1003)
+        return
+    except ServerBusy as e:
+        await websocket.send_json({"type": "error", "detail": str(e), "retry_after": e.retry_after})
+        await websocket.close(code=1013)
+        return
+
+    executor = get_job_executor()
+    transcriber = StreamingTranscriber()
+    audio_arrived = asyncio.Event()
+    stopping = False
+    story_job: Optional[Job] = None
+
+    async def transcribe_loop():
+        # One Whisper call at a time per stream; audio keeps arriving meanwhile,
+        # so a slow machine simply sends fewer partial transcripts
+        while True:
+            await audio_arrived.wait()
+            audio_arrived.clear()
+            request = transcriber.pending(final=stopping)
+            while request is not None:
+                text = await asyncio.wrap_future(
+                    executor.transcribe_samples(request.samples, STREAM_MODEL_SIZE, request.prompt)
+                )
+                await websocket.send_json(transcriber.complete(request, text))
+                request = transcriber.pending(final=stopping)
+            if stopping:
+                return
+
+    transcribing = asyncio.create_task(transcribe_loop())
+    await websocket.send_json({"type": "ready"})
+    try:
+        while not stopping:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("bytes"):
+                transcriber.add_pcm(message["bytes"], encoding, sample_rate)
+                if transcriber.seconds_received > MAX_STREAM_SECONDS:
+                    stopping = True
+                audio_arrived.set()
+            elif message.get("text"):
+                try:
+                    control = json.loads(message["text"])
+                except ValueError:
+                    control = {}
+                if isinstance(control, dict) and control.get("type") == "stop":
+                    stopping = True
+                    audio_arrived.set()
+
+        await transcribing
+        transcript = transcriber.transcript
+        await websocket.send_json({"type": "transcript", "text": transcript})
+        if not transcript:
+            await websocket.send_json({"type": "error", "detail": "No speech was recognized"})
+            await websocket.close()
+            return
+
+        # Relay Claude's text to the client as it arrives
+        loop = asyncio.get_running_loop()
+        deltas: asyncio.Queue = asyncio.Queue()
+        story_job = executor.get(executor.submit_story(
+            _translator(), transcript, style, StorybookFormatter().story_templates,
+            meta={"original": transcript}, priority=True,
+            on_delta=lambda delta: loop.call_soon_threadsafe(deltas.put_nowait, delta)
+        ))
+        if book_id:
+            story_job.add_done_callback(lambda finished: _save_to_book(finished, book_id, style))
+        story_job.add_done_callback(lambda finished: loop.call_soon_threadsafe(deltas.put_nowait, None))
+
+        delta = await deltas.get()
+        while delta is not None:
+            await websocket.send_json({"type": "story_delta", "text": delta})
+            delta = await deltas.get()
+
+        if story_job.status == "done":
+            await websocket.send_json({"type": "story", **story_job.result,
+                                       "story_id": story_job.meta.get("story_id")})
+        else:
+            await websocket.send_json({"type": "error", "detail": story_job.error or story_job.status})
+        await websocket.close()
+    except WebSocketDisconnect:
+        transcribing.cancel()
+        if story_job is not None:
+            executor.cancel(story_job.id)
+    except Exception as e:
+        transcribing.cancel()
+        await websocket.send_json({"type": "error", "detail": str(e)})
+        await websocket.close(code=1011)
+
+
+# Handlers that query SQLite are plain functions, which FastAPI runs on its
+# thread pool instead of the event loop
+
+@app.get("/v1/books/{book_id}/stories")
+def list_stories(book_id: str, page: int = Query(0, ge=0),
+                 page_size: int = Query(HISTORY_PAGE_SIZE, ge=1, le=100),
+                 search: Optional[str] = None):
+    """One page of story summaries from a collection, newest first"""
+    store = get_shared_store()
+    return {
+        "book_id": book_id,
+        "total": store.count(book_id, search),
+        "page": page,
+        "stories": store.page(book_id, page, page_size, search=search),
+    }
+
+
+@app.get("/v1/books/{book_id}/stories/{story_id}")
+def get_story(book_id: str, story_id: int):
+    """One full story; only found through the collection it belongs to"""
+    story = get_shared_store().get(story_id)
+    if story is None or story["book"] != book_id:
+        raise HTTPException(status_code=404, detail="Unknown story")
+    return story
+
+
+def _export_response(stories: Iterable[str], fmt: str, style: str, title: Optional[str], name: str):
+    if fmt == "md":
+        chunks = ChapterBookWriter(stories).iter_bytes()
+        mime = "text/markdown"
+    elif fmt in EXPORT_FORMATS:
+        chunks = get_shared_exporter().export(stories, fmt, style, title or BOOK_TITLE)
+        mime = EXPORT_FORMATS[fmt]["mime"]
+    else:
+        raise HTTPException(status_code=422, detail=f"Unknown format {fmt!r}")
+    return StreamingResponse(
+        chunks,
+        media_type=mime,
+        headers={"Content-Disposition": f'attachment; filename="{name}.{fmt}"'}
+    )
+
+
+@app.post("/v1/export")
+async def export_stories(request: ExportRequest):
+    """Build a book from the given stories; the file is streamed as it is produced"""
+    _check_style(request.style)
+    if not request.stories:
+        raise HTTPException(status_code=422, detail="No stories to export")
+    if request.format == "pdf" and not all(pdf_supported(story) for story in request.stories):
+        raise HTTPException(status_code=422, detail=PDF_UNSUPPORTED)
+    return _export_response(request.stories, request.format, request.style, request.title, "storybook")
+
+
+@app.get("/v1/books/{book_id}/export")
+def export_book(book_id: str, format: str = "html", style: str = "friendly"):
+    """Build a book from every story in a collection"""
+    _check_style(style)
+    store = get_shared_store()
+    if not store.count(book_id):
+        raise HTTPException(status_code=404, detail="This collection has no stories")
+    if format == "pdf" and not store.languages(book_id) <= PDF_LANGUAGES:
+        raise HTTPException(status_code=422, detail=PDF_UNSUPPORTED)
+    # Stories are read from the store in batches as the response is streamed
+    return _export_response(store.iter_stories(book_id), format, style, None, f"storybook_{book_id}")
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the storybook pipeline over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Clean up microphone audio before Whisper sees it.
+
+Clinic recordings tend to be quiet, with fan or HVAC hiss, mains hum and a
+DC offset from cheap microphones. Whisper copes badly with that: quiet or
+noisy segments fail its log-probability checks and are decoded again at
+higher temperatures, and stretches of pure noise come back as invented text.
+
+AudioPreprocessor runs block by block while recording, all in NumPy:
+
+    high-pass   removes DC and rumble below ~80 Hz (a gain ramp in the STFT)
+    gating      spectral gating against a per-frequency noise floor that is
+                tracked continuously, so no separate noise sample is needed
+    level       RMS normalization of speech to a fixed level, with a gain
+                that moves smoothly between blocks and a peak limiter
+
+The STFT uses square-root Hann windows at 50% overlap, so unmodified audio
+comes back sample for sample. Output lags input by one hop (12-21 ms);
+flush() returns the held-back tail so the total length matches the input.
+"""
+import os
+from typing import Optional
+
+import numpy as np
+
+# STFT frame length; a power of two near this many seconds
+FRAME_SECONDS = 0.032
+HIGH_PASS_HZ = 80.0
+# Width of the high-pass gain ramp, centred on HIGH_PASS_HZ
+HIGH_PASS_RAMP_HZ = 40.0
+
+# A bin passes when it is this many times above the noise floor. The floor
+# follows the quietest blocks, so it sits below the average noise level
+GATE_THRESHOLD = 3.0
+# Gain applied to gated bins (-12 dB); a floor avoids "musical noise"
+GATE_FLOOR = 0.25
+# How fast the noise floor may rise during long stretches of sound
+NOISE_RISE_DB_PER_SECOND = 3.0
+
+TARGET_RMS = 10 ** (-20 / 20)
+MAX_GAIN = 10 ** (24 / 20)
+MIN_GAIN = 10 ** (-12 / 20)
+# Blocks quieter than this after gating are not speech and leave the gain alone
+SPEECH_RMS = 10 ** (-50 / 20)
+# Share of the way the gain moves to its new target per block
+GAIN_ATTACK = 0.5     # getting quieter (avoid clipping loud speech)
+GAIN_RELEASE = 0.1    # getting louder (don't pump up breaths and pauses)
+PEAK_LIMIT = 0.99
+
+PREPROCESSING_ENABLED = os.getenv("AUDIO_PREPROCESSING", "1") != "0"
+
+
+def frame_length(sample_rate: int) -> int:
+    """STFT frame length for a sample rate: 512 at 16 kHz, 1024 at 44.1 kHz, 2048 at 48 kHz"""
+    return 1 << int(round(np.log2(FRAME_SECONDS * sample_rate)))
+
+
+class AudioPreprocessor:
+    def __init__(self, sample_rate: int = 16000, high_pass: bool = True, denoise: bool = True,
+                 normalize: bool = True):
+        """
+        Streaming high-pass, noise suppression and level normalization
+
+        Feed blocks of any size to process() in order, then call flush() once
+        at the end. Multi-channel input is mixed down to mono.
+
+        Args:
+            sample_rate: Sample rate of the audio
+            high_pass: Remove DC and low-frequency rumble
+            denoise: Apply spectral gating
+            normalize: Bring speech to a steady RMS level
+        """
+        self.sample_rate = sample_rate
+        self.high_pass = high_pass
+        self.denoise = denoise
+        self.normalize = normalize
+        self.n_fft = frame_length(sample_rate)
+        self.hop = self.n_fft // 2
+        # Periodic sqrt-Hann: squared windows at 50% overlap sum to exactly one
+        self.window = np.sqrt(np.hanning(self.n_fft + 1)[:-1]).astype(np.float32)
+
+        freqs = np.fft.rfftfreq(self.n_fft, 1 / sample_rate)
+        ramp = np.clip((freqs - (HIGH_PASS_HZ - HIGH_PASS_RAMP_HZ / 2)) / HIGH_PASS_RAMP_HZ, 0.0, 1.0)
+        self.high_pass_gain = (0.5 - 0.5 * np.cos(np.pi * ramp)).astype(np.float32)
+        self.high_pass_gain[0] = 0.0
+
+        self.noise_rise_per_hop = 10 ** (NOISE_RISE_DB_PER_SECOND * self.hop / sample_rate / 20)
+        self.reset()
+
+    def reset(self):
+        """Forget all state, ready for a new recording"""
+        self._pending = np.zeros(self.n_fft - self.hop, dtype=np.float32)
+        self._overlap = np.zeros(self.n_fft - self.hop, dtype=np.float32)
+        self._previous_gain: Optional[np.ndarray] = None
+        self.noise_floor: Optional[np.ndarray] = None
+        self.gain = 1.0
+        self._heard_speech = False
+        self._samples_in = 0
+        self._samples_out = 0
+        # The first hop of output is the zero padding in front of the audio
+        self._skip = self.n_fft - self.hop
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """
+        Clean one block of audio
+
+        Args:
+            block: float samples, shape (n,) or (n, channels)
+
+        Returns:
+            float32 mono samples, shaped like the input with one channel. The
+            count can differ from the input by up to one hop because of the
+            STFT latency
+        """
+        samples = np.asarray(block, dtype=np.float32)
+        two_dimensional = samples.ndim == 2
+        if two_dimensional:
+            samples = samples.mean(axis=1)
+        self._samples_in += len(samples)
+        output = self._run(samples)
+        return output.reshape(-1, 1) if two_dimensional else output
+
+    def flush(self, channels: int = 1) -> np.ndarray:
+        """
+        The audio still held back at the end of a recording
+
+        Args:
+            channels: 1 for (n, 1) output like process() on 2-D blocks, 0 for (n,)
+        """
+        output = self._run(np.zeros(self.n_fft, dtype=np.float32))
+        output = output[:max(0, self._samples_in - self._samples_out + len(output))]
+        self._samples_out = self._samples_in
+        return output.reshape(-1, 1) if channels else output
+
+    def _run(self, samples: np.ndarray) -> np.ndarray:
+        buffer = np.concatenate((self._pending, samples))
+        frame_count = (len(buffer) - self.n_fft) // self.hop + 1 if len(buffer) >= self.n_fft else 0
+        if frame_count == 0:
+            self._pending = buffer
+            return np.zeros(0, dtype=np.float32)
+
+        frames = np.lib.stride_tricks.sliding_window_view(buffer, self.n_fft)[::self.hop][:frame_count]
+        self._pending = buffer[frame_count * self.hop:]
+
+        frames = frames * self.window
+        if self.high_pass or self.denoise:
+            spectrum = np.fft.rfft(frames, axis=1)
+            gain = np.ones(spectrum.shape, dtype=np.float32)
+            if self.high_pass:
+                gain *= self.high_pass_gain
+            if self.denoise:
+                gain *= self._gate(np.abs(spectrum))
+            frames = np.fft.irfft(spectrum * gain, n=self.n_fft, axis=1).astype(np.float32)
+        frames = frames * self.window
+
+        # Overlap-add: each frame's first half completes the previous frame's second half
+        first, second = frames[:, :self.hop], frames[:, self.hop:]
+        carried = np.vstack((self._overlap[np.newaxis], second[:-1]))
+        output = (first + carried).reshape(-1)
+        self._overlap = second[-1].copy()
+
+        if self._skip:
+            skipped = min(self._skip, len(output))
+            output = output[skipped:]
+            self._skip -= skipped
+        self._samples_out += len(output)
+        if self.normalize and len(output):
+            output = self._level(output)
+        return output
+
+    def _gate(self, magnitude: np.ndarray) -> np.ndarray:
+        """Per-bin gains for a block of frames, from the noise floor before the block"""
+        # Averaging a block's frames steadies the estimate against single quiet frames
+        level = magnitude.mean(axis=0)
+        if self.noise_floor is None:
+            self.noise_floor = level
+
+        # Soft gate: full gain well above the threshold, GATE_FLOOR at or below it
+        threshold = self.noise_floor * GATE_THRESHOLD
+        excess = np.clip((magnitude - threshold) / (magnitude + 1e-9), 0.0, 1.0)
+        gain = GATE_FLOOR + (1.0 - GATE_FLOOR) * np.sqrt(excess)
+        # Smooth across neighbouring bins and frames so gated noise doesn't warble
+        gain[:, 1:-1] = (gain[:, :-2] + 2 * gain[:, 1:-1] + gain[:, 2:]) / 4
+        previous = gain[-1].copy()
+        if self._previous_gain is not None:
+            gain = (gain + np.vstack((self._previous_gain[np.newaxis], gain[:-1]))) / 2
+        self._previous_gain = previous
+
+        # Minimum tracking: drops straight to quieter blocks, creeps up during sound
+        self.noise_floor = np.minimum(level, self.noise_floor * self.noise_rise_per_hop ** len(magnitude))
+        return gain.astype(np.float32)
+
+    def _level(self, samples: np.ndarray) -> np.ndarray:
+        """Apply the smoothed speech gain, ramped across the block, under a peak limit"""
+        rms = float(np.sqrt(np.mean(samples * samples)))
+        target = self.gain
+        if rms > SPEECH_RMS:
+            wanted = min(MAX_GAIN, max(MIN_GAIN, TARGET_RMS / rms))
+            if not self._heard_speech:
+                # The first speech sets the level outright instead of fading up over seconds
+                rate = 1.0
+                self._heard_speech = True
+            else:
+                rate = GAIN_ATTACK if wanted < self.gain else GAIN_RELEASE
+            target = self.gain + (wanted - self.gain) * rate
+
+        ramp = np.linspace(self.gain, target, len(samples), dtype=np.float32)
+        self.gain = target
+        # Per-sample limiting instead of clipping: only the loudest peaks are turned down
+        peaks = np.abs(samples) * ramp
+        ramp = np.where(peaks > PEAK_LIMIT, PEAK_LIMIT / np.maximum(np.abs(samples), 1e-9), ramp)
+        return (samples * ramp).astype(np.float32)
+
+
+def preprocess(samples: np.ndarray, sample_rate: int = 16000, block_seconds: float = 0.1,
+               **options) -> np.ndarray:
+    """
+    Clean a whole recording the same way the recorder does while capturing
+
+    Args:
+        samples: float samples, shape (n,) or (n, channels)
+        sample_rate: Sample rate of the audio
+        block_seconds: Block size to feed through, as the recorder would
+        **options: high_pass, denoise and normalize, see AudioPreprocessor
+
+    Returns:
+        float32 mono samples, the same length as the input, shaped (n,) or (n, 1)
+    """
+    preprocessor = AudioPreprocessor(sample_rate, **options)
+    samples = np.asarray(samples, dtype=np.float32)
+    block = max(1, int(block_seconds * sample_rate))
+    pieces = [preprocessor.process(samples[start:start + block]) for start in range(0, len(samples), block)]
+    pieces.append(preprocessor.flush(channels=1 if samples.ndim == 2 else 0))
+    return np.concatenate(pieces)
@@ -5,17 +5,30 @@ import tempfile
 import os
 from typing import Optional
 
+from audio_preprocessing import PREPROCESSING_ENABLED, AudioPreprocessor
+from instrumentation import count_audio, span
+
 class AudioRecorder:
-    def __init__(self, sample_rate: int = 44100, channels: int = 1):
+    def __init__(self, sample_rate: int = 44100, channels: int = 1, preprocess: bool = PREPROCESSING_ENABLED):
+        """
+        Args:
+            sample_rate: Capture sample rate
+            channels: Capture channels; cleaned-up recordings are saved as mono
+            preprocess: Clean each chunk as it arrives (high-pass, noise
+                suppression, level), see audio_preprocessing.py
+        """
         self.sample_rate = sample_rate
         self.channels = channels
         self.recording = False
         self.audio_data = []
+        self.preprocessor = AudioPreprocessor(sample_rate) if preprocess else None
         
     def start_recording(self):
         """Start recording audio from the microphone"""
         self.recording = True
         self.audio_data = []
+        if self.preprocessor:
+            self.preprocessor.reset()
         
     def stop_recording(self) -> Optional[str]:
         """Stop recording and save to temporary file"""
@@ -24,17 +37,25 @@ class AudioRecorder:
         if not self.audio_data:
             return None
             
-        # Convert list to numpy array
-        audio_array = np.concatenate(self.audio_data, axis=0)
-        
-        # Create temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
-        temp_filename = temp_file.name
-        temp_file.close()
-        
-        # Save audio to file
-        sf.write(temp_filename, audio_array, self.sample_rate)
+        with span("stop_recording") as stage:
+            if self.preprocessor:
+                # The last few milliseconds are still inside the preprocessor
+                self.audio_data.append(self.preprocessor.flush())
+            
+            # Convert list to numpy array
+            audio_array = np.concatenate(self.audio_data, axis=0)
+            audio_seconds = len(audio_array) / self.sample_rate
+            stage.set(audio_seconds=audio_seconds)
+            
+            # Create temporary file
+            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
+            temp_filename = temp_file.name
+            temp_file.close()
+            
+            # Save audio to file
+            sf.write(temp_filename, audio_array, self.sample_rate)
         
+        count_audio("stop_recording", audio_seconds)
         return temp_filename
         
     def record_chunk(self, duration: float = 0.1):
@@ -48,6 +69,9 @@ class AudioRecorder:
                     dtype=np.float32
                 )
                 sd.wait()
+                if self.preprocessor:
+                    with span("preprocess_chunk"):
+                        chunk = self.preprocessor.process(chunk)
                 self.audio_data.append(chunk)
             except Exception as e:
                 print(f"Error recording audio chunk: {e}")
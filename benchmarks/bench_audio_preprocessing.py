@@ -0,0 +1,259 @@
+"""
+Cost and benefit of cleaning up recordings before Whisper.
+
+Each clip is degraded the way a clinic microphone degrades speech: turned
+down to a quiet level, given a DC offset and mains hum, and buried in
+low-pass-tinted hiss at --snr dB. The benchmark then measures:
+
+    cpu       AudioPreprocessor.process() per 0.1 s block at 16 kHz and at
+              the recorder's 44.1 kHz, as latency and real-time factor
+    quality   SI-SDR of the noisy and the filtered (high-pass and gating)
+              clip against the clean one, and the normalized output level
+    whisper   decode time, fallback decodes (segments Whisper had to retry
+              at a higher temperature) and word error rate, noisy vs cleaned
+
+The clips are the medical notes from bench_pipeline.py spoken by espeak-ng
+when it is installed (see narration.py), otherwise synthetic speech-like
+audio. The whisper stage needs Whisper and espeak-ng, since word error rate
+means nothing on synthetic audio; it is skipped without them.
+
+Exits with status 1 when preprocessing runs slower than --max-rtf times real
+time or fails to raise SI-SDR.
+
+Usage:
+    python benchmarks/bench_audio_preprocessing.py
+    python benchmarks/bench_audio_preprocessing.py --snr 5 --models tiny base --json preprocessing.json
+"""
+import argparse
+import io
+import json
+import os
+import random
+import re
+import sys
+import time
+import wave
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from audio_preprocessing import AudioPreprocessor, preprocess
+from bench_pipeline import MEDICAL_TEXTS, percentile, synthetic_speech
+from streaming_transcriber import WHISPER_SAMPLE_RATE, decode_pcm
+
+RECORDER_SAMPLE_RATE = 44100
+BLOCK_SECONDS = 0.1
+QUIET_RMS = 10 ** (-38 / 20)
+DC_OFFSET = 0.01
+HUM_HZ = 60.0
+
+
+def spoken_clips() -> Optional[List[Tuple[np.ndarray, str]]]:
+    """The medical notes read by espeak-ng at 16 kHz, with their text; None without espeak"""
+    from narration import Narrator
+
+    narrator = Narrator(cache_dir=None)
+    if narrator.engine not in ("espeak-ng", "espeak"):
+        return None
+    clips = []
+    for text in MEDICAL_TEXTS:
+        data = narrator._synthesize(text, "en-us")
+        with wave.open(io.BytesIO(data), "rb") as f:
+            rate = f.getframerate()
+            frames = f.readframes(f.getnframes())
+        clips.append((decode_pcm(frames, "pcm_s16le", rate), text))
+    narrator.shutdown()
+    return clips
+
+
+def synthetic_clips(seconds: float, count: int, seed: int, sample_rate: int = WHISPER_SAMPLE_RATE) -> List[np.ndarray]:
+    clips = []
+    for i in range(count):
+        samples = np.asarray(synthetic_speech(seconds, random.Random(seed + i)), dtype=np.float32)
+        if sample_rate != WHISPER_SAMPLE_RATE:
+            positions = np.linspace(0, len(samples) - 1, num=int(len(samples) * sample_rate / WHISPER_SAMPLE_RATE))
+            samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+        clips.append(samples)
+    return clips
+
+
+def degrade(clean: np.ndarray, snr_db: float, sample_rate: int, rng: np.random.Generator) -> np.ndarray:
+    """A quiet, hummy, hissy version of a clip"""
+    speech = clean / max(float(np.sqrt(np.mean(clean ** 2))), 1e-9) * QUIET_RMS
+    # White noise through a one-pole low-pass, closer to fan noise than pure hiss
+    white = rng.standard_normal(len(clean)).astype(np.float32)
+    hiss = np.fft.irfft(np.fft.rfft(white) / np.sqrt(1 + (np.fft.rfftfreq(len(white), 1 / sample_rate) / 2000) ** 2),
+                        n=len(white))
+    hiss *= QUIET_RMS / 10 ** (snr_db / 20) / max(float(np.sqrt(np.mean(hiss ** 2))), 1e-9)
+    t = np.arange(len(clean)) / sample_rate
+    hum = 0.3 * QUIET_RMS * np.sin(2 * np.pi * HUM_HZ * t)
+    return (speech + hiss + hum + DC_OFFSET).astype(np.float32)
+
+
+def si_sdr(estimate: np.ndarray, reference: np.ndarray) -> float:
+    """Scale-invariant signal-to-distortion ratio in dB"""
+    estimate = estimate - estimate.mean()
+    reference = reference - reference.mean()
+    target = reference * (np.dot(estimate, reference) / max(float(np.dot(reference, reference)), 1e-12))
+    distortion = estimate - target
+    return 10 * np.log10(max(float(np.dot(target, target)), 1e-12) / max(float(np.dot(distortion, distortion)), 1e-12))
+
+
+def word_error_rate(hypothesis: str, reference: str) -> float:
+    """Word-level edit distance over the reference length"""
+    def words(text: str) -> List[str]:
+        return re.sub(r"[^\w\s]", " ", text.lower()).split()
+
+    hyp, ref = words(hypothesis), words(reference)
+    row = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        previous, row[0] = row[0], i
+        for j, hyp_word in enumerate(hyp, 1):
+            previous, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, previous + (ref_word != hyp_word))
+    return row[-1] / max(1, len(ref))
+
+
+def bench_cpu(sample_rate: int, seconds: float, snr_db: float, seed: int) -> Dict:
+    clean = synthetic_clips(seconds, 1, seed, sample_rate)[0]
+    noisy = degrade(clean, snr_db, sample_rate, np.random.default_rng(seed))
+    block = int(BLOCK_SECONDS * sample_rate)
+    blocks = [noisy[i:i + block].reshape(-1, 1) for i in range(0, len(noisy), block)]
+
+    preprocessor = AudioPreprocessor(sample_rate)
+    for piece in blocks[:5]:
+        preprocessor.process(piece)
+    preprocessor.reset()
+
+    latencies = []
+    for piece in blocks:
+        started = time.perf_counter()
+        preprocessor.process(piece)
+        latencies.append(time.perf_counter() - started)
+    preprocessor.flush()
+    return {
+        "sample_rate": sample_rate,
+        "frame": preprocessor.n_fft,
+        "block_p50_ms": percentile(latencies, 50) * 1000,
+        "block_p95_ms": percentile(latencies, 95) * 1000,
+        "realtime_factor": sum(latencies) / seconds,
+    }
+
+
+def bench_quality(clips: List[np.ndarray], snr_db: float, seed: int) -> Dict:
+    rng = np.random.default_rng(seed)
+    before, after, levels = [], [], []
+    for clean in clips:
+        noisy = degrade(clean, snr_db, WHISPER_SAMPLE_RATE, rng)
+        # SI-SDR would count the level normalization's slow gain changes as distortion
+        filtered = preprocess(noisy, WHISPER_SAMPLE_RATE, BLOCK_SECONDS, normalize=False)
+        cleaned = preprocess(noisy, WHISPER_SAMPLE_RATE, BLOCK_SECONDS)
+        before.append(si_sdr(noisy, clean))
+        after.append(si_sdr(filtered, clean))
+        levels.append(20 * np.log10(max(float(np.sqrt(np.mean(cleaned ** 2))), 1e-9)))
+    return {
+        "si_sdr_noisy_db": float(np.mean(before)),
+        "si_sdr_cleaned_db": float(np.mean(after)),
+        "si_sdr_gain_db": float(np.mean(after) - np.mean(before)),
+        "input_rms_dbfs": 20 * np.log10(QUIET_RMS),
+        "output_rms_dbfs": float(np.mean(levels)),
+    }
+
+
+def bench_whisper(clips: List[Tuple[np.ndarray, str]], snr_db: float, seed: int, model_size: str) -> Dict:
+    import whisper
+
+    model = whisper.load_model(model_size)
+    rng = np.random.default_rng(seed)
+    results = {"noisy": {"seconds": 0.0, "fallbacks": 0, "wer": []},
+               "cleaned": {"seconds": 0.0, "fallbacks": 0, "wer": []}}
+    for clean, text in clips:
+        noisy = degrade(clean, snr_db, WHISPER_SAMPLE_RATE, rng)
+        versions = {"noisy": noisy, "cleaned": preprocess(noisy, WHISPER_SAMPLE_RATE, BLOCK_SECONDS)}
+        for name, samples in versions.items():
+            started = time.perf_counter()
+            result = model.transcribe(samples, fp16=False)
+            results[name]["seconds"] += time.perf_counter() - started
+            results[name]["fallbacks"] += sum(1 for segment in result["segments"] if segment.get("temperature", 0) > 0)
+            results[name]["wer"].append(word_error_rate(result["text"], text))
+
+    audio_seconds = sum(len(clean) for clean, _ in clips) / WHISPER_SAMPLE_RATE
+    summary = {}
+    for name, result in results.items():
+        summary[name] = {
+            "decode_seconds": result["seconds"],
+            "realtime_factor": result["seconds"] / audio_seconds,
+            "fallback_segments": result["fallbacks"],
+            "wer": float(np.mean(result["wer"])),
+        }
+    summary["decode_time_change"] = summary["cleaned"]["decode_seconds"] / summary["noisy"]["decode_seconds"] - 1
+    return summary
+
+
+def print_report(report: Dict):
+    print(f"\n{'rate':>7} {'frame':>6} {'block p50 ms':>13} {'block p95 ms':>13} {'x real time':>12}")
+    for row in report["cpu"]:
+        print(f"{row['sample_rate']:>7} {row['frame']:>6} {row['block_p50_ms']:>13.3f} "
+              f"{row['block_p95_ms']:>13.3f} {row['realtime_factor']:>12.4f}")
+
+    quality = report["quality"]
+    print(f"\nSI-SDR {quality['si_sdr_noisy_db']:.1f} dB -> {quality['si_sdr_cleaned_db']:.1f} dB "
+          f"({quality['si_sdr_gain_db']:+.1f} dB) on {report['source']} speech at {report['snr_db']:g} dB SNR; "
+          f"level {quality['input_rms_dbfs']:.0f} -> {quality['output_rms_dbfs']:.0f} dBFS")
+
+    for model_size, result in report["whisper"].items():
+        if "skipped" in result:
+            print(f"whisper {model_size}: skipped: {result['skipped']}")
+            continue
+        noisy, cleaned = result["noisy"], result["cleaned"]
+        print(f"whisper {model_size}: decode {noisy['decode_seconds']:.1f}s -> {cleaned['decode_seconds']:.1f}s "
+              f"({result['decode_time_change']:+.0%}), fallback segments {noisy['fallback_segments']} -> "
+              f"{cleaned['fallback_segments']}, WER {noisy['wer']:.1%} -> {cleaned['wer']:.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU cost and transcription benefit of audio preprocessing")
+    parser.add_argument("--snr", type=float, default=10.0, help="Speech-to-noise ratio of the degraded clips, in dB")
+    parser.add_argument("--seconds", type=float, default=20.0, help="Length of the clip used for CPU timing")
+    parser.add_argument("--models", nargs="+", default=["tiny", "base"], help="Whisper model sizes")
+    parser.add_argument("--max-rtf", type=float, default=0.05, help="Slowest acceptable preprocessing, x real time")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    spoken = spoken_clips()
+    clips = [clean for clean, _ in spoken] if spoken else synthetic_clips(8.0, len(MEDICAL_TEXTS), args.seed)
+    report = {
+        "snr_db": args.snr,
+        "source": "espeak-ng" if spoken else "synthetic",
+        "cpu": [bench_cpu(rate, args.seconds, args.snr, args.seed)
+                for rate in (WHISPER_SAMPLE_RATE, RECORDER_SAMPLE_RATE)],
+        "quality": bench_quality(clips, args.snr, args.seed),
+        "whisper": {},
+    }
+    for model_size in args.models:
+        if spoken is None:
+            report["whisper"][model_size] = {"skipped": "espeak-ng is needed for clips with a known transcript"}
+            continue
+        try:
+            report["whisper"][model_size] = bench_whisper(spoken, args.snr, args.seed, model_size)
+        except ImportError as e:
+            report["whisper"][model_size] = {"skipped": str(e)}
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    failures = [f"{row['sample_rate']} Hz runs at {row['realtime_factor']:.3f}x real time"
+                for row in report["cpu"] if row["realtime_factor"] > args.max_rtf]
+    if report["quality"]["si_sdr_gain_db"] <= 0:
+        failures.append(f"SI-SDR changed by {report['quality']['si_sdr_gain_db']:+.1f} dB")
+    if failures:
+        print(f"\nChecks failed: {'; '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Glossary scan time against glossary size.
+
+The bundled glossary is padded with synthetic entries to each size, and the
+build and scan times are measured at each one.
+
+Usage:
+    python benchmarks/bench_glossary.py --sizes 100 1000 10000 50000 --words 5000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from medical_glossary import DEFAULT_GLOSSARY_PATH, MedicalGlossary, load_glossary_file
+
+FILLER_WORDS = ("the doctor said your child should rest and drink water then come back "
+                "if the fever lasts more than three days we will check again next week").split()
+
+
+def synthetic_entries(count: int, rng: random.Random):
+    """Pseudo drug names and multi-word terms to pad the real glossary"""
+    syllables = ["ab", "ce", "dox", "fen", "ga", "lin", "mo", "ni", "pro", "qua", "rix", "sto", "tan", "vu", "zol"]
+    entries = []
+    for i in range(count):
+        word = ''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) + str(i)
+        if rng.random() < 0.3:
+            word += " " + rng.choice(["syndrome", "disease", "tablets", "drops", "test"])
+        entries.append({"term": word, "definition": "Synthetic benchmark entry.", "aliases": []})
+    return entries
+
+
+def synthetic_transcript(words: int, real_terms, rng: random.Random) -> str:
+    tokens = []
+    for _ in range(words):
+        if rng.random() < 0.05:
+            tokens.append(rng.choice(real_terms))
+        else:
+            tokens.append(rng.choice(FILLER_WORDS))
+    return ' '.join(tokens)
+
+
+def run(sizes, words: int, repeats: int, seed: int):
+    rng = random.Random(seed)
+    real_entries = load_glossary_file(DEFAULT_GLOSSARY_PATH)
+    transcript = synthetic_transcript(words, [e["term"] for e in real_entries], rng)
+
+    results = []
+    for size in sizes:
+        entries = real_entries + synthetic_entries(max(0, size - len(real_entries)), rng)
+
+        start = time.perf_counter()
+        glossary = MedicalGlossary(entries=entries)
+        build_seconds = time.perf_counter() - start
+
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            found = glossary.find_terms(transcript)
+            timings.append(time.perf_counter() - start)
+
+        results.append({
+            "glossary_entries": len(entries),
+            "patterns": len(glossary.matcher),
+            "build_ms": build_seconds * 1000,
+            "scan_ms_median": statistics.median(timings) * 1000,
+            "scan_chars_per_ms": len(transcript) / (statistics.median(timings) * 1000),
+            "terms_found": len(found),
+        })
+    return {"transcript_chars": len(transcript), "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark glossary scan time against glossary size")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[130, 1000, 5000, 20000, 50000])
+    parser.add_argument("--words", type=int, default=5000, help="Transcript length in words")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write results to this file")
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.words, args.repeats, args.seed)
+
+    print(f"Transcript: {report['transcript_chars']} characters")
+    print(f"{'entries':>10} {'patterns':>10} {'build ms':>10} {'scan ms':>10} {'chars/ms':>10} {'found':>6}")
+    for row in report["results"]:
+        print(f"{row['glossary_entries']:>10} {row['patterns']:>10} {row['build_ms']:>10.1f} "
+              f"{row['scan_ms_median']:>10.2f} {row['scan_chars_per_ms']:>10.0f} {row['terms_found']:>6}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
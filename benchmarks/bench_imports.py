@@ -0,0 +1,173 @@
+"""
+Import-time report for every entry point, checked against a fixed budget.
+
+Each entry point is imported in a fresh interpreter under `python -X
+importtime` and the import tree is parsed. Time spent inside the web
+framework (Streamlit, FastAPI, uvicorn) is reported but left out of the
+budget, since nothing here can make it smaller; the rest is the repo's own
+startup cost. Heavy modules that should only load on first use (Whisper,
+torch, PortAudio, the Anthropic SDK, python-dotenv) are flagged if they
+show up at startup at all.
+
+Entry points whose own dependencies are missing are reported as skipped.
+Exits with status 1 when an entry point is over budget or loads a deferred
+module.
+
+Usage:
+    python benchmarks/bench_imports.py
+    python benchmarks/bench_imports.py --budget-ms 150 --runs 7 --json imports.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, NamedTuple, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = ["simple_main", "streamlit_app", "main", "kid_friendly_main", "api_server", "pipeline"]
+
+# Packages whose import time is reported but not counted against the budget
+FRAMEWORKS = {"streamlit", "fastapi", "starlette", "pydantic", "pydantic_core", "uvicorn"}
+
+# Must not be imported until the feature that needs them is used
+DEFERRED = {"whisper", "torch", "sounddevice", "soundfile", "anthropic", "dotenv"}
+DEFERRED_BY_ENTRY = {"api_server": DEFERRED | {"numpy"}, "pipeline": DEFERRED | {"numpy"}}
+
+TOP_IMPORTS = 5
+
+
+class ImportLine(NamedTuple):
+    self_us: int
+    cumulative_us: int
+    depth: int
+    name: str
+
+
+def parse_importtime(output: str) -> List[ImportLine]:
+    """Lines of `-X importtime` output, in the order printed (children before parents)"""
+    lines = []
+    for raw in output.splitlines():
+        if not raw.startswith("import time:"):
+            continue
+        parts = raw[len("import time:"):].split("|", 2)
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # The header line
+        label = parts[2][1:]
+        name = label.lstrip(" ")
+        lines.append(ImportLine(int(parts[0]), int(parts[1]), (len(label) - len(name)) // 2, name))
+    return lines
+
+
+def _package(name: str) -> str:
+    return name.split(".", 1)[0]
+
+
+def analyze(module: str, lines: List[ImportLine]) -> Optional[Dict]:
+    """
+    Split one entry point's import time into framework and own time
+
+    Returns:
+        Times in milliseconds, the slowest direct imports and every deferred
+        module that was loaded, or None if the module itself never finished
+    """
+    entry = next((line for line in reversed(lines) if line.name == module), None)
+    if entry is None:
+        return None
+
+    # Walking the output backwards visits each parent before its children
+    ancestors: List[ImportLine] = []
+    framework_us = 0
+    children = []
+    for line in reversed(lines):
+        while ancestors and ancestors[-1].depth >= line.depth:
+            ancestors.pop()
+        in_framework = any(_package(a.name) in FRAMEWORKS for a in ancestors)
+        if _package(line.name) in FRAMEWORKS and not in_framework:
+            framework_us += line.cumulative_us
+        elif ancestors and ancestors[-1] is entry and not in_framework:
+            children.append(line)
+        ancestors.append(line)
+
+    loaded = {_package(line.name) for line in lines}
+    own_ms = (entry.cumulative_us - framework_us) / 1000
+    return {
+        "total_ms": entry.cumulative_us / 1000,
+        "framework_ms": framework_us / 1000,
+        "own_ms": own_ms,
+        "slowest": [(line.name, line.cumulative_us / 1000) for line in
+                    sorted(children, key=lambda line: -line.cumulative_us)[:TOP_IMPORTS]],
+        "deferred_loaded": sorted(loaded & DEFERRED_BY_ENTRY.get(module, DEFERRED)),
+    }
+
+
+def measure(module: str, runs: int) -> Dict:
+    """Import a module in fresh interpreters and keep the median run"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1", STREAMLIT_SERVER_HEADLESS="true")
+    env.pop("STORYBOOK_METRICS_PORT", None)
+    env.pop("STORYBOOK_PROFILE_RUNS", None)
+
+    results = []
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              cwd=ROOT, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            error = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+            return {"skipped": error[-1] if error else f"exit status {proc.returncode}"}
+        result = analyze(module, parse_importtime(proc.stderr))
+        if result is None:
+            return {"skipped": "no import timing for the module"}
+        results.append(result)
+
+    results.sort(key=lambda result: result["own_ms"])
+    median = dict(results[len(results) // 2])
+    median["own_ms_spread"] = [results[0]["own_ms"], results[-1]["own_ms"]]
+    median["runs"] = runs
+    return median
+
+
+def print_report(report: Dict, budget_ms: float):
+    print(f"\n{'entry point':<18} {'total ms':>9} {'framework':>10} {'own ms':>8} {'budget':>7}")
+    for module, row in report.items():
+        if "skipped" in row:
+            print(f"{module:<18} skipped: {row['skipped']}")
+            continue
+        status = "ok" if row["own_ms"] <= budget_ms else "OVER"
+        print(f"{module:<18} {row['total_ms']:>9.1f} {row['framework_ms']:>10.1f} "
+              f"{row['own_ms']:>8.1f} {status:>7}")
+        for name, ms in row["slowest"]:
+            print(f"{'':<20}{ms:>8.1f} ms  {name}")
+        if row["deferred_loaded"]:
+            print(f"{'':<20}loaded at startup: {', '.join(row['deferred_loaded'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time of each entry point against a budget")
+    parser.add_argument("--entry-points", nargs="+", default=ENTRY_POINTS)
+    parser.add_argument("--budget-ms", type=float, default=150.0,
+                        help="Allowed import time outside the web framework")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per entry point")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    report = {}
+    for module in args.entry_points:
+        print(f"Importing {module}...", flush=True)
+        report[module] = measure(module, max(1, args.runs))
+    print_report(report, args.budget_ms)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"budget_ms": args.budget_ms, "entry_points": report}, f, indent=2)
+
+    failures = [module for module, row in report.items() if "skipped" not in row and
+                (row["own_ms"] > args.budget_ms or row["deferred_loaded"])]
+    if failures:
+        print(f"\nOver the {args.budget_ms:.0f} ms budget or loading deferred modules: {', '.join(failures)}")
+        sys.exit(1)
+    print(f"\nEvery measured entry point is within {args.budget_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""
+End-to-end benchmark of every stage and the full pipeline.
+
+Stages:
+    recorder   AudioRecorder buffering and stop_recording() on synthetic audio
+    stt        SpeechToText.transcribe_audio() for each --models size
+    translate  MedicalTranslator.translate_to_storybook() against a local mock Claude
+    format     StorybookFormatter.format_storybook(), cold and cached
+    pipeline   StoryPipeline over text notes (and recordings if Whisper is installed)
+
+Claude is replaced by mock_anthropic_server with a fixed latency, so runs are
+repeatable and cost nothing. Every input gets a unique visit number so the
+story cache never answers for Claude, and is about a condition the story
+library has no ready-made story for. Stages whose dependencies are missing
+(numpy, sounddevice, whisper) are skipped and reported as such.
+
+Each stage reports p50/p95/p99 latency, throughput and the process's peak RSS
+so far (stages run in the order given, so RSS is cumulative). Results can be
+saved as JSON and compared against an earlier run:
+
+Usage:
+    python benchmarks/bench_pipeline.py --json bench.json
+    python benchmarks/bench_pipeline.py --baseline bench.json --tolerance 0.15
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import struct
+import sys
+import tempfile
+import time
+import wave
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STAGES = ["recorder", "stt", "translate", "format", "pipeline"]
+
+SAMPLE_RATE = 16000
+
+MEDICAL_TEXTS = [
+    "The patient has strep throat caused by bacterial infection. They need to take amoxicillin "
+    "antibiotics twice daily for 10 days. Rest and plenty of fluids are recommended.",
+    "The child needs an X-ray of their left arm to check for a possible fracture after falling "
+    "off their bike. The procedure is painless and takes only a few minutes.",
+    "Mild persistent asthma. Use the albuterol inhaler with a spacer when wheezing, and the "
+    "fluticasone inhaler every morning and evening. Avoid smoke and come back in 4 weeks.",
+    "Acute otitis media in the right ear. Give ibuprofen for pain every 6 hours as needed and "
+    "watch for fever above 102. If it is not better in 48 hours, start amoxicillin.",
+]
+
+# Visits the story library has no ready-made story for, so every one reaches Claude
+UNCACHED_TEXTS = [
+    "Croup with a barking cough and stridor at night. One dose of dexamethasone by mouth was given "
+    "in clinic. Use a cool mist humidifier and return if breathing becomes hard.",
+    "Viral gastroenteritis with vomiting and diarrhea for two days. Give small sips of oral "
+    "rehydration solution every few minutes and watch for signs of dehydration.",
+    "Bacterial conjunctivitis in both eyes. Put one drop of ofloxacin in each eye four times daily "
+    "for 5 days and wash hands often. May return to school after 24 hours of drops.",
+    "Urinary tract infection confirmed by urinalysis. Take cephalexin three times daily for 7 days "
+    "and drink plenty of water. Follow-up if the fever lasts beyond 48 hours.",
+]
+
+# Metrics where a larger value is better; everything else regresses by growing
+HIGHER_IS_BETTER = {"throughput_per_s"}
+COMPARED_METRICS = ["p50_ms", "p95_ms", "throughput_per_s", "peak_rss_mb"]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Linear-interpolated percentile of a non-empty list"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * pct / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(latencies: List[float], wall_seconds: float, **extra) -> Dict:
+    summary = {
+        "count": len(latencies),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "throughput_per_s": len(latencies) / wall_seconds if wall_seconds else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    summary.update(extra)
+    return summary
+
+
+def timed_runs(fn: Callable[[int], object], iterations: int, warmup: int = 1) -> Dict:
+    for i in range(warmup):
+        fn(-1 - i)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        begin = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - begin)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def synthetic_speech(seconds: float, rng: random.Random) -> List[float]:
+    """
+    Speech-like audio: a voiced tone with formant harmonics, syllable-rate
+    amplitude modulation, pitch drift and short pauses between phrases
+    """
+    samples = []
+    phase = 0.0
+    pitch = 140.0
+    phrase_left = rng.uniform(1.0, 2.5)
+    pause_left = 0.0
+    for n in range(int(seconds * SAMPLE_RATE)):
+        t = n / SAMPLE_RATE
+        if pause_left > 0:
+            pause_left -= 1 / SAMPLE_RATE
+            samples.append(rng.gauss(0, 0.003))
+            continue
+        phrase_left -= 1 / SAMPLE_RATE
+        if phrase_left <= 0:
+            phrase_left = rng.uniform(1.0, 2.5)
+            pause_left = rng.uniform(0.2, 0.5)
+            pitch = rng.uniform(110, 180)
+
+        pitch += rng.gauss(0, 0.05)
+        phase += 2 * math.pi * pitch / SAMPLE_RATE
+        syllable = 0.5 + 0.5 * math.sin(2 * math.pi * 4.0 * t) ** 2
+        voiced = (math.sin(phase) + 0.5 * math.sin(2 * phase) + 0.3 * math.sin(5.3 * phase)
+                  + 0.2 * math.sin(13.1 * phase))
+        samples.append(0.15 * syllable * voiced + rng.gauss(0, 0.01))
+    return samples
+
+
+def write_wav(path: str, samples: List[float]):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(b''.join(struct.pack('<h', max(-32767, min(32767, int(s * 32767)))) for s in samples))
+
+
+def unique_text(i: int) -> str:
+    """A fixed input with a unique visit number, so neither the library nor a cache can answer it"""
+    return f"{UNCACHED_TEXTS[i % len(UNCACHED_TEXTS)]} Visit reference {i + 1000}."
+
+
+def bench_recorder(args, workdir: str) -> Dict:
+    import numpy as np
+    from audio_recorder import AudioRecorder
+
+    rng = random.Random(args.seed)
+    audio = np.asarray(synthetic_speech(args.audio_seconds, rng), dtype=np.float32).reshape(-1, 1)
+    chunk = int(0.1 * SAMPLE_RATE)
+    chunks = [audio[i:i + chunk] for i in range(0, len(audio), chunk)]
+    recorder = AudioRecorder(sample_rate=SAMPLE_RATE)
+
+    def run(_):
+        recorder.start_recording()
+        # What record_chunk() does after each sd.rec(), without a microphone
+        for piece in chunks:
+            recorder.audio_data.append(piece)
+        path = recorder.stop_recording()
+        os.unlink(path)
+
+    result = timed_runs(run, args.iterations)
+    result["audio_seconds"] = args.audio_seconds
+    return result
+
+
+def bench_stt(args, wav_paths: List[str], model_size: str) -> Dict:
+    from speech_to_text import SpeechToText
+
+    load_started = time.perf_counter()
+    stt = SpeechToText(model_size)
+    load_seconds = time.perf_counter() - load_started
+
+    result = timed_runs(lambda i: stt.transcribe_audio(wav_paths[i % len(wav_paths)]),
+                        max(1, args.iterations // 4))
+    result["model_load_s"] = load_seconds
+    result["audio_seconds"] = args.audio_seconds
+    result["realtime_factor"] = result["p50_ms"] / 1000 / args.audio_seconds
+    return result
+
+
+def bench_translate(args, base_url: str) -> Dict:
+    from medical_translator import MedicalTranslator
+    from near_duplicate_cache import NearDuplicateCache
+
+    translator = MedicalTranslator(base_url=base_url, story_cache=NearDuplicateCache())
+    return timed_runs(lambda i: translator.translate_to_storybook(unique_text(i)), args.iterations)
+
+
+def bench_format(args) -> Dict:
+    from mock_anthropic_server import CANNED_STORIES
+    from storybook_formatter import StorybookFormatter
+
+    formatter = StorybookFormatter()
+    stories = [story["text"] for story in CANNED_STORIES]
+    styles = ["friendly", "adventure", "magical", "superhero"]
+
+    def cold(i):
+        StorybookFormatter.clear_cache()
+        formatter.format_storybook(stories[i % len(stories)], styles[i % len(styles)])
+
+    def warm(i):
+        formatter.format_storybook(stories[i % len(stories)], styles[i % len(styles)])
+
+    iterations = args.iterations * 10
+    result = timed_runs(cold, iterations)
+    cached = timed_runs(warm, iterations)
+    result["cached_p50_ms"] = cached["p50_ms"]
+    result["cached_p95_ms"] = cached["p95_ms"]
+    return result
+
+
+def bench_pipeline(args, base_url: str, workdir: str, wav_paths: List[str]) -> Dict:
+    from medical_translator import MedicalTranslator
+    from near_duplicate_cache import NearDuplicateCache
+    from pipeline import StoryPipeline
+
+    inputs = os.path.join(workdir, "pipeline_inputs")
+    os.makedirs(inputs, exist_ok=True)
+    for i in range(args.iterations):
+        with open(os.path.join(inputs, f"note_{i:03d}.txt"), "w", encoding="utf-8") as f:
+            f.write(unique_text(i + 5000))
+    for path in wav_paths:
+        shutil.copy(path, inputs)
+
+    translator = MedicalTranslator(base_url=base_url, story_cache=NearDuplicateCache())
+    pipeline = StoryPipeline(translator=translator, translate_workers=args.translate_workers,
+                             model_size=args.models[0])
+    summary = pipeline.run([inputs], os.path.join(workdir, "pipeline_out"))
+
+    with open(os.path.join(workdir, "pipeline_out", "stories.jsonl"), encoding="utf-8") as f:
+        items = [json.loads(line) for line in f]
+    latencies = [sum(item["timings"].values()) for item in items if not item.get("error")]
+    if not latencies:
+        raise RuntimeError(f"every pipeline item failed, e.g. {items[0].get('error') if items else 'no inputs'}")
+
+    result = summarize(latencies, summary["seconds"])
+    result["failed"] = summary["failed"]
+    for stage in ("load", "transcribe", "translate", "format"):
+        stage_times = [item["timings"][stage] for item in items if stage in item["timings"]]
+        if stage_times:
+            result[f"{stage}_p50_ms"] = percentile(stage_times, 50) * 1000
+    return result
+
+
+def run(args) -> Dict:
+    from mock_anthropic_server import MockConfig, start_background_server
+
+    os.environ.setdefault("ANTHROPIC_API_KEY", "benchmark")
+    server, base_url = start_background_server(MockConfig(latency=args.mock_latency, seed=args.seed))
+    workdir = tempfile.mkdtemp(prefix="storybook_bench_")
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "iterations": args.iterations,
+            "mock_latency": args.mock_latency,
+        },
+        "stages": {},
+        "skipped": {},
+    }
+
+    rng = random.Random(args.seed)
+    wav_paths = []
+    if {"stt", "pipeline"} & set(args.stages):
+        for i in range(2):
+            path = os.path.join(workdir, f"speech_{i}.wav")
+            write_wav(path, synthetic_speech(args.audio_seconds, rng))
+            wav_paths.append(path)
+
+    try:
+        for stage in args.stages:
+            jobs = [(f"stt_{size}", size) for size in args.models] if stage == "stt" else [(stage, None)]
+            for name, model_size in jobs:
+                print(f"Running {name}...", flush=True)
+                try:
+                    if stage == "recorder":
+                        result = bench_recorder(args, workdir)
+                    elif stage == "stt":
+                        result = bench_stt(args, wav_paths, model_size)
+                    elif stage == "translate":
+                        result = bench_translate(args, base_url)
+                    elif stage == "format":
+                        result = bench_format(args)
+                    else:
+                        try:
+                            import whisper  # noqa: F401
+                            audio_inputs = wav_paths
+                        except ImportError:
+                            audio_inputs = []
+                        result = bench_pipeline(args, base_url, workdir, audio_inputs)
+                except ImportError as e:
+                    report["skipped"][name] = str(e)
+                    continue
+                report["stages"][name] = result
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Lines describing every metric that got worse by more than the tolerance"""
+    regressions = []
+    for name, current in report["stages"].items():
+        previous = baseline.get("stages", {}).get(name)
+        if not previous:
+            continue
+        for metric in COMPARED_METRICS:
+            if metric not in current or not previous.get(metric):
+                continue
+            change = (current[metric] - previous[metric]) / previous[metric]
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if worse > tolerance:
+                regressions.append(f"{name}.{metric}: {previous[metric]:.2f} -> {current[metric]:.2f} "
+                                   f"({change:+.0%})")
+    return regressions
+
+
+def print_report(report: Dict):
+    print(f"\n{'stage':<12} {'n':>5} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'ops/s':>9} {'rss MB':>8}")
+    for name, row in report["stages"].items():
+        print(f"{name:<12} {row['count']:>5} {row['p50_ms']:>10.2f} {row['p95_ms']:>10.2f} "
+              f"{row['p99_ms']:>10.2f} {row['throughput_per_s']:>9.2f} {row['peak_rss_mb']:>8.1f}")
+    for name, reason in report["skipped"].items():
+        print(f"{name:<12} skipped: {reason}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark each stage and the full storybook pipeline")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--models", nargs="+", default=["tiny", "base"], help="Whisper model sizes")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--audio-seconds", type=float, default=8.0, help="Length of each synthetic recording")
+    parser.add_argument("--mock-latency", default="fixed:0.05", help="Mock Claude latency, see mock_anthropic_server.py")
+    parser.add_argument("--translate-workers", type=int, default=4, help="Pipeline translate workers")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\nRegressions beyond {args.tolerance:.0%} against {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
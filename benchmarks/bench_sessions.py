@@ -0,0 +1,357 @@
+"""
+Concurrent-session load test for kid_friendly_main.py.
+
+Drives N headless sessions at once through the parent's flow, using
+Streamlit's AppTest in this process, so every session shares one job
+executor, story store and set of caches the way sessions on one server do:
+
+    load        first page render
+    transcribe  a synthetic recording is handed to the transcription job
+                that the Stop Recording button would start (no microphone
+                here), and the page polls it until it is done
+    review      type the visit note and press Review This Text
+    create      press Create Magic Story and rerun until the story is saved
+
+Claude is replaced by mock_anthropic_server. Every note has a unique visit
+number and is about a condition the story library has no story for, so
+every create step misses the library and caches and reaches mock Claude. The
+transcribe step is skipped when Whisper is not installed. Synthetic audio
+has no words in it, so "no speech" is the expected result of that step and is
+counted separately from errors.
+
+Concurrency ramps through --levels. Each level reports per-step latency,
+errors and queue rejections, stories per minute, and the peak memory of the
+server process plus its Whisper workers. The largest level that stays within
+--slo-seconds (p95 of the create step) and --max-error-rate is printed as the
+number of families one process can serve. Worker counts and queue limits come
+from the usual environment variables (CLAUDE_WORKERS, WHISPER_PROCESSES, ...).
+
+Usage:
+    python benchmarks/bench_sessions.py --levels 1 2 4 8 16 --rounds 2
+    python benchmarks/bench_sessions.py --mock-latency lognormal:0.5,0.4 --token-delay 0.02 --json sessions.json
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pipeline import percentile, synthetic_speech, unique_text, write_wav
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "kid_friendly_main.py")
+
+STEPS = ["load", "transcribe", "review", "create"]
+
+# Pause between reruns while a session waits on a background job (the app's own poll interval)
+POLL_SECONDS = 0.5
+# How often server memory is sampled
+RSS_SAMPLE_SECONDS = 0.2
+
+
+class StepError(Exception):
+    """A step failed; the message says why"""
+
+
+class StepBusy(StepError):
+    """The server turned the step's job away because its queue is full"""
+
+
+def _state(at, key: str):
+    try:
+        return at.session_state[key]
+    except KeyError:
+        return None
+
+
+def _button(at, label: str):
+    for button in at.button:
+        if button.label == label:
+            return button
+    raise StepError(f"No {label!r} button on the page")
+
+
+def _text_area(at, label: Optional[str] = None, key: Optional[str] = None):
+    for area in at.text_area:
+        if (key is not None and area.key == key) or (label is not None and area.label == label):
+            return area
+    raise StepError(f"No {key or label!r} text area on the page")
+
+
+def _check(at, errors: bool = True):
+    """Raise if the last run crashed, showed an error or was turned away"""
+    if at.exception:
+        raise StepError(at.exception[0].message)
+    for warning in at.warning:
+        if "Too busy" in warning.value:
+            raise StepBusy(warning.value)
+    if errors and at.error:
+        raise StepError(at.error[0].value)
+
+
+def _run_until(at, done: Callable[[], bool], timeout: float, errors: bool = True):
+    """Rerun the page, as the app's own polling does, until done() or the timeout"""
+    deadline = time.monotonic() + timeout
+    while True:
+        _check(at, errors)
+        if done():
+            return
+        if time.monotonic() > deadline:
+            raise StepError(f"Timed out after {timeout:.0f}s")
+        time.sleep(POLL_SECONDS)
+        at.run(timeout=timeout)
+
+
+class LevelResults:
+    def __init__(self):
+        """Step latencies and failures collected from every session of one level"""
+        self.latencies: Dict[str, List[float]] = {step: [] for step in STEPS}
+        self.errors: Dict[str, int] = {step: 0 for step in STEPS}
+        self.busy: Dict[str, int] = {step: 0 for step in STEPS}
+        self.no_speech = 0
+        self.stories = 0
+        self.messages: List[str] = []
+        self._lock = threading.Lock()
+
+    def timed(self, step: str, fn: Callable[[], object]):
+        """Run one step; returns False (after recording why) if it failed"""
+        started = time.perf_counter()
+        try:
+            fn()
+        except StepBusy:
+            with self._lock:
+                self.busy[step] += 1
+            return False
+        except Exception as e:
+            with self._lock:
+                self.errors[step] += 1
+                if len(self.messages) < 10:
+                    self.messages.append(f"{step}: {e}")
+            return False
+        with self._lock:
+            self.latencies[step].append(time.perf_counter() - started)
+        return True
+
+
+def run_session(index: int, args, wav_path: Optional[str], workdir: str, results: LevelResults):
+    """One family: load the page, then record, review and create --rounds times"""
+    from streamlit.testing.v1 import AppTest
+
+    from admission_control import ServerBusy
+    from job_executor import get_job_executor
+
+    at = None
+    for round_number in range(args.rounds):
+        if at is None:
+            at = AppTest.from_file(APP_PATH, default_timeout=args.step_timeout)
+            if not results.timed("load", lambda: (at.run(), _check(at))):
+                at = None
+                continue
+        # A condition outside the story library, so the story comes from mock Claude
+        note = unique_text(index * 1000 + round_number + args.seed * 100000)
+
+        if wav_path:
+            def transcribe():
+                # What the Stop Recording button does with the recorder's file
+                recording = os.path.join(workdir, f"session_{index}_{round_number}.wav")
+                shutil.copyfile(wav_path, recording)
+                try:
+                    job_id = get_job_executor().submit_transcription(recording, delete_after=True)
+                except ServerBusy as e:
+                    raise StepBusy(str(e))
+                at.session_state["transcription_job"] = job_id
+                at.run()
+                _run_until(at, lambda: not _state(at, "transcription_job"), args.step_timeout, errors=False)
+                job = get_job_executor().get(job_id)
+                if job is not None and job.status == "failed":
+                    if job.error != "No speech was recognized":
+                        raise StepError(job.error)
+                    with results._lock:
+                        results.no_speech += 1
+
+            if not results.timed("transcribe", transcribe):
+                at = None
+                continue
+
+        def review():
+            _text_area(at, label="Parents can type medical information here:").input(note)
+            _button(at, "📋 Review This Text").click()
+            at.run()
+            _run_until(at, lambda: bool(_state(at, "show_review")), args.step_timeout)
+            _text_area(at, key="review_text").input(note)
+
+        def create():
+            _button(at, "✨ Create Magic Story!").click()
+            at.run()
+            _run_until(at, lambda: not _state(at, "story_job") and not _state(at, "show_review"),
+                       args.step_timeout)
+
+        if not results.timed("review", review) or not results.timed("create", create):
+            at = None
+            continue
+        with results._lock:
+            results.stories += 1
+
+
+class RssSampler:
+    def __init__(self):
+        """Peak memory of this process and its Whisper workers while a level runs"""
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        from job_executor import get_job_executor
+
+        while not self._stop.is_set():
+            rss = get_job_executor().admission_stats()["rss_mb"]
+            if rss is not None:
+                self.peak_mb = max(self.peak_mb, rss)
+            self._stop.wait(RSS_SAMPLE_SECONDS)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_level(level: int, args, wav_path: Optional[str], workdir: str) -> Dict:
+    results = LevelResults()
+    threads = [threading.Thread(target=run_session, args=(i, args, wav_path, workdir, results))
+               for i in range(level)]
+    started = time.perf_counter()
+    with RssSampler() as sampler:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    wall_seconds = time.perf_counter() - started
+
+    steps = {}
+    for step in STEPS:
+        latencies = results.latencies[step]
+        attempts = len(latencies) + results.errors[step] + results.busy[step]
+        if not attempts:
+            continue
+        steps[step] = {
+            "count": len(latencies),
+            "p50_s": percentile(latencies, 50) if latencies else None,
+            "p95_s": percentile(latencies, 95) if latencies else None,
+            "max_s": max(latencies) if latencies else None,
+            "errors": results.errors[step],
+            "busy": results.busy[step],
+        }
+    attempts = sum(len(results.latencies[step]) + results.errors[step] + results.busy[step] for step in STEPS)
+    failures = sum(results.errors.values()) + sum(results.busy.values())
+    return {
+        "sessions": level,
+        "steps": steps,
+        "stories": results.stories,
+        "stories_per_min": results.stories / wall_seconds * 60,
+        "error_rate": failures / attempts if attempts else 0.0,
+        "no_speech": results.no_speech,
+        "peak_rss_mb": sampler.peak_mb,
+        "wall_s": wall_seconds,
+        "sample_errors": results.messages,
+    }
+
+
+def within_slo(row: Dict, args) -> bool:
+    create = row["steps"].get("create")
+    return (row["error_rate"] <= args.max_error_rate and create is not None
+            and create["p95_s"] is not None and create["p95_s"] <= args.slo_seconds)
+
+
+def print_level(row: Dict):
+    print(f"\n{row['sessions']} sessions: {row['stories']} stories in {row['wall_s']:.1f}s "
+          f"({row['stories_per_min']:.1f}/min), error rate {row['error_rate']:.1%}, "
+          f"peak RSS {row['peak_rss_mb']:.0f} MB")
+    print(f"  {'step':<11} {'n':>5} {'p50 s':>8} {'p95 s':>8} {'max s':>8} {'errors':>7} {'busy':>5}")
+    for step, stats in row["steps"].items():
+        times = [f"{stats[key]:>8.2f}" if stats[key] is not None else f"{'-':>8}" for key in ("p50_s", "p95_s", "max_s")]
+        print(f"  {step:<11} {stats['count']:>5} {' '.join(times)} {stats['errors']:>7} {stats['busy']:>5}")
+    if row["no_speech"]:
+        print(f"  {row['no_speech']} synthetic recordings came back as no speech (expected)")
+    for message in row["sample_errors"]:
+        print(f"  error: {message}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent Streamlit sessions through the review-then-create flow")
+    parser.add_argument("--levels", nargs="+", type=int, default=[1, 2, 4, 8, 16],
+                        help="Concurrent sessions at each step of the ramp")
+    parser.add_argument("--rounds", type=int, default=2, help="Stories each session creates per level")
+    parser.add_argument("--audio-seconds", type=float, default=8.0, help="Length of the synthetic recording")
+    parser.add_argument("--no-audio", action="store_true", help="Skip the transcribe step")
+    parser.add_argument("--mock-latency", default="lognormal:0.0,0.4",
+                        help="Mock Claude latency, see mock_anthropic_server.py")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds between streamed deltas")
+    parser.add_argument("--step-timeout", type=float, default=180.0, help="Seconds before a step counts as failed")
+    parser.add_argument("--slo-seconds", type=float, default=30.0, help="Allowed p95 for the create step")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    if importlib.util.find_spec("streamlit") is None:
+        print("Streamlit is not installed; nothing to load test")
+        sys.exit(1)
+
+    from mock_anthropic_server import MockConfig, start_background_server
+
+    workdir = tempfile.mkdtemp(prefix="storybook_sessions_")
+    server, base_url = start_background_server(MockConfig(latency=args.mock_latency, token_delay=args.token_delay,
+                                                          seed=args.seed))
+    # Set before the app's modules are imported, so stories land in a throwaway database
+    os.environ["ANTHROPIC_BASE_URL"] = base_url
+    os.environ.setdefault("ANTHROPIC_API_KEY", "load-test")
+    os.environ["STORY_DB_PATH"] = os.path.join(workdir, "stories.db")
+
+    wav_path = None
+    if not args.no_audio:
+        if importlib.util.find_spec("whisper") is None:
+            print("Whisper is not installed; skipping the transcribe step")
+        else:
+            wav_path = os.path.join(workdir, "speech.wav")
+            write_wav(wav_path, synthetic_speech(args.audio_seconds, random.Random(args.seed)))
+
+    report = {"meta": {"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "rounds": args.rounds,
+                       "mock_latency": args.mock_latency, "token_delay": args.token_delay,
+                       "transcribe": wav_path is not None},
+              "levels": []}
+    try:
+        for level in args.levels:
+            print(f"Running {level} concurrent sessions...", flush=True)
+            row = run_level(max(1, level), args, wav_path, workdir)
+            report["levels"].append(row)
+            print_level(row)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    supported = [row["sessions"] for row in report["levels"] if within_slo(row, args)]
+    report["supported_sessions"] = max(supported) if supported else 0
+    if supported:
+        print(f"\nOne process served {max(supported)} concurrent sessions with create p95 within "
+              f"{args.slo_seconds:.0f}s and at most {args.max_error_rate:.0%} errors")
+    else:
+        print(f"\nNo level stayed within create p95 {args.slo_seconds:.0f}s and {args.max_error_rate:.0%} errors")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
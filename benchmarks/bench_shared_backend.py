@@ -0,0 +1,211 @@
+"""
+Shared backend behaviour with several replicas.
+
+Each replica is a thread with its own backend connection, the way separate
+server processes would connect. For every backend the benchmark measures:
+
+    cache   story cache lookups when each replica wrote only its share of
+            the stories, and how many of the others' stories it reused
+    queue   claim throughput with every replica pulling from one queue, and
+            whether each item was handed out exactly once
+    order   queue positions before and after an item is withdrawn
+
+The SQLite backend uses a temporary file. The Redis-protocol backend runs
+against the in-process stand-in (mock_redis_server.py) unless --redis-url
+points at a real server; keys and queues are unique to each run, so nothing
+else on that server is touched.
+
+Exits with status 1 when an item is lost or claimed twice, a shared story is
+missed, or a queue position is wrong.
+
+Usage:
+    python benchmarks/bench_shared_backend.py
+    python benchmarks/bench_shared_backend.py --replicas 8 --items 2000 --redis-url redis://127.0.0.1:6379/0
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pipeline import MEDICAL_TEXTS, percentile
+from mock_redis_server import start_background_server
+from near_duplicate_cache import NearDuplicateCache
+from shared_backend import SharedBackend, open_backend
+
+
+def _run_replicas(replicas: int, target) -> float:
+    """Run target(index) on one thread per replica; returns the wall time"""
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(replicas)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def bench_cache(backends: List[SharedBackend], stories: int, run_id: str) -> Dict:
+    """Each replica adds its share of stories, then looks up all of them"""
+    replicas = len(backends)
+    texts = [f"{MEDICAL_TEXTS[i % len(MEDICAL_TEXTS)]} Visit {run_id} number {i}." for i in range(stories)]
+    caches = [NearDuplicateCache(shared=backend) for backend in backends]
+    write_ms: List[List[float]] = [[] for _ in range(replicas)]
+    read_ms: List[List[float]] = [[] for _ in range(replicas)]
+
+    def write(index: int):
+        for i in range(index, stories, replicas):
+            start = time.perf_counter()
+            caches[index].add(texts[i], f"story {i}")
+            write_ms[index].append((time.perf_counter() - start) * 1000)
+
+    def read(index: int):
+        for text in texts:
+            start = time.perf_counter()
+            caches[index].lookup(text)
+            read_ms[index].append((time.perf_counter() - start) * 1000)
+
+    _run_replicas(replicas, write)
+    _run_replicas(replicas, read)
+
+    expected_shared = stories * (replicas - 1)
+    shared_hits = sum(cache.shared_hits for cache in caches)
+    misses = sum(cache.misses for cache in caches)
+    writes = [ms for per_replica in write_ms for ms in per_replica]
+    reads = [ms for per_replica in read_ms for ms in per_replica]
+    return {
+        "write_p50_ms": percentile(writes, 50),
+        "write_p95_ms": percentile(writes, 95),
+        "lookup_p50_ms": percentile(reads, 50),
+        "lookup_p95_ms": percentile(reads, 95),
+        "cross_replica_hit_rate": shared_hits / expected_shared if expected_shared else 1.0,
+        "misses": misses,
+        "ok": misses == 0 and shared_hits == expected_shared,
+    }
+
+
+def bench_queue(backends: List[SharedBackend], items: int, run_id: str) -> Dict:
+    """Push from every replica, then let every replica claim until the queue is drained"""
+    replicas = len(backends)
+    queue = f"bench-{run_id}"
+    claimed: List[List[str]] = [[] for _ in range(replicas)]
+
+    def push(index: int):
+        for i in range(index, items, replicas):
+            backends[index].push(queue, f"{run_id}-{i}", json.dumps({"n": i}))
+
+    def claim(index: int):
+        while True:
+            item = backends[index].claim(queue, timeout=0.2)
+            if item is None:
+                return
+            claimed[index].append(item[0])
+
+    push_seconds = _run_replicas(replicas, push)
+    claim_seconds = _run_replicas(replicas, claim)
+
+    all_claimed = [item_id for per_replica in claimed for item_id in per_replica]
+    # The last claim of each replica waits out its timeout on an empty queue
+    working_seconds = max(claim_seconds - 0.2, 1e-9)
+    return {
+        "push_per_s": items / push_seconds,
+        "claim_per_s": items / working_seconds,
+        "claimed": len(all_claimed),
+        "duplicates": len(all_claimed) - len(set(all_claimed)),
+        "per_replica": [len(per_replica) for per_replica in claimed],
+        "ok": sorted(all_claimed) == sorted(f"{run_id}-{i}" for i in range(items)),
+    }
+
+
+def check_order(backend: SharedBackend, run_id: str) -> Dict:
+    """Positions count from the front, and a withdrawn item closes the gap"""
+    queue = f"order-{run_id}"
+    ids = [f"{run_id}-order-{i}" for i in range(5)]
+    for item_id in ids:
+        backend.push(queue, item_id, "{}")
+    before = [backend.queue_position(queue, item_id) for item_id in ids]
+    removed = backend.remove(queue, ids[2])
+    after = [backend.queue_position(queue, item_id) for item_id in ids]
+    first = backend.claim(queue, timeout=0.1)
+    while backend.claim(queue, timeout=0.1) is not None:
+        pass
+    ok = (before == [1, 2, 3, 4, 5] and removed and after == [1, 2, None, 3, 4]
+          and first is not None and first[0] == ids[0] and backend.queue_length(queue) == 0)
+    return {"before": before, "after_remove": after, "ok": ok}
+
+
+def run(name: str, url: str, replicas: int, stories: int, items: int) -> Dict:
+    backends = [open_backend(url) for _ in range(replicas)]
+    if any(backend is None for backend in backends):
+        return {"skipped": f"could not open {url}"}
+    run_id = uuid.uuid4().hex[:8]
+    try:
+        return {
+            "cache": bench_cache(backends, stories, run_id),
+            "queue": bench_queue(backends, items, run_id),
+            "order": check_order(backends[0], run_id),
+        }
+    finally:
+        for backend in backends:
+            backend.close()
+
+
+def print_report(name: str, result: Dict):
+    print(f"\n{name}")
+    if "skipped" in result:
+        print(f"  skipped: {result['skipped']}")
+        return
+    cache, queue, order = result["cache"], result["queue"], result["order"]
+    print(f"  cache  write p50 {cache['write_p50_ms']:.2f} ms  p95 {cache['write_p95_ms']:.2f} ms | "
+          f"lookup p50 {cache['lookup_p50_ms']:.2f} ms  p95 {cache['lookup_p95_ms']:.2f} ms | "
+          f"cross-replica hit rate {cache['cross_replica_hit_rate']:.0%}")
+    print(f"  queue  push {queue['push_per_s']:.0f}/s  claim {queue['claim_per_s']:.0f}/s | "
+          f"claimed {queue['claimed']}, duplicates {queue['duplicates']}, per replica {queue['per_replica']}")
+    print(f"  order  positions {order['before']} -> {order['after_remove']} after withdrawing the third")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared cache and queue behaviour across replicas")
+    parser.add_argument("--replicas", type=int, default=4)
+    parser.add_argument("--stories", type=int, default=400, help="Stories written to the shared cache")
+    parser.add_argument("--items", type=int, default=1000, help="Items pushed through the shared queue")
+    parser.add_argument("--redis-url", help="Real Redis-protocol server to use instead of the stand-in")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+    replicas = max(1, args.replicas)
+
+    server = None
+    redis_url = args.redis_url
+    if not redis_url:
+        server, redis_url = start_background_server()
+
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {"sqlite": f"sqlite:///{os.path.join(tmp, 'shared.db')}", "resp": redis_url}
+        for name, url in backends.items():
+            print(f"Running {name} with {replicas} replicas...", flush=True)
+            report[name] = run(name, url, replicas, args.stories, args.items)
+            print_report(name, report[name])
+    if server is not None:
+        server.shutdown()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"replicas": replicas, "backends": report}, f, indent=2)
+
+    failures = [f"{name} {check}" for name, result in report.items() if "skipped" not in result
+                for check in ("cache", "queue", "order") if not result[check]["ok"]]
+    if failures:
+        print(f"\nCorrectness checks failed: {', '.join(failures)}")
+        sys.exit(1)
+    print("\nEvery item was claimed exactly once and every shared story was found")
+
+
+if __name__ == "__main__":
+    main()
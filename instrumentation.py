@@ -0,0 +1,325 @@
+"""
+Lightweight tracing and metrics for the storybook pipeline.
+
+Spans wrap each stage (recording, Whisper, Claude, formatting) and feed
+per-stage latency histograms; counters track Claude tokens, audio seconds and
+cache hits. Metrics are served in the Prometheus text format on a small local
+HTTP endpoint, next to the most recent traces as JSON.
+
+Everything is off unless STORYBOOK_METRICS=1 (or STORYBOOK_METRICS_PORT is
+set). When off, span() hands back a shared no-op object and the counters
+return immediately, so instrumented code pays only a function call.
+
+Metrics live in the process that records them, and only the main process
+serves them. Work done in worker processes (Whisper) is recorded by the
+parent from the timings the workers hand back.
+
+Usage:
+    STORYBOOK_METRICS_PORT=9464 streamlit run main.py
+    curl localhost:9464/metrics
+"""
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+METRICS_PORT = int(os.getenv("STORYBOOK_METRICS_PORT", "0"))
+ENABLED = os.getenv("STORYBOOK_METRICS", "1" if METRICS_PORT else "0").lower() in ("1", "true", "yes")
+
+# Latency buckets in seconds, from formatting (sub-millisecond) to Whisper on long recordings
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Finished root spans kept for /traces
+RECENT_TRACES = 200
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        """Cumulative-bucket histogram with one series per label set"""
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series: Dict[LabelKey, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (non-cumulative), then sum and count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(key, list(series[0]), series[1], series[2]) for key, series in self._series.items()]
+        for key, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', repr(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        """Monotonic counter with one series per label set"""
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = sorted(self._values.items())
+        for key, value in snapshot:
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("storybook_stage_seconds", "Time spent in each pipeline stage")
+STAGE_ERRORS = Counter("storybook_stage_errors_total", "Stages that raised an exception")
+CLAUDE_TOKENS = Counter("storybook_claude_tokens_total", "Claude tokens by direction (input/output)")
+AUDIO_SECONDS = Counter("storybook_audio_seconds_total", "Seconds of audio recorded or transcribed, by stage")
+CACHE_LOOKUPS = Counter("storybook_cache_lookups_total", "Cache lookups by cache and result (hit/miss)")
+
+METRICS = [STAGE_SECONDS, STAGE_ERRORS, CLAUDE_TOKENS, AUDIO_SECONDS, CACHE_LOOKUPS]
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("storybook_span", default=None)
+_recent_traces: deque = deque(maxlen=RECENT_TRACES)
+
+
+class Span:
+    def __init__(self, stage: str, attributes: Dict):
+        """One timed stage; nested spans become its children"""
+        self.stage = stage
+        self.attributes = attributes
+        self.children: List["Span"] = []
+        self.started_at = 0.0
+        self.duration = 0.0
+        self.error: Optional[str] = None
+        self._token = None
+        self._start = 0.0
+
+    def set(self, **attributes):
+        """Attach details such as token counts to the span"""
+        self.attributes.update(attributes)
+
+    def fail(self, error: str):
+        """Mark the span failed when the code handles the exception itself"""
+        if self.error is None:
+            self.error = error
+            STAGE_ERRORS.inc(stage=self.stage)
+
+    def __enter__(self) -> "Span":
+        parent = _current_span.get()
+        if parent is not None:
+            parent.children.append(self)
+        self._token = _current_span.set(self)
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._start
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Exited from another context, e.g. a generator resumed elsewhere
+            _current_span.set(None)
+        STAGE_SECONDS.observe(self.duration, stage=self.stage)
+        if exc_type is not None:
+            self.fail(f"{exc_type.__name__}: {exc}")
+        if _current_span.get() is None:
+            _recent_traces.append(self)
+        return False
+
+    def to_dict(self) -> Dict:
+        return {
+            "stage": self.stage,
+            "started_at": self.started_at,
+            "duration_ms": self.duration * 1000,
+            "attributes": self.attributes,
+            "error": self.error,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+class _NoopSpan:
+    """Stand-in used while instrumentation is off"""
+
+    def set(self, **attributes):
+        pass
+
+    def fail(self, error: str):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(stage: str, **attributes):
+    """
+    Time a block of code as one pipeline stage
+
+    Usage:
+        with span("transcribe_audio", model="base") as s:
+            ...
+            s.set(audio_seconds=12.5)
+    """
+    if not ENABLED:
+        return _NOOP_SPAN
+    _ensure_server()
+    return Span(stage, attributes)
+
+
+def observe(stage: str, seconds: float, error: Optional[str] = None):
+    """
+    Record a stage timed by hand
+
+    For work that cannot sit inside one with-block, such as a generator that
+    yields to its caller between chunks.
+    """
+    if not ENABLED:
+        return
+    _ensure_server()
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if error:
+        STAGE_ERRORS.inc(stage=stage)
+
+
+def count_tokens(input_tokens: Optional[int], output_tokens: Optional[int]):
+    """Record Claude token usage"""
+    if not ENABLED:
+        return
+    if input_tokens:
+        CLAUDE_TOKENS.inc(input_tokens, direction="input")
+    if output_tokens:
+        CLAUDE_TOKENS.inc(output_tokens, direction="output")
+
+
+def count_audio(stage: str, seconds: Optional[float]):
+    """Record seconds of audio handled by a stage"""
+    if ENABLED and seconds:
+        AUDIO_SECONDS.inc(seconds, stage=stage)
+
+
+def count_cache(cache: str, hit: bool):
+    """Record one cache lookup"""
+    if ENABLED:
+        CACHE_LOOKUPS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def render_prometheus() -> str:
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def recent_traces(limit: int = 50) -> List[Dict]:
+    """The most recent finished root spans, newest first"""
+    return [trace.to_dict() for trace in list(_recent_traces)[-limit:][::-1]]
+
+
+def _metrics_handler():
+    # http.server pulls in ssl and email; only load it when the server starts
+    from http.server import BaseHTTPRequestHandler
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith("/metrics"):
+                body = render_prometheus().encode("utf-8")
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            elif self.path.startswith("/traces"):
+                body = json.dumps(recent_traces()).encode("utf-8")
+                content_type = "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return _MetricsHandler
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = "127.0.0.1"):
+    """
+    Serve /metrics and /traces on a daemon thread, once per process
+
+    Returns:
+        The server, or None if it could not be started (e.g. port in use)
+    """
+    global _server
+    with _server_lock:
+        if _server is None:
+            from http.server import ThreadingHTTPServer
+            try:
+                _server = ThreadingHTTPServer((host, port), _metrics_handler())
+            except OSError as e:
+                print(f"Error starting metrics server on port {port}: {e}")
+                return None
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server
+
+
+_server_checked = False
+
+
+def _ensure_server():
+    global _server_checked
+    if not _server_checked:
+        _server_checked = True
+        # Worker processes inherit STORYBOOK_METRICS_PORT; only the main process serves it
+        import multiprocessing
+        if METRICS_PORT and multiprocessing.parent_process() is None:
+            start_metrics_server(METRICS_PORT)
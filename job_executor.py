@@ -0,0 +1,912 @@
+"""
+Process-wide background jobs for work that must not block Streamlit reruns.
+
+Claude requests run on a thread pool; Whisper transcription runs on a process
+pool so it neither holds the GIL nor blocks other sessions. Each submission
+returns a job id that the UI keeps in session state (and the URL) and polls,
+so results survive reruns and page refreshes.
+
+Both pools sit behind admission control: jobs beyond the free slots wait in a
+bounded queue (job.status "queued", with a position for the UI), and once
+that queue is full submissions fail fast with ServerBusy.
+
+With a shared backend (SHARED_BACKEND_URL) replicas cooperate: recordings go
+into one transcription queue that every replica's Whisper workers pull from,
+transcripts are cached by audio content, and each job's state is published so
+any replica can report on or cancel it. Story jobs still run on the replica
+that accepted them.
+"""
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional
+
+from admission_control import AdmissionController, ServerBusy, default_watermark_mb, rss_mb
+from instrumentation import count_audio, observe
+from profiling import Profiler, get_profiler
+from shared_backend import BACKEND_ERRORS, SharedBackend, get_shared_backend
+from storybook_formatter import MULTILINGUAL_SEPARATOR, IncrementalStoryFormatter, StorybookFormatter
+
+CLAUDE_WORKERS = int(os.getenv("CLAUDE_WORKERS", "8"))
+WHISPER_PROCESSES = int(os.getenv("WHISPER_PROCESSES", "1"))
+
+# Jobs allowed to wait for a free worker before new ones are rejected
+WHISPER_QUEUE_LIMIT = int(os.getenv("WHISPER_QUEUE_LIMIT", "20"))
+CLAUDE_QUEUE_LIMIT = int(os.getenv("CLAUDE_QUEUE_LIMIT", "50"))
+# Queued jobs are held back while this process and its Whisper workers use more memory than this
+RSS_WATERMARK_MB = float(os.getenv("RSS_WATERMARK_MB", "0")) or default_watermark_mb()
+
+# Finished jobs are kept this long for late pollers, then dropped
+JOB_RETENTION_SECONDS = 3600
+
+# Shared queue that every replica's Whisper workers pull recordings from
+TRANSCRIPTION_QUEUE = "transcription"
+# How often job state is published and shared transcription results are collected
+SYNC_SECONDS = 0.25
+# A shared transcription with no result after this long is given up on (its replica likely died)
+SHARED_TRANSCRIPTION_TIMEOUT_SECONDS = 600
+# Transcripts are cached by audio content this long
+TRANSCRIPT_TTL_SECONDS = 7 * 24 * 3600
+
+# Whisper models loaded inside each worker process, by model size
+_process_models: Dict[str, Any] = {}
+
+
+def _process_stt(model_size: str):
+    """The worker process's Whisper model; it stays loaded between jobs"""
+    stt = _process_models.get(model_size)
+    if stt is None:
+        from speech_to_text import SpeechToText
+        stt = _process_models[model_size] = SpeechToText(model_size)
+    return stt
+
+
+def _transcribe_in_process(audio_path: str, model_size: str, profile_dir: Optional[str] = None):
+    """
+    Runs in a worker process; profiles itself when the parent claimed a profiling run
+
+    Metrics recorded here never reach the parent's /metrics, so the timing
+    and audio length go back with the text for the parent to record.
+
+    Returns:
+        (text, start time, seconds spent, seconds of audio)
+    """
+    started = time.time()
+    profiling = Profiler(profile_dir).profile("job_transcription", force=True) if profile_dir else nullcontext()
+    with profiling:
+        stt = _process_stt(model_size)
+        text = stt.transcribe_audio(audio_path)
+    return text, started, time.time() - started, stt.last_audio_seconds
+
+
+def _claim_profile_dir() -> Optional[str]:
+    """Profile output directory if the next transcription should be profiled"""
+    profiler = get_profiler()
+    return profiler.output_dir if profiler.claim() else None
+
+
+def _transcribe_samples_in_process(samples, model_size: str, prompt: Optional[str]):
+    """Runs in a worker process; returns (text, seconds spent)"""
+    started = time.time()
+    text = _process_stt(model_size).transcribe_samples(samples, prompt)
+    return text, time.time() - started
+
+
+def _record_transcription(stage: str, text: Optional[str], seconds: float, audio_seconds: Optional[float]):
+    """Record a worker process's transcription in this process's metrics"""
+    observe(stage, seconds, error=None if text is not None else "transcription failed")
+    count_audio(stage, audio_seconds)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job that noticed its cancellation"""
+
+
+class Job:
+    def __init__(self, kind: str, meta: Optional[Dict] = None):
+        """
+        State of one background job
+
+        Args:
+            kind: Short label such as "transcription" or "story"
+            meta: Extra details the UI needs to finish the job after a refresh
+        """
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.meta = meta or {}
+        self.status = "queued"
+        self.progress: Any = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_requested = False
+        self.future: Optional[Future] = None
+        self.admission: Optional[AdmissionController] = None
+        self._callbacks: List[Callable[["Job"], None]] = []
+        self._callback_lock = threading.Lock()
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+    @property
+    def queue_seconds(self) -> Optional[float]:
+        """Time spent waiting for a worker"""
+        if self.started_at is None:
+            return None
+        return self.started_at - self.submitted_at
+
+    @property
+    def run_seconds(self) -> Optional[float]:
+        """Time spent running, so far if still running"""
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def elapsed(self) -> float:
+        """Time since submission"""
+        return (self.finished_at or time.time()) - self.submitted_at
+
+    def report(self, progress: Any):
+        """Publish progress for pollers; raises JobCancelled if the job was cancelled"""
+        if self.cancel_requested:
+            raise JobCancelled()
+        self.progress = progress
+
+    def add_done_callback(self, callback: Callable[["Job"], None]):
+        """Call callback(job) once the job finishes, or right away if it already has"""
+        with self._callback_lock:
+            if not self.done:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _run_callbacks(self):
+        with self._callback_lock:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                print(f"Error in job callback: {e}")
+
+    def timing(self) -> Dict[str, Optional[float]]:
+        return {
+            "queue_seconds": self.queue_seconds,
+            "run_seconds": self.run_seconds,
+            "elapsed": self.elapsed,
+        }
+
+    def state(self, queue_position: Optional[int] = None) -> Dict:
+        """What other replicas need to report on this job"""
+        return {
+            "id": self.id, "kind": self.kind, "meta": self.meta, "status": self.status,
+            "progress": self.progress, "result": self.result, "error": self.error,
+            "submitted_at": self.submitted_at, "started_at": self.started_at,
+            "finished_at": self.finished_at, "queue_position": queue_position,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> "Job":
+        """Read-only snapshot of a job owned by another replica"""
+        job = cls(state["kind"], state.get("meta"))
+        for name in ("id", "status", "progress", "result", "error", "submitted_at", "started_at", "finished_at"):
+            setattr(job, name, state.get(name))
+        return job
+
+
+class JobExecutor:
+    def __init__(self, thread_workers: int = CLAUDE_WORKERS, process_workers: int = WHISPER_PROCESSES,
+                 whisper_queue_limit: int = WHISPER_QUEUE_LIMIT, claude_queue_limit: int = CLAUDE_QUEUE_LIMIT,
+                 rss_watermark_mb: float = RSS_WATERMARK_MB, shared: Optional[SharedBackend] = None):
+        """
+        Thread pool for Claude I/O plus a lazily started process pool for Whisper
+
+        Args:
+            thread_workers: Concurrent Claude jobs
+            process_workers: Whisper worker processes
+            whisper_queue_limit: Transcriptions allowed to wait for a worker
+                (across all replicas, with a shared backend)
+            claude_queue_limit: Story jobs allowed to wait for a worker
+            rss_watermark_mb: Memory above which queued jobs are held back
+            shared: Backend shared with other replicas, if any
+        """
+        self._threads = ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix="claude-job")
+        self._process_workers = process_workers
+        self._processes: Optional[ProcessPoolExecutor] = None
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        # One slot per worker, so the pools' own queues stay empty and waiting is visible
+        self.whisper_admission = AdmissionController("transcription", process_workers, whisper_queue_limit,
+                                                     rss_watermark_mb, rss=self._rss_mb)
+        self.claude_admission = AdmissionController("story", thread_workers, claude_queue_limit,
+                                                    rss_watermark_mb, rss=self._rss_mb)
+
+        self.shared = shared
+        # Jobs whose recording is in the shared queue: job id -> (callback for the transcript, pushed at)
+        self._shared_waits: Dict[str, Any] = {}
+        self._stopping = threading.Event()
+        if shared is not None:
+            threading.Thread(target=self._sync_loop, name="job-sync", daemon=True).start()
+            for i in range(process_workers):
+                threading.Thread(target=self._shared_worker, name=f"whisper-claim-{i}", daemon=True).start()
+
+    def _rss_mb(self) -> Optional[float]:
+        """Memory of this process and its Whisper workers, where the models live"""
+        workers = getattr(self._processes, "_processes", None) or {}
+        return rss_mb(list(workers))
+
+    def _register(self, job: Job):
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, old in self._jobs.items()
+                       if old.done and now - old.finished_at > JOB_RETENTION_SECONDS]
+            for job_id in expired:
+                del self._jobs[job_id]
+            self._jobs[job.id] = job
+
+    def _admit(self, job: Job, admission: AdmissionController, begin: Callable[[], None],
+               priority: bool = False):
+        """
+        Run begin() once the job gets a slot
+
+        Raises:
+            ServerBusy: The queue is full; the job is dropped
+        """
+        def start():
+            job.admission = admission
+            if job.cancel_requested:
+                self._finish(job)
+                return
+            try:
+                begin()
+            except Exception as e:
+                self._finish(job, error=str(e))
+
+        try:
+            admission.submit(job.id, start, priority=priority)
+        except ServerBusy:
+            self._drop(job)
+            raise
+
+    def _drop(self, job: Job):
+        """Forget a job that was turned away"""
+        with self._lock:
+            self._jobs.pop(job.id, None)
+
+    def _release(self, job: Job):
+        """Give back the job's slot, once"""
+        with job._callback_lock:
+            admission, job.admission = job.admission, None
+        if admission is not None:
+            admission.release(job.id)
+
+    def _finish(self, job: Job, result: Any = None, error: Optional[str] = None):
+        with job._callback_lock:
+            if job.done:
+                return
+            job.finished_at = time.time()
+            if job.cancel_requested:
+                job.status = "cancelled"
+            elif error is not None:
+                job.error = error
+                job.status = "failed"
+            else:
+                job.result = result
+                job.status = "done"
+        self._release(job)
+        self._publish(job)
+        job._run_callbacks()
+
+    def _run(self, job: Job, fn: Callable, args, kwargs):
+        """Body of every thread-pool job"""
+        if job.cancel_requested:
+            self._finish(job)
+            return
+        if job.started_at is None:
+            job.started_at = time.time()
+        job.status = "running"
+        try:
+            with get_profiler().profile(f"job_{job.kind}"):
+                result = fn(job, *args, **kwargs)
+            self._finish(job, result=result)
+        except JobCancelled:
+            self._finish(job)
+        except Exception as e:
+            self._finish(job, error=str(e))
+
+    def _ensure_processes(self) -> ProcessPoolExecutor:
+        if self._processes is None:
+            with self._lock:
+                if self._processes is None:
+                    # spawn avoids forking a process that already has threads and torch loaded
+                    self._processes = ProcessPoolExecutor(
+                        max_workers=self._process_workers,
+                        mp_context=multiprocessing.get_context("spawn")
+                    )
+        return self._processes
+
+    def submit(self, kind: str, fn: Callable, *args, meta: Optional[Dict] = None,
+               priority: bool = False, **kwargs) -> str:
+        """
+        Run fn(job, *args, **kwargs) on the Claude thread pool
+
+        The function receives its Job so it can call job.report() with progress.
+
+        Args:
+            priority: Skip the queue limit and go to the front, for work
+                that was already accepted (e.g. a live stream)
+
+        Returns:
+            Job id to poll with get()
+
+        Raises:
+            ServerBusy: Too many story jobs are already waiting
+        """
+        job = Job(kind, meta)
+        self._register(job)
+        self._admit(job, self.claude_admission, lambda: self._start_thread(job, fn, args, kwargs), priority)
+        return job.id
+
+    def _start_thread(self, job: Job, fn: Callable, args, kwargs):
+        job.future = self._threads.submit(self._run, job, fn, args, kwargs)
+
+    def submit_transcription(self, audio_path: str, model_size: str = "base",
+                             delete_after: bool = False, meta: Optional[Dict] = None) -> str:
+        """
+        Transcribe an audio file in a Whisper worker process
+
+        Args:
+            audio_path: Audio file to transcribe
+            model_size: Whisper model size
+            delete_after: Remove the file once the job finishes
+
+        Returns:
+            Job id; the result is the transcribed text
+
+        Raises:
+            ServerBusy: Too many transcriptions are already waiting
+        """
+        job = Job("transcription", meta)
+        self._register(job)
+        if delete_after:
+            job.add_done_callback(lambda _job: _remove(audio_path))
+        try:
+            self._start_transcription(job, audio_path, model_size, lambda text: self._finish(job, result=text))
+        except ServerBusy:
+            if delete_after:
+                _remove(audio_path)
+            raise
+        return job.id
+
+    def _start_transcription(self, job: Job, audio_path: str, model_size: str,
+                             on_transcript: Callable[[str], None]):
+        """
+        Transcribe for a job, then call on_transcript(text)
+
+        Runs in this replica's Whisper workers, or with a shared backend goes
+        through the shared transcript cache and queue. Errors, silence and
+        cancellation finish the job instead.
+
+        Raises:
+            ServerBusy: Too many transcriptions are already waiting; the job is dropped
+        """
+        if self.shared is not None:
+            try:
+                self._share_transcription(job, audio_path, model_size, on_transcript)
+                return
+            except BACKEND_ERRORS as e:
+                print(f"Error using the shared transcription queue, transcribing locally: {e}")
+
+        def begin():
+            job.status = "running"
+            job.future = self._ensure_processes().submit(
+                _transcribe_in_process, audio_path, model_size, _claim_profile_dir()
+            )
+            job.future.add_done_callback(done)
+
+        def done(future: Future):
+            if future.cancelled():
+                job.cancel_requested = True
+                self._finish(job)
+                return
+            try:
+                text, started, seconds, audio_seconds = future.result()
+            except Exception as e:
+                self._finish(job, error=str(e))
+                return
+            _record_transcription("transcribe_audio", text, seconds, audio_seconds)
+            job.started_at = started
+            self._transcribed(job, text, on_transcript)
+
+        self._admit(job, self.whisper_admission, begin)
+
+    def _transcribed(self, job: Job, text: Optional[str], on_transcript: Callable[[str], None]):
+        if job.cancel_requested:
+            self._finish(job)
+        elif not text:
+            self._finish(job, error="No speech was recognized")
+        else:
+            try:
+                on_transcript(text)
+            except Exception as e:
+                self._finish(job, error=str(e))
+
+    def _share_transcription(self, job: Job, audio_path: str, model_size: str,
+                             on_transcript: Callable[[str], None]):
+        """Use a cached transcript of the same audio, or queue the recording for any replica"""
+        with open(audio_path, "rb") as f:
+            audio = f.read()
+        cache_key = hashlib.sha256(model_size.encode("utf-8") + b"\0" + audio).hexdigest()
+        cached = self.shared.get("transcript", cache_key)
+        if cached:
+            job.status = "running"
+            job.started_at = time.time()
+            self._transcribed(job, cached, on_transcript)
+            return
+
+        waiting = self.shared.queue_length(TRANSCRIPTION_QUEUE)
+        if waiting >= self.whisper_admission.queue_limit:
+            self._drop(job)
+            raise self.whisper_admission.reject(waiting)
+
+        payload = json.dumps({
+            "audio": base64.b64encode(audio).decode("ascii"),
+            "suffix": os.path.splitext(audio_path)[1] or ".wav",
+            "model_size": model_size,
+            "cache_key": cache_key,
+        })
+        with self._lock:
+            self._shared_waits[job.id] = (on_transcript, time.time())
+        try:
+            self.shared.push(TRANSCRIPTION_QUEUE, job.id, payload)
+        except BACKEND_ERRORS:
+            with self._lock:
+                self._shared_waits.pop(job.id, None)
+            raise
+
+    def transcribe_samples(self, samples, model_size: str = "base", prompt: Optional[str] = None) -> Future:
+        """
+        Transcribe in-memory audio in a Whisper worker process
+
+        Used for live streams, where each call is short and the caller waits on
+        the future directly instead of polling a job.
+
+        Args:
+            samples: 16 kHz mono float32 numpy array
+            model_size: Whisper model size
+            prompt: Text spoken just before this audio
+
+        Streams were admitted when they started, so each call goes to the
+        front of the transcription queue rather than being rejected.
+
+        Returns:
+            Future resolving to the text (None on error)
+        """
+        result: Future = Future()
+        key = uuid.uuid4().hex
+
+        def start():
+            if not result.set_running_or_notify_cancel():
+                self.whisper_admission.release(key)
+                return
+            try:
+                future = self._ensure_processes().submit(_transcribe_samples_in_process, samples, model_size, prompt)
+            except Exception as e:
+                self.whisper_admission.release(key)
+                result.set_exception(e)
+                return
+            future.add_done_callback(relay)
+
+        def relay(future: Future):
+            self.whisper_admission.release(key)
+            if future.cancelled():
+                result.set_exception(JobCancelled())
+            elif future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                text, seconds = future.result()
+                _record_transcription("transcribe_samples", text, seconds, len(samples) / 16000)
+                result.set_result(text)
+
+        self.whisper_admission.submit(key, start, priority=True)
+        return result
+
+    def submit_story(self, translator, medical_text: str, style: str,
+                     templates: Optional[Dict[str, str]] = None,
+                     on_personalized: Optional[Callable[[str], None]] = None,
+                     meta: Optional[Dict] = None,
+                     on_delta: Optional[Callable[[str], None]] = None, priority: bool = False) -> str:
+        """
+        Stream a story from Claude in the background
+
+        While running, job.progress holds the formatted story so far.
+
+        Args:
+            on_delta: Called on the worker thread with each raw text delta
+
+        Returns:
+            Job id; the result is a dict with the raw and formatted story
+
+        Raises:
+            ServerBusy: Too many story jobs are already waiting
+        """
+        return self.submit("story", _stream_story, translator, medical_text, style, templates,
+                           on_personalized, on_delta, meta=meta, priority=priority)
+
+    def submit_multilingual_story(self, translator, medical_text: str, style: str, languages: List[str],
+                                  templates: Optional[Dict[str, str]] = None,
+                                  meta: Optional[Dict] = None, priority: bool = False) -> str:
+        """
+        Write the story in several languages from one Claude request in the background
+
+        The reply is structured rather than streamed, so job.progress stays
+        empty until every language is ready.
+
+        Returns:
+            Job id; the result is a dict with the raw and formatted story and
+            the raw story by language code
+
+        Raises:
+            ServerBusy: Too many story jobs are already waiting
+        """
+        return self.submit("story", _multilingual_story, translator, medical_text, style, languages,
+                           templates, meta=meta, priority=priority)
+
+    def submit_audio_story(self, audio_path: str, translator, style: str, model_size: str = "base",
+                           templates: Optional[Dict[str, str]] = None, delete_after: bool = False,
+                           meta: Optional[Dict] = None) -> str:
+        """
+        Transcribe a recording, then stream a story from the transcript, as one job
+
+        The transcription runs in a Whisper process and the story on the Claude
+        thread pool; no thread waits on Whisper in between.
+
+        Returns:
+            Job id; the result is a dict with the transcript, raw and formatted story
+
+        Raises:
+            ServerBusy: Too many transcriptions are already waiting
+        """
+        job = Job("audio_story", meta)
+        self._register(job)
+
+        def write_story(job: Job, transcript: str):
+            result = _stream_story(job, translator, transcript, style, templates)
+            result["transcript"] = transcript
+            return result
+
+        def transcribed(transcript: str):
+            if delete_after:
+                _remove(audio_path)
+            job.meta["transcript"] = transcript
+            # The Whisper slot goes to the next recording while the story waits for a Claude slot
+            self._release(job)
+            job.status = "queued"
+            self._admit(job, self.claude_admission,
+                        lambda: self._start_thread(job, write_story, (transcript,), {}), priority=True)
+
+        if delete_after:
+            job.add_done_callback(lambda _job: _remove(audio_path))
+        try:
+            self._start_transcription(job, audio_path, model_size, transcribed)
+        except ServerBusy:
+            if delete_after:
+                _remove(audio_path)
+            raise
+        return job.id
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        """
+        The job with this id, or None if it is unknown or expired
+
+        A job owned by another replica comes back as a read-only snapshot of
+        its last published state.
+        """
+        if not job_id:
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or self.shared is None:
+            return job
+        state = self._remote_state(job_id)
+        return Job.from_state(state) if state else None
+
+    def _remote_state(self, job_id: str) -> Optional[Dict]:
+        try:
+            state = self.shared.get("job", job_id)
+        except BACKEND_ERRORS as e:
+            print(f"Error reading shared job state: {e}")
+            return None
+        return json.loads(state) if state else None
+
+    def _publish(self, job: Job):
+        """Share the job's state so other replicas can report on it"""
+        if self.shared is None:
+            return
+        try:
+            self.shared.set("job", job.id, json.dumps(job.state(self.queue_position(job.id)), default=str),
+                            ttl=JOB_RETENTION_SECONDS)
+        except BACKEND_ERRORS as e:
+            print(f"Error publishing job state: {e}")
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a job
+
+        Queued jobs never start. Running Claude jobs stop at their next progress
+        report; a running transcription finishes in its process but its result
+        is discarded.
+
+        Returns:
+            True if the job was still active
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return self._cancel_remote(job_id)
+        if job.done:
+            return False
+        job.cancel_requested = True
+        if self.whisper_admission.withdraw(job.id) or self.claude_admission.withdraw(job.id):
+            self._finish(job)
+        elif job.future is not None and job.future.cancel():
+            self._finish(job)
+        elif self._withdraw_shared(job.id):
+            self._finish(job)
+        return True
+
+    def _withdraw_shared(self, job_id: str) -> bool:
+        """Take a recording back out of the shared queue before a worker claims it"""
+        with self._lock:
+            if job_id not in self._shared_waits:
+                return False
+        try:
+            if not self.shared.remove(TRANSCRIPTION_QUEUE, job_id):
+                return False
+        except BACKEND_ERRORS as e:
+            print(f"Error withdrawing from the shared transcription queue: {e}")
+            return False
+        with self._lock:
+            self._shared_waits.pop(job_id, None)
+        return True
+
+    def _cancel_remote(self, job_id: str) -> bool:
+        """Ask the replica that owns a job to cancel it"""
+        if self.shared is None:
+            return False
+        state = self._remote_state(job_id)
+        if state is None or state["status"] in ("done", "failed", "cancelled"):
+            return False
+        try:
+            self.shared.set("cancel", job_id, "1", ttl=JOB_RETENTION_SECONDS)
+        except BACKEND_ERRORS as e:
+            print(f"Error requesting cancellation: {e}")
+            return False
+        return True
+
+    def queue_position(self, job_id: str) -> Optional[int]:
+        """1-based place of a queued job in line for a worker, None once it has one"""
+        position = self.whisper_admission.position(job_id) or self.claude_admission.position(job_id)
+        if position or self.shared is None:
+            return position
+        with self._lock:
+            local = job_id in self._jobs
+            shared_wait = job_id in self._shared_waits
+        try:
+            if shared_wait:
+                return self.shared.queue_position(TRANSCRIPTION_QUEUE, job_id)
+        except BACKEND_ERRORS as e:
+            print(f"Error reading the shared transcription queue: {e}")
+            return None
+        if local:
+            return None
+        state = self._remote_state(job_id)
+        return state.get("queue_position") if state else None
+
+    def check_capacity(self, transcription: bool = False):
+        """
+        Fail fast before accepting an upload or a stream
+
+        Raises:
+            ServerBusy: New work of that kind would be rejected
+        """
+        (self.whisper_admission if transcription else self.claude_admission).check()
+        if transcription and self.shared is not None:
+            waiting = self._shared_queue_length()
+            if waiting is not None and waiting >= self.whisper_admission.queue_limit:
+                raise self.whisper_admission.reject(waiting)
+
+    def _shared_queue_length(self) -> Optional[int]:
+        try:
+            return self.shared.queue_length(TRANSCRIPTION_QUEUE)
+        except BACKEND_ERRORS as e:
+            print(f"Error reading the shared transcription queue: {e}")
+            return None
+
+    def admission_stats(self) -> Dict[str, Dict]:
+        """Slots, queue lengths and rejections for each kind of work"""
+        stats = {
+            "transcription": self.whisper_admission.stats(),
+            "story": self.claude_admission.stats(),
+            "rss_mb": self._rss_mb(),
+        }
+        if self.shared is not None:
+            stats["shared_transcription_queue"] = self._shared_queue_length()
+        return stats
+
+    def _sync_loop(self):
+        """Publish active jobs, apply remote cancellations and collect shared transcriptions"""
+        while not self._stopping.wait(SYNC_SECONDS):
+            with self._lock:
+                active = [job for job in self._jobs.values() if not job.done]
+            for job in active:
+                try:
+                    if self.shared.get("cancel", job.id):
+                        self.shared.delete("cancel", job.id)
+                        self.cancel(job.id)
+                    else:
+                        self._collect_shared(job)
+                except BACKEND_ERRORS as e:
+                    print(f"Error syncing job {job.id}: {e}")
+                if not job.done:
+                    self._publish(job)
+
+    def _collect_shared(self, job: Job):
+        """Pick up the transcript of a recording this replica put in the shared queue"""
+        with self._lock:
+            wait = self._shared_waits.get(job.id)
+        if wait is None:
+            return
+        on_transcript, pushed_at = wait
+
+        reply = self.shared.get("transcription_result", job.id)
+        if reply is None:
+            if time.time() - pushed_at > SHARED_TRANSCRIPTION_TIMEOUT_SECONDS:
+                with self._lock:
+                    self._shared_waits.pop(job.id, None)
+                self._finish(job, error="Transcription timed out")
+            elif job.status == "queued" and self.shared.queue_position(TRANSCRIPTION_QUEUE, job.id) is None:
+                # Claimed by a worker on some replica
+                job.status = "running"
+            return
+
+        with self._lock:
+            self._shared_waits.pop(job.id, None)
+        self.shared.delete("transcription_result", job.id)
+        result = json.loads(reply)
+        if result.get("error"):
+            self._finish(job, error=result["error"])
+            return
+        job.started_at = result.get("started") or time.time()
+        self._transcribed(job, result.get("text"), on_transcript)
+
+    def _shared_worker(self):
+        """Claim recordings from the shared queue, whichever replica they came from"""
+        while not self._stopping.is_set():
+            try:
+                item = self.shared.claim(TRANSCRIPTION_QUEUE, timeout=1.0)
+            except BACKEND_ERRORS as e:
+                print(f"Error claiming shared transcription work: {e}")
+                self._stopping.wait(1.0)
+                continue
+            if item is not None:
+                self._transcribe_shared(*item)
+
+    def _transcribe_shared(self, item_id: str, payload: str):
+        request = json.loads(payload)
+        fd, audio_path = tempfile.mkstemp(suffix=request["suffix"])
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(base64.b64decode(request["audio"]))
+            # Already admitted to the shared queue, so it is never rejected here
+            with self.whisper_admission.slot(priority=True):
+                text, started, seconds, audio_seconds = self._ensure_processes().submit(
+                    _transcribe_in_process, audio_path, request["model_size"], _claim_profile_dir()
+                ).result()
+            _record_transcription("transcribe_audio", text, seconds, audio_seconds)
+            reply = {"text": text, "started": started}
+        except Exception as e:
+            reply = {"error": str(e)}
+        finally:
+            _remove(audio_path)
+
+        try:
+            if reply.get("text"):
+                self.shared.set("transcript", request["cache_key"], reply["text"], ttl=TRANSCRIPT_TTL_SECONDS)
+            self.shared.set("transcription_result", item_id, json.dumps(reply), ttl=JOB_RETENTION_SECONDS)
+        except BACKEND_ERRORS as e:
+            print(f"Error returning a shared transcription: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        """Number of jobs in each status"""
+        counts: Dict[str, int] = {}
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def shutdown(self):
+        self._stopping.set()
+        # Drop queued jobs by hand; shutdown(cancel_futures=True) needs Python 3.9
+        with self._lock:
+            futures = [job.future for job in self._jobs.values() if job.future is not None]
+        for future in futures:
+            future.cancel()
+        self._threads.shutdown(wait=False)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False)
+
+
+def _remove(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _stream_story(job: Job, translator, medical_text: str, style: str,
+                  templates: Optional[Dict[str, str]] = None,
+                  on_personalized: Optional[Callable[[str], None]] = None,
+                  on_delta: Optional[Callable[[str], None]] = None) -> Dict[str, str]:
+    """Stream a story into job.progress and return the raw and formatted text"""
+    live_story = IncrementalStoryFormatter(style, templates)
+    try:
+        for delta in translator.stream_storybook(medical_text, style, on_personalized=on_personalized):
+            live_story.feed(delta)
+            job.report(live_story.preview())
+            if on_delta:
+                on_delta(delta)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        # A story cut off mid-stream fails the job rather than being saved half-written
+        raise RuntimeError(f"Story magic failed: {e}") from e
+    live_story.finish()
+    if not live_story.raw_text:
+        raise RuntimeError("Story magic failed. Check your settings!")
+    return {"story": live_story.raw_text, "formatted": live_story.text}
+
+
+def _multilingual_story(job: Job, translator, medical_text: str, style: str, languages: List[str],
+                        templates: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """Write the story in every language and return it raw, formatted and by language"""
+    stories = translator.translate_to_storybook_multilingual(medical_text, languages, style)
+    if not stories:
+        raise RuntimeError("Story magic failed. Check your settings!")
+    formatter = StorybookFormatter()
+    if templates:
+        formatter.story_templates = templates
+    return {
+        "story": MULTILINGUAL_SEPARATOR.join(stories.values()),
+        "formatted": formatter.format_multilingual(stories, style),
+        "stories": stories,
+    }
+
+
+_shared_executor: Optional[JobExecutor] = None
+_shared_lock = threading.Lock()
+
+
+def get_job_executor() -> JobExecutor:
+    """
+    The executor shared by every session in this server process
+
+    Cooperates with other replicas when SHARED_BACKEND_URL is set.
+    """
+    global _shared_executor
+    with _shared_lock:
+        if _shared_executor is None:
+            _shared_executor = JobExecutor(shared=get_shared_backend())
+        return _shared_executor
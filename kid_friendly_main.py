@@ -2,10 +2,27 @@ import streamlit as st
 import os
 import tempfile
 import time
-from audio_recorder import AudioRecorder
-from speech_to_text import SpeechToText
+from typing import List, Optional
+from admission_control import ServerBusy
+from instrumentation import count_cache
+from job_executor import get_job_executor
 from medical_translator import MedicalTranslator
-from storybook_formatter import StorybookFormatter
+from narration import get_shared_narrator
+from near_duplicate_cache import same_medical_content
+from story_exporter import BOOK_FORMAT_LABELS, EXPORT_FORMATS, book_formats, get_shared_exporter
+from story_languages import DEFAULT_LANGUAGE, STORY_LANGUAGES, native_name
+from profiling import get_profiler
+from story_store import get_shared_store
+from storybook_formatter import ChapterBookWriter, StorybookFormatter
+from streamlit_helpers import (choose_microphone, current_book_id, get_query_param, get_recorder,
+                               job_status_message, show_admin_controls, set_query_param, show_busy,
+                               show_story_history)
+
+# How often the page refreshes while a background job is running
+JOB_POLL_SECONDS = 0.5
+
+# Start writing the story while the parent is still reviewing the text
+SPECULATIVE_STORIES = os.getenv("SPECULATIVE_STORIES", "0").lower() in ("1", "true", "yes")
 
 # Page configuration with kid-friendly theme
 st.set_page_config(
@@ -106,25 +123,119 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+def remember_job(name: str, job_id: Optional[str]):
+    """Keep a background job id in session state and the URL so a refresh can pick it back up"""
+    st.session_state[name] = job_id
+    set_query_param(name, job_id)
+
+def submit_story_job(job_executor, store, text: str, style: str, personalize: bool,
+                     languages: List[str]) -> str:
+    """
+    Start writing a story in the background
+
+    The job keeps the story entry so a refreshed page can still finish it.
+    Several languages come back from one request instead of a stream.
+
+    Raises:
+        ServerBusy: Too many stories are already waiting
+    """
+    story_entry = {
+        'original': text,
+        'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'style': style,
+        'languages': languages
+    }
+    formatter = st.session_state.formatter
+    if languages != [DEFAULT_LANGUAGE]:
+        return job_executor.submit_multilingual_story(
+            st.session_state.translator,
+            text,
+            style,
+            languages,
+            formatter.story_templates,
+            meta=story_entry
+        )
+    
+    def use_personalized_story(personalized, entry=story_entry, style=style):
+        # Runs on a background thread once the personalized story arrives
+        entry['story'] = formatter.format_storybook(personalized, style)
+        if 'id' in entry:
+            store.update_story(entry['id'], entry['story'])
+    
+    return job_executor.submit_story(
+        st.session_state.translator,
+        text,
+        style,
+        formatter.story_templates,
+        on_personalized=use_personalized_story if personalize else None,
+        meta=story_entry
+    )
+
+def speculate_story(job_executor, store, text: str, style: str, personalize: bool, languages: List[str]):
+    """Start the story for text under review, so it is ready (or nearly) when the parent approves"""
+    job = job_executor.get(st.session_state.speculative_job)
+    if (job is not None and job.status != "failed" and job.meta.get('original') == text
+            and job.meta.get('style') == style and job.meta.get('languages') == languages):
+        return
+    discard_speculative_story(job_executor)
+    try:
+        remember_job('speculative_job', submit_story_job(job_executor, store, text, style, personalize, languages))
+    except ServerBusy:
+        # Only a head start; the story is requested again on approval
+        pass
+
+def discard_speculative_story(job_executor):
+    if st.session_state.speculative_job:
+        job_executor.cancel(st.session_state.speculative_job)
+        remember_job('speculative_job', None)
+
+def take_speculative_story(job_executor, approved_text: str, style: str, languages: List[str]) -> Optional[str]:
+    """
+    The speculative story job, if it still fits the approved text
+
+    Edits that leave the medical content alone keep the story; anything else
+    cancels it so a new one is written from the edited text.
+
+    Returns:
+        The job id to follow, or None if a new story is needed
+    """
+    job = job_executor.get(st.session_state.speculative_job)
+    if job is None:
+        remember_job('speculative_job', None)
+        return None
+    fits = (job.status not in ("failed", "cancelled") and job.meta.get('style') == style
+            and job.meta.get('languages') == languages
+            and same_medical_content(job.meta['original'], approved_text))
+    count_cache("speculative_story", hit=fits)
+    if not fits:
+        discard_speculative_story(job_executor)
+        return None
+    remember_job('speculative_job', None)
+    # Saved with the wording the parent approved, at the time they approved it
+    job.meta['original'] = approved_text
+    job.meta['timestamp'] = time.strftime("%Y-%m-%d %H:%M:%S")
+    return job.id
+
 # Initialize session state
-if 'recorder' not in st.session_state:
-    st.session_state.recorder = AudioRecorder()
-if 'stt' not in st.session_state:
-    st.session_state.stt = SpeechToText()
 if 'translator' not in st.session_state:
     st.session_state.translator = MedicalTranslator()
 if 'formatter' not in st.session_state:
     st.session_state.formatter = StorybookFormatter()
 if 'recording' not in st.session_state:
     st.session_state.recording = False
-if 'stories' not in st.session_state:
-    st.session_state.stories = []
+if 'chapter_book' not in st.session_state:
+    st.session_state.chapter_book = ChapterBookWriter()
 if 'transcribed_text' not in st.session_state:
     st.session_state.transcribed_text = ""
 if 'show_review' not in st.session_state:
     st.session_state.show_review = False
+for job_name in ('transcription_job', 'story_job', 'speculative_job'):
+    if job_name not in st.session_state:
+        st.session_state[job_name] = get_query_param(job_name)
 
 def main():
+    show_admin_controls()
+    
     # Fun animated title
     st.markdown('<h1 class="big-title">🌈 My Medical Story Maker 🌈</h1>', unsafe_allow_html=True)
     st.markdown('<p style="text-align: center; font-size: 1.5rem; color: #FF6B9D;">✨ Turn doctor visits into magical stories! ✨</p>', unsafe_allow_html=True)
@@ -145,14 +256,7 @@ def main():
         
         # Audio device selection
         st.subheader("🎤 Microphone Setup")
-        devices = st.session_state.recorder.get_available_devices()
-        input_devices = [f"{i}: {device['name']}" for i, device in enumerate(devices) 
-                        if device['max_input_channels'] > 0]
-        
-        if input_devices:
-            selected_device = st.selectbox("Select Microphone", input_devices)
-            device_id = int(selected_device.split(':')[0])
-            st.session_state.recorder.set_device(device_id)
+        choose_microphone("Select Microphone")
         
         # Story style selection
         st.subheader("📖 Story Theme")
@@ -167,6 +271,27 @@ def main():
             }[x]
         )
         
+        story_languages = st.multiselect(
+            "🌍 Story Languages",
+            list(STORY_LANGUAGES),
+            default=[DEFAULT_LANGUAGE],
+            format_func=native_name,
+            help="Every language is written in the same request, so extra languages add little wait"
+        ) or [DEFAULT_LANGUAGE]
+        
+        personalize_stories = st.checkbox(
+            "✨ Personalize instant stories",
+            value=True,
+            help="Common visits get a ready-made story right away, then a personalized one replaces it"
+        )
+        
+        speculative_stories = st.checkbox(
+            "⚡ Start the story during review",
+            value=SPECULATIVE_STORIES,
+            help="The story is written while you review the text. Small fixes keep it; "
+                 "changing a medicine, dose or diagnosis starts it over"
+        )
+        
         st.markdown('</div>', unsafe_allow_html=True)
         
         # Instructions for parents
@@ -187,6 +312,14 @@ def main():
         """)
         st.markdown('</div>', unsafe_allow_html=True)
     
+    # Whisper and Claude run in the background; this page only polls them
+    job_executor = get_job_executor()
+    keep_polling = False
+    
+    # Stories are saved in the story store, not in session memory
+    store = get_shared_store()
+    book_id = current_book_id()
+    
     # Main interface with kid-friendly design
     col1, col2 = st.columns([1, 1])
     
@@ -198,38 +331,45 @@ def main():
         if not st.session_state.recording:
             if st.button("🔴 Start Recording Your Story!", type="primary"):
                 st.session_state.recording = True
-                st.session_state.recorder.start_recording()
+                get_recorder().start_recording()
                 st.rerun()
         else:
             st.markdown('<div class="recording-pulse">', unsafe_allow_html=True)
             st.error("🎙️ Recording... Tell me what the doctor said!")
             if st.button("⏹️ Stop Recording", type="secondary"):
                 st.session_state.recording = False
-                audio_file = st.session_state.recorder.stop_recording()
-                
-                if audio_file:
-                    with st.spinner("🔄 Listening to your story..."):
-                        transcribed_text = st.session_state.stt.transcribe_audio(audio_file)
-                    
-                    if transcribed_text:
-                        st.session_state.transcribed_text = transcribed_text
-                        st.session_state.show_review = True
-                        st.success("✅ Got it! Let's review together!")
-                    else:
-                        st.error("❌ Oops! I couldn't hear clearly. Try again!")
-                    
-                    # Clean up temp file
-                    try:
-                        os.unlink(audio_file)
-                    except:
-                        pass
+                audio_file = get_recorder().stop_recording()
                 
-                st.rerun()
+                try:
+                    if audio_file:
+                        # The temp file is cleaned up once the transcription job finishes
+                        remember_job('transcription_job', job_executor.submit_transcription(audio_file, delete_after=True))
+                    st.rerun()
+                except ServerBusy as e:
+                    show_busy(e)
             st.markdown('</div>', unsafe_allow_html=True)
         
         # Recording status
         if st.session_state.recording:
-            st.session_state.recorder.record_chunk(0.1)
+            get_recorder().record_chunk(0.1)
+        
+        # Transcription progress
+        transcription_job = job_executor.get(st.session_state.transcription_job)
+        if transcription_job is not None and not transcription_job.done:
+            st.info(job_status_message(job_executor, transcription_job, "🔄 Listening to your story..."))
+            if st.button("✋ Stop Listening"):
+                job_executor.cancel(transcription_job.id)
+                remember_job('transcription_job', None)
+                st.rerun()
+            keep_polling = True
+        elif st.session_state.transcription_job:
+            if transcription_job is not None and transcription_job.status == "done":
+                st.session_state.transcribed_text = transcription_job.result
+                st.session_state.show_review = True
+                st.success("✅ Got it! Let's review together!")
+            elif transcription_job is not None and transcription_job.status == "failed":
+                st.error("❌ Oops! I couldn't hear clearly. Try again!")
+            remember_job('transcription_job', None)
         
         st.markdown("### 📝 Or Type It Here!")
         manual_text = st.text_area(
@@ -245,12 +385,51 @@ def main():
         
         st.markdown('</div>', unsafe_allow_html=True)
         
+        # Story progress, with paragraphs shown as soon as Claude finishes writing them
+        story_job = job_executor.get(st.session_state.story_job)
+        if story_job is not None and not story_job.done:
+            st.markdown("## 🪄 Creating your magical story...")
+            if job_executor.queue_position(story_job.id):
+                st.info(job_status_message(job_executor, story_job, ""))
+            st.markdown('<div class="story-display">', unsafe_allow_html=True)
+            st.markdown(story_job.progress or "✨ ...")
+            st.markdown('</div>', unsafe_allow_html=True)
+            if st.button("✋ Stop This Story"):
+                job_executor.cancel(story_job.id)
+                remember_job('story_job', None)
+                st.rerun()
+            keep_polling = True
+        elif st.session_state.story_job:
+            if story_job is not None and story_job.status == "done":
+                # The entry may already hold a personalized story
+                story_entry = story_job.meta
+                saved_story = story_entry.setdefault('story', story_job.result['formatted'])
+                # Save the languages that actually came back, in the order their sections are shown
+                saved_languages = list(story_job.result.get('stories', {})) or story_entry.get('languages')
+                story_entry['id'] = store.add(book_id, saved_story, original=story_entry['original'],
+                                              style=story_entry['style'], timestamp=story_entry['timestamp'],
+                                              languages=saved_languages)
+                if story_entry['story'] is not saved_story:
+                    # The personalized story arrived while this one was being saved
+                    store.update_story(story_entry['id'], story_entry['story'])
+                st.session_state.show_review = False
+                st.session_state.transcribed_text = ""
+                remember_job('story_job', None)
+                st.rerun()
+            elif story_job is not None and story_job.status == "failed":
+                st.error(f"❌ Oops! Something went wrong: {story_job.error}")
+            remember_job('story_job', None)
+        
         # Review section for parents
-        if st.session_state.show_review and st.session_state.transcribed_text:
+        if st.session_state.show_review and st.session_state.transcribed_text and not keep_polling:
             st.markdown('<div class="parent-section">', unsafe_allow_html=True)
             st.markdown("## 👨‍👩‍👧‍👦 Parent Review")
             st.markdown("**Please review the text before creating the story:**")
             
+            if speculative_stories:
+                speculate_story(job_executor, store, st.session_state.transcribed_text, story_style,
+                                personalize_stories, story_languages)
+            
             # Editable text area for review
             reviewed_text = st.text_area(
                 "Edit if needed:",
@@ -262,29 +441,21 @@ def main():
             col_a, col_b = st.columns(2)
             with col_a:
                 if st.button("✨ Create Magic Story!", type="primary"):
-                    with st.spinner("🪄 Creating your magical story..."):
-                        try:
-                            story = st.session_state.translator.translate_to_storybook(reviewed_text)
-                            
-                            if story:
-                                formatted_story = st.session_state.formatter.format_storybook(story, story_style)
-                                st.session_state.stories.append({
-                                    'original': reviewed_text,
-                                    'story': formatted_story,
-                                    'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
-                                    'style': story_style
-                                })
-                                st.session_state.show_review = False
-                                st.session_state.transcribed_text = ""
-                                st.success("📚 Your story is ready!")
-                                st.rerun()
-                            else:
-                                st.error("❌ Story magic failed. Check your settings!")
-                        except Exception as e:
-                            st.error(f"❌ Oops! Something went wrong: {str(e)}")
+                    # A story started during review is used if the edits kept its medical details
+                    story_job_id = take_speculative_story(job_executor, reviewed_text, story_style,
+                                                          story_languages)
+                    try:
+                        remember_job('story_job', story_job_id or submit_story_job(
+                            job_executor, store, reviewed_text, story_style, personalize_stories,
+                            story_languages
+                        ))
+                        st.rerun()
+                    except ServerBusy as e:
+                        show_busy(e)
             
             with col_b:
                 if st.button("🔄 Start Over"):
+                    discard_speculative_story(job_executor)
                     st.session_state.show_review = False
                     st.session_state.transcribed_text = ""
                     st.rerun()
@@ -318,13 +489,25 @@ def main():
         st.markdown('<div class="fun-box">', unsafe_allow_html=True)
         st.markdown("## 📚 Your Magical Stories!")
         
-        if st.session_state.stories:
+        latest_story = store.latest(book_id)
+        if latest_story:
             # Show latest story with fun styling
-            latest_story = st.session_state.stories[-1]
             st.markdown('<div class="story-display">', unsafe_allow_html=True)
             st.markdown(latest_story['story'])
             st.markdown('</div>', unsafe_allow_html=True)
             
+            # Read-aloud for kids who can't read yet; players appear as each paragraph is ready
+            narrator = get_shared_narrator()
+            if narrator.available and st.button("🔊 Read It To Me!"):
+                # Saved in section order, so this is the first section's (or the only) language
+                story_language = latest_story['languages'].split(',')[0]
+                with st.spinner("🎙️ Warming up the storyteller..."):
+                    for paragraph, audio in narrator.narrate(latest_story['story'], story_language):
+                        if audio:
+                            st.audio(audio, format="audio/wav")
+                        else:
+                            st.caption(f"🤐 Couldn't read this part: {paragraph[:60]}")
+            
             # Interactive elements
             if st.checkbox("🎨 Add Fun Activities!", value=True):
                 interactive_story = st.session_state.formatter.add_interactive_elements(latest_story['story'])
@@ -332,19 +515,17 @@ def main():
                 st.markdown(interactive_story)
                 st.markdown('</div>', unsafe_allow_html=True)
             
-            # Story history
-            if len(st.session_state.stories) > 1:
-                st.markdown("### 📖 Your Story Collection")
-                for i, story_data in enumerate(reversed(st.session_state.stories[:-1])):
-                    theme_emoji = {
-                        "friendly": "🐻", "adventure": "🗺️", 
-                        "magical": "✨", "superhero": "🦸"
-                    }.get(story_data.get('style', 'friendly'), '📚')
-                    
-                    with st.expander(f"{theme_emoji} Story {len(st.session_state.stories) - i - 1} - {story_data['timestamp']}"):
-                        st.markdown('<div class="story-display">', unsafe_allow_html=True)
-                        st.markdown(story_data['story'])
-                        st.markdown('</div>', unsafe_allow_html=True)
+            # Story history, one page at a time
+            theme_emoji = {
+                "friendly": "🐻", "adventure": "🗺️", 
+                "magical": "✨", "superhero": "🦸"
+            }
+            show_story_history(
+                store,
+                book_id,
+                heading="📖 Your Story Collection",
+                label=lambda story_data: f"{theme_emoji.get(story_data['style'], '📚')} {story_data['title']} - {story_data['timestamp']}"
+            )
             
             # Export options with kid-friendly design
             st.markdown("### 💾 Save Your Stories!")
@@ -352,20 +533,37 @@ def main():
             col_save1, col_save2 = st.columns(2)
             
             with col_save1:
+                book_format = st.selectbox(
+                    "📁 Book Format",
+                    # PDF only when its fonts can show every story's script
+                    book_formats(store.languages(book_id)),
+                    format_func=BOOK_FORMAT_LABELS.get
+                )
+                
                 if st.button("📄 Make Story Book"):
-                    all_stories = [story['story'] for story in st.session_state.stories]
-                    complete_book = st.session_state.formatter.create_chapter_format(all_stories)
+                    all_stories = store.iter_stories(book_id)
+                    if book_format == "md":
+                        # Only stories added since the last export get rendered
+                        st.session_state.chapter_book.sync(all_stories)
+                        complete_book = st.session_state.chapter_book.getvalue()
+                        book_mime = "text/markdown"
+                    else:
+                        # Chapters rendered in an earlier export come from the exporter's cache
+                        complete_book = get_shared_exporter().export_bytes(all_stories, book_format, story_style)
+                        book_mime = EXPORT_FORMATS[book_format]["mime"]
                     
                     st.download_button(
                         label="📥 Download Story Book",
                         data=complete_book,
-                        file_name=f"my_medical_storybook_{time.strftime('%Y%m%d')}.md",
-                        mime="text/markdown"
+                        file_name=f"my_medical_storybook_{time.strftime('%Y%m%d')}.{book_format}",
+                        mime=book_mime
                     )
             
             with col_save2:
                 if st.button("🗑️ Clear All Stories"):
-                    st.session_state.stories = []
+                    store.clear(book_id)
+                    st.session_state.chapter_book.clear()
+                    st.session_state.history_page = 0
                     st.rerun()
         else:
             # Welcome message with animations
@@ -411,6 +609,13 @@ def main():
     <p style="font-size: 1.1rem;">🌈 Every visit is a new adventure! 🌈</p>
     </div>
     """, unsafe_allow_html=True)
+    
+    # Check on background jobs again shortly; other widgets stay usable meanwhile
+    if keep_polling:
+        time.sleep(JOB_POLL_SECONDS)
+        st.rerun()
 
 if __name__ == "__main__":
-    main()
+    # Profiled when STORYBOOK_PROFILE_RUNS or the admin controls armed the profiler
+    with get_profiler().profile("kid_friendly_main"):
+        main()
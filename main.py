@@ -2,10 +2,17 @@ import streamlit as st
 import os
 import tempfile
 import time
-from audio_recorder import AudioRecorder
-from speech_to_text import SpeechToText
+from typing import Optional
+from admission_control import ServerBusy
+from job_executor import get_job_executor
 from medical_translator import MedicalTranslator
-from storybook_formatter import StorybookFormatter
+from story_exporter import BOOK_FORMAT_LABELS, EXPORT_FORMATS, book_formats, get_shared_exporter
+from profiling import get_profiler
+from story_store import get_shared_store
+from storybook_formatter import ChapterBookWriter, StorybookFormatter
+from streamlit_helpers import (choose_microphone, current_book_id, get_query_param, get_recorder,
+                               job_status_message, show_admin_controls, set_query_param, show_busy,
+                               show_story_history)
 
 # Page configuration
 st.set_page_config(
@@ -14,21 +21,49 @@ st.set_page_config(
     layout="wide"
 )
 
+# How often the page refreshes while a background job is running
+JOB_POLL_SECONDS = 0.5
+
+def remember_job(name: str, job_id: Optional[str]):
+    """Keep a background job id in session state and the URL so a refresh can pick it back up"""
+    st.session_state[name] = job_id
+    set_query_param(name, job_id)
+
+def start_story_job(text: str, style: str) -> bool:
+    entry = {
+        'original': text,
+        'style': style,
+        'timestamp': time.strftime("%Y-%m-%d %H:%M:%S")
+    }
+    try:
+        remember_job('story_job', get_job_executor().submit_story(
+            st.session_state.translator,
+            text,
+            style,
+            st.session_state.formatter.story_templates,
+            meta=entry
+        ))
+    except ServerBusy as e:
+        show_busy(e)
+        return False
+    return True
+
 # Initialize session state
-if 'recorder' not in st.session_state:
-    st.session_state.recorder = AudioRecorder()
-if 'stt' not in st.session_state:
-    st.session_state.stt = SpeechToText()
 if 'translator' not in st.session_state:
     st.session_state.translator = MedicalTranslator()
 if 'formatter' not in st.session_state:
     st.session_state.formatter = StorybookFormatter()
 if 'recording' not in st.session_state:
     st.session_state.recording = False
-if 'stories' not in st.session_state:
-    st.session_state.stories = []
+if 'chapter_book' not in st.session_state:
+    st.session_state.chapter_book = ChapterBookWriter()
+for job_name in ('transcription_job', 'story_job'):
+    if job_name not in st.session_state:
+        st.session_state[job_name] = get_query_param(job_name)
 
 def main():
+    show_admin_controls()
+    
     st.title("🏥📚 Medical Storybook Translator")
     st.markdown("*Transform medical visits into kid-friendly storybooks!*")
     
@@ -45,14 +80,7 @@ def main():
             st.success("✅ Claude API connected")
         
         # Audio device selection
-        devices = st.session_state.recorder.get_available_devices()
-        input_devices = [f"{i}: {device['name']}" for i, device in enumerate(devices) 
-                        if device['max_input_channels'] > 0]
-        
-        if input_devices:
-            selected_device = st.selectbox("🎤 Select Microphone", input_devices)
-            device_id = int(selected_device.split(':')[0])
-            st.session_state.recorder.set_device(device_id)
+        choose_microphone("🎤 Select Microphone")
         
         # Story style selection
         story_style = st.selectbox(
@@ -60,6 +88,14 @@ def main():
             ["friendly", "adventure", "magical", "superhero"]
         )
     
+    # Whisper and Claude run in the background; this page only polls them
+    job_executor = get_job_executor()
+    keep_polling = False
+    
+    # Stories are saved in the story store, not in session memory
+    store = get_shared_store()
+    book_id = current_book_id()
+    
     # Main interface
     col1, col2 = st.columns([1, 1])
     
@@ -70,77 +106,83 @@ def main():
         if not st.session_state.recording:
             if st.button("🔴 Start Recording", type="primary"):
                 st.session_state.recording = True
-                st.session_state.recorder.start_recording()
+                get_recorder().start_recording()
                 st.rerun()
         else:
             if st.button("⏹️ Stop Recording", type="secondary"):
                 st.session_state.recording = False
-                audio_file = st.session_state.recorder.stop_recording()
-                
-                if audio_file:
-                    with st.spinner("🔄 Converting speech to text..."):
-                        transcribed_text = st.session_state.stt.transcribe_audio(audio_file)
-                    
-                    if transcribed_text:
-                        st.success("✅ Audio transcribed successfully!")
-                        st.text_area("📝 Transcribed Text:", transcribed_text, height=100)
-                        
-                        with st.spinner("🪄 Creating your storybook..."):
-                            story = st.session_state.translator.translate_to_storybook(transcribed_text)
-                            
-                        if story:
-                            formatted_story = st.session_state.formatter.format_storybook(story, story_style)
-                            st.session_state.stories.append({
-                                'original': transcribed_text,
-                                'story': formatted_story,
-                                'timestamp': time.strftime("%Y-%m-%d %H:%M:%S")
-                            })
-                            st.success("📚 Storybook created!")
-                        else:
-                            st.error("❌ Failed to create storybook")
-                    else:
-                        st.error("❌ Failed to transcribe audio")
-                    
-                    # Clean up temp file
-                    try:
-                        os.unlink(audio_file)
-                    except:
-                        pass
+                audio_file = get_recorder().stop_recording()
                 
-                st.rerun()
+                try:
+                    if audio_file:
+                        # The temp file is cleaned up once the transcription job finishes
+                        remember_job('transcription_job', job_executor.submit_transcription(
+                            audio_file, delete_after=True, meta={'style': story_style}
+                        ))
+                    st.rerun()
+                except ServerBusy as e:
+                    show_busy(e)
         
         # Recording status
         if st.session_state.recording:
             st.warning("🎙️ Recording in progress... Click 'Stop Recording' when finished.")
             # Record audio chunks in real-time
-            st.session_state.recorder.record_chunk(0.1)
+            get_recorder().record_chunk(0.1)
+        
+        # Transcription progress; a finished transcription goes straight on to a story
+        transcription_job = job_executor.get(st.session_state.transcription_job)
+        if transcription_job is not None and not transcription_job.done:
+            st.info(job_status_message(job_executor, transcription_job, "🔄 Converting speech to text..."))
+            if st.button("✖️ Cancel Transcription"):
+                job_executor.cancel(transcription_job.id)
+                remember_job('transcription_job', None)
+                st.rerun()
+            keep_polling = True
+        elif st.session_state.transcription_job:
+            if transcription_job is not None and transcription_job.status == "done":
+                st.success("✅ Audio transcribed successfully!")
+                st.text_area("📝 Transcribed Text:", transcription_job.result, height=100)
+                start_story_job(transcription_job.result, transcription_job.meta.get('style', story_style))
+            elif transcription_job is not None and transcription_job.status == "failed":
+                st.error("❌ Failed to transcribe audio")
+            remember_job('transcription_job', None)
+        
+        # Story progress, showing the story as Claude writes it
+        story_job = job_executor.get(st.session_state.story_job)
+        if story_job is not None and not story_job.done:
+            st.info(job_status_message(job_executor, story_job, "🪄 Creating your storybook..."))
+            if story_job.progress:
+                st.markdown(story_job.progress)
+            if st.button("✖️ Cancel Storybook"):
+                job_executor.cancel(story_job.id)
+                remember_job('story_job', None)
+                st.rerun()
+            keep_polling = True
+        elif st.session_state.story_job:
+            if story_job is not None and story_job.status == "done":
+                story_entry = story_job.meta
+                store.add(book_id, story_job.result['formatted'], original=story_entry['original'],
+                          style=story_entry['style'], timestamp=story_entry['timestamp'])
+                remember_job('story_job', None)
+                st.rerun()
+            elif story_job is not None and story_job.status == "failed":
+                st.error("❌ Failed to create storybook")
+            remember_job('story_job', None)
         
         # Manual text input option
         st.subheader("📝 Or Enter Text Manually")
         manual_text = st.text_area("Enter medical information:", height=150)
         
-        if st.button("🪄 Create Storybook from Text") and manual_text:
-            with st.spinner("🪄 Creating your storybook..."):
-                story = st.session_state.translator.translate_to_storybook(manual_text)
-                
-            if story:
-                formatted_story = st.session_state.formatter.format_storybook(story, story_style)
-                st.session_state.stories.append({
-                    'original': manual_text,
-                    'story': formatted_story,
-                    'timestamp': time.strftime("%Y-%m-%d %H:%M:%S")
-                })
-                st.success("📚 Storybook created!")
+        if st.button("🪄 Create Storybook from Text", disabled=keep_polling) and manual_text:
+            if start_story_job(manual_text, story_style):
                 st.rerun()
-            else:
-                st.error("❌ Failed to create storybook")
     
     with col2:
         st.header("📚 Your Storybooks")
         
-        if st.session_state.stories:
+        latest_story = store.latest(book_id)
+        if latest_story:
             # Show latest story
-            latest_story = st.session_state.stories[-1]
             st.markdown(latest_story['story'])
             
             # Add interactive elements
@@ -148,30 +190,43 @@ def main():
                 interactive_story = st.session_state.formatter.add_interactive_elements(latest_story['story'])
                 st.markdown(interactive_story)
             
-            # Story history
-            if len(st.session_state.stories) > 1:
-                st.subheader("📖 Previous Stories")
-                for i, story_data in enumerate(reversed(st.session_state.stories[:-1])):
-                    with st.expander(f"Story {len(st.session_state.stories) - i - 1} - {story_data['timestamp']}"):
-                        st.markdown(story_data['story'])
+            # Story history, one page at a time
+            show_story_history(store, book_id)
             
             # Export options
             st.subheader("💾 Export Options")
             
+            book_format = st.selectbox(
+                "📁 Book Format",
+                # PDF only when its fonts can show every story's script
+                book_formats(store.languages(book_id)),
+                format_func=BOOK_FORMAT_LABELS.get
+            )
+            
             if st.button("📄 Create Complete Storybook"):
-                all_stories = [story['story'] for story in st.session_state.stories]
-                complete_book = st.session_state.formatter.create_chapter_format(all_stories)
+                all_stories = store.iter_stories(book_id)
+                if book_format == "md":
+                    # Only stories added since the last export get rendered
+                    st.session_state.chapter_book.sync(all_stories)
+                    complete_book = st.session_state.chapter_book.getvalue()
+                    book_mime = "text/markdown"
+                else:
+                    # Chapters rendered in an earlier export come from the exporter's cache
+                    complete_book = get_shared_exporter().export_bytes(all_stories, book_format, story_style)
+                    book_mime = EXPORT_FORMATS[book_format]["mime"]
                 
                 st.download_button(
                     label="📥 Download Complete Storybook",
                     data=complete_book,
-                    file_name=f"medical_storybook_{time.strftime('%Y%m%d_%H%M%S')}.md",
-                    mime="text/markdown"
+                    file_name=f"medical_storybook_{time.strftime('%Y%m%d_%H%M%S')}.{book_format}",
+                    mime=book_mime
                 )
             
             # Clear stories
             if st.button("🗑️ Clear All Stories"):
-                st.session_state.stories = []
+                store.clear(book_id)
+                st.session_state.chapter_book.clear()
+                st.session_state.history_page = 0
                 st.rerun()
         else:
             st.info("👆 Record or enter medical information to create your first storybook!")
@@ -179,6 +234,13 @@ def main():
     # Footer
     st.markdown("---")
     st.markdown("*Made with ❤️ to help make medical visits less scary for kids*")
+    
+    # Check on background jobs again shortly; other widgets stay usable meanwhile
+    if keep_polling:
+        time.sleep(JOB_POLL_SECONDS)
+        st.rerun()
 
 if __name__ == "__main__":
-    main()
+    # Profiled when STORYBOOK_PROFILE_RUNS or the admin controls armed the profiler
+    with get_profiler().profile("main"):
+        main()
@@ -0,0 +1,225 @@
+"""
+Medical glossary that finds the terms used in a transcript in a single pass.
+
+An Aho-Corasick automaton over every term and alias scans the text in one
+pass, so only the definitions that are actually needed get attached to
+Claude prompts. The bundled glossary is a curated list of about 130 common
+pediatric terms, medicines and abbreviations; more can be loaded from
+MEDICAL_GLOSSARY_PATHS.
+"""
+import json
+import os
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_GLOSSARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "medical_glossary.json")
+
+# Extra glossary files (os.pathsep separated), e.g. a clinic's own list of medicines
+EXTRA_GLOSSARY_PATHS = os.getenv("MEDICAL_GLOSSARY_PATHS", "")
+
+MAX_PROMPT_TERMS = 12
+
+
+class AhoCorasick:
+    def __init__(self, patterns: Iterable[str]):
+        """
+        Build a multi-pattern matching automaton
+
+        Args:
+            patterns: Lowercase strings to search for
+        """
+        self.patterns: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._build_links()
+
+    def _add(self, pattern: str):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = next_node
+        self._out[node].append(len(self.patterns))
+        self.patterns.append(pattern)
+
+    def _build_links(self):
+        """Breadth-first pass computing failure links and merged outputs"""
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                link = self._goto[fallback].get(char, 0)
+                self._fail[child] = link if link != child else 0
+                if self._out[self._fail[child]]:
+                    self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def iter_matches(self, text: str):
+        """
+        Yield (start, end, pattern index) for every occurrence in the text
+
+        Args:
+            text: Lowercase text to scan
+        """
+        goto = self._goto
+        fail = self._fail
+        out = self._out
+        patterns = self.patterns
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for pattern_idx in out[node]:
+                end = position + 1
+                yield end - len(patterns[pattern_idx]), end, pattern_idx
+
+    def __len__(self) -> int:
+        return len(self.patterns)
+
+
+class MedicalGlossary:
+    def __init__(self, entries: Optional[List[Dict]] = None, paths: Optional[List[str]] = None):
+        """
+        Load glossary entries and compile the matcher
+
+        Args:
+            entries: Glossary entries ({term, definition, aliases} and an
+                optional category such as "medication"); loaded from
+                paths when not given
+            paths: JSON glossary files; defaults to data/medical_glossary.json
+                plus any files listed in MEDICAL_GLOSSARY_PATHS
+        """
+        if entries is None:
+            entries = []
+            if paths is None:
+                paths = [DEFAULT_GLOSSARY_PATH] + [p for p in EXTRA_GLOSSARY_PATHS.split(os.pathsep) if p]
+            for path in paths:
+                entries.extend(load_glossary_file(path))
+
+        self.entries = entries
+        surface_forms: List[str] = []
+        self._entry_for_form: List[int] = []
+        for entry_idx, entry in enumerate(entries):
+            for form in [entry["term"]] + list(entry.get("aliases", [])):
+                surface_forms.append(form.lower())
+                self._entry_for_form.append(entry_idx)
+
+        self.matcher = AhoCorasick(surface_forms)
+
+    def find_terms(self, text: str) -> List[Dict]:
+        """
+        Find the glossary entries mentioned in the text
+
+        Matches must sit on word boundaries, so "ear" never matches inside "heart".
+
+        Args:
+            text: Transcript or typed medical text
+
+        Returns:
+            Matched entries in order of first appearance, without duplicates
+        """
+        lowered = text.lower()
+        length = len(lowered)
+
+        # Keep the longest match at each start so "strep throat" beats "strep"
+        best_at_start: Dict[int, Tuple[int, int]] = {}
+        for start, end, form_idx in self.matcher.iter_matches(lowered):
+            if start > 0 and lowered[start - 1].isalnum():
+                continue
+            if end < length and lowered[end].isalnum():
+                continue
+            if end > best_at_start.get(start, (0, -1))[0]:
+                best_at_start[start] = (end, form_idx)
+
+        found = []
+        seen = set()
+        covered_until = 0
+        for start in sorted(best_at_start):
+            end, form_idx = best_at_start[start]
+            if start < covered_until:
+                continue
+            covered_until = end
+            entry_idx = self._entry_for_form[form_idx]
+            if entry_idx not in seen:
+                seen.add(entry_idx)
+                found.append(self.entries[entry_idx])
+        return found
+
+    def forms_in_category(self, category: str) -> Dict[str, str]:
+        """
+        Every surface form of the entries in a category, e.g. "medication"
+
+        Args:
+            category: Value of the entries' "category" field
+
+        Returns:
+            Mapping of lowercase term or alias to the entry's term
+        """
+        forms = {}
+        for entry in self.entries:
+            if entry.get("category") == category:
+                for form in [entry["term"]] + list(entry.get("aliases", [])):
+                    forms[form.lower()] = entry["term"]
+        return forms
+
+    def definitions_for_prompt(self, text: str, max_terms: int = MAX_PROMPT_TERMS) -> str:
+        """
+        Short definition list for the terms in the text, ready to add to a prompt
+
+        Args:
+            text: Transcript or typed medical text
+            max_terms: Most definitions to include
+
+        Returns:
+            Bullet list of "term: definition" lines, or "" if nothing matched
+        """
+        terms = self.find_terms(text)[:max_terms]
+        return '\n'.join(f"- {entry['term']}: {entry['definition']}" for entry in terms)
+
+
+def load_glossary_file(path: str) -> List[Dict]:
+    """
+    Read glossary entries from a JSON file
+
+    Accepts either {"terms": [...]} or a plain {term: definition} mapping.
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error loading glossary {path}: {e}")
+        return []
+
+    if isinstance(data, dict) and "terms" in data:
+        return data["terms"]
+    if isinstance(data, dict):
+        return [{"term": term, "definition": definition, "aliases": []} for term, definition in data.items()]
+    return list(data)
+
+
+_shared_glossary: Optional[MedicalGlossary] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_glossary() -> MedicalGlossary:
+    """Process-wide glossary; the automaton is compiled once"""
+    global _shared_glossary
+    with _shared_lock:
+        if _shared_glossary is None:
+            _shared_glossary = MedicalGlossary()
+        return _shared_glossary
@@ -1,40 +1,325 @@
-import anthropic
+import json
 import os
-from dotenv import load_dotenv
-from typing import Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from instrumentation import count_cache, count_tokens, observe, span
+from medical_glossary import MedicalGlossary, get_shared_glossary
+from near_duplicate_cache import NearDuplicateCache, get_shared_cache
+from story_languages import DEFAULT_LANGUAGE, language_name, normalize_languages
+from story_library import StoryLibrary, get_shared_library
+from transcript_chunker import chunk_transcript, estimate_tokens
+
+# Transcripts longer than this are summarized chunk by chunk before the story is written
+LONG_TRANSCRIPT_TOKENS = 1500
+CHUNK_TOKENS = 1200
+MAX_PARALLEL_CHUNKS = 4
+
+# Output budget for the story, scaled with how much there is to explain
+MIN_STORY_TOKENS = 600
+MAX_STORY_TOKENS = 2000
+# Output budget for one response carrying the story in several languages
+MAX_MULTILINGUAL_TOKENS = 8000
+
+# Minimum similarity for a new input to reuse a story generated for an earlier one;
+# STORY_CACHE_THRESHOLD in the environment or .env overrides it
+STORY_CACHE_THRESHOLD = 0.8
+
+_env_loaded = False
+
+
+def parse_multilingual_stories(response: str, languages: List[str]) -> Dict[str, str]:
+    """
+    Pull each language's story out of Claude's JSON reply
+
+    Accepts the object on its own or wrapped in prose or a code fence. Each
+    story comes back as markdown with its title as a heading.
+
+    Args:
+        response: Claude's reply
+        languages: Language codes that were asked for
+
+    Returns:
+        Story by language code, in the order asked for; languages missing
+        from the reply are left out
+    """
+    start, end = response.find('{'), response.rfind('}')
+    if start < 0 or end <= start:
+        return {}
+    try:
+        data = json.loads(response[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+
+    stories = {}
+    for code in languages:
+        entry = data.get(code)
+        if isinstance(entry, str):
+            entry = {"story": entry}
+        if not isinstance(entry, dict):
+            continue
+        story = str(entry.get("story") or "").strip()
+        if not story:
+            continue
+        title = str(entry.get("title") or "").strip()
+        stories[code] = f"# {title}\n\n{story}" if title else story
+    return stories
+
+
+def load_env():
+    """
+    Read .env into the environment, once
+
+    Called when the first translator is created rather than at import, so
+    entry points that never talk to Claude don't pay for python-dotenv.
+    """
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        # Only after success, so a failed load is retried by the next translator
+        _env_loaded = True
 
-# Load environment variables
-load_dotenv()
 
 class MedicalTranslator:
-    def __init__(self):
-        """Initialize the Claude API client"""
-        try:
-            # Try new version first
-            self.client = anthropic.Anthropic(
-                api_key=os.getenv("ANTHROPIC_API_KEY")
+    def __init__(self, base_url: Optional[str] = None, story_cache: Optional[NearDuplicateCache] = None,
+                 story_library: Optional[StoryLibrary] = None, glossary: Optional[MedicalGlossary] = None):
+        """
+        Initialize the Claude API client
+
+        Args:
+            base_url: API endpoint to use instead of Anthropic's, e.g. a local
+                mock_anthropic_server. Defaults to ANTHROPIC_BASE_URL if set.
+            story_cache: Near-duplicate index of past stories. Defaults to the
+                process-wide cache shared by all sessions.
+            story_library: Pre-generated stories for common visits. Defaults
+                to the shared library in data/story_library.json.
+            glossary: Medical glossary whose matching definitions are added to
+                prompts. Defaults to the shared glossary.
+        """
+        load_env()
+        threshold = float(os.getenv("STORY_CACHE_THRESHOLD", STORY_CACHE_THRESHOLD))
+        self.cache_threshold = threshold
+        self.story_cache = story_cache or get_shared_cache(threshold)
+        self._language_caches: Dict[str, NearDuplicateCache] = {DEFAULT_LANGUAGE: self.story_cache}
+        self.story_library = story_library or get_shared_library()
+        self.glossary = glossary or get_shared_glossary()
+
+        base_url = base_url or os.getenv("ANTHROPIC_BASE_URL")
+        client_kwargs = {"api_key": os.getenv("ANTHROPIC_API_KEY")}
+        if base_url:
+            client_kwargs["base_url"] = base_url
+
+        # The SDK is imported and the client built on the first request
+        self._client_kwargs = client_kwargs
+        self._client = None
+        self._use_messages_api = True
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The Anthropic client, created on first use"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import anthropic
+                    try:
+                        # Try new version first
+                        self._client = anthropic.Anthropic(**self._client_kwargs)
+                        self._use_messages_api = True
+                    except TypeError:
+                        # Fall back to older version
+                        self._client = anthropic.Client(**self._client_kwargs)
+                        self._use_messages_api = False
+        return self._client
+
+    @property
+    def use_messages_api(self) -> bool:
+        self.client
+        return self._use_messages_api
+
+    def _complete(self, prompt: str, max_tokens: int, temperature: float) -> str:
+        """Send a single prompt to Claude and return the response text"""
+        return self._complete_with_stop(prompt, max_tokens, temperature)[0]
+
+    def _complete_with_stop(self, prompt: str, max_tokens: int, temperature: float) -> Tuple[str, Optional[str]]:
+        """
+        Send a single prompt to Claude
+
+        Returns:
+            (response text, stop reason); "max_tokens" means the reply was cut off
+        """
+        if self.use_messages_api:
+            message = self.client.messages.create(
+                model="claude-3-sonnet-20240229",
+                max_tokens=max_tokens,
+                temperature=temperature,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ]
             )
-            self.use_messages_api = True
-        except TypeError:
-            # Fall back to older version
-            self.client = anthropic.Client(
-                api_key=os.getenv("ANTHROPIC_API_KEY")
+            usage = getattr(message, "usage", None)
+            if usage is not None:
+                count_tokens(usage.input_tokens, usage.output_tokens)
+            return message.content[0].text, getattr(message, "stop_reason", None)
+        else:
+            message = self.client.completions.create(
+                model="claude-2",
+                max_tokens_to_sample=max_tokens,
+                temperature=temperature,
+                prompt=f"\n\nHuman: {prompt}\n\nAssistant:"
             )
-            self.use_messages_api = False
-        
-    def translate_to_storybook(self, medical_text: str) -> Optional[str]:
+            return message.completion, getattr(message, "stop_reason", None)
+
+    def _glossary_section(self, medical_text: str) -> str:
+        """Definitions for just the medical terms that appear in the text"""
+        definitions = self.glossary.definitions_for_prompt(medical_text)
+        if not definitions:
+            return ""
+        return f"""
+Definitions of the medical terms used above (for accuracy; explain them simply):
+{definitions}
+"""
+
+    def _stream(self, prompt: str, max_tokens: int, temperature: float) -> Iterator[str]:
+        """Send a single prompt to Claude and yield the response text as it arrives"""
+        if self.use_messages_api:
+            stream = self.client.messages.create(
+                model="claude-3-sonnet-20240229",
+                max_tokens=max_tokens,
+                temperature=temperature,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                stream=True
+            )
+            for event in stream:
+                if event.type == "content_block_delta" and getattr(event.delta, "text", None):
+                    yield event.delta.text
+                elif event.type == "message_start" and getattr(event.message, "usage", None):
+                    count_tokens(event.message.usage.input_tokens, None)
+                elif event.type == "message_delta" and getattr(event, "usage", None):
+                    count_tokens(None, event.usage.output_tokens)
+        else:
+            stream = self.client.completions.create(
+                model="claude-2",
+                max_tokens_to_sample=max_tokens,
+                temperature=temperature,
+                prompt=f"\n\nHuman: {prompt}\n\nAssistant:",
+                stream=True
+            )
+            for completion in stream:
+                if completion.completion:
+                    yield completion.completion
+
+    def _story_max_tokens(self, source_text: str) -> int:
+        """Size the story's output budget from the amount of medical content"""
+        budget = MIN_STORY_TOKENS + estimate_tokens(source_text) // 2
+        return max(MIN_STORY_TOKENS, min(MAX_STORY_TOKENS, budget))
+
+    def _extract_medical_facts(self, chunk: str) -> str:
+        """Pull the key medical facts out of one transcript chunk (map step)"""
+        prompt = f"""
+Below is part of a transcript from a child's doctor visit. List the key medical facts it contains as short bullet points:
+diagnoses, tests or procedures, medicines with dose and schedule, care instructions, and follow-up plans.
+Skip small talk and anything not medically relevant. If there are no medical facts, reply with "None".
+
+Transcript excerpt:
+"{chunk}"
+"""
+        max_tokens = max(150, min(400, estimate_tokens(chunk) // 3))
+        return self._complete(prompt, max_tokens=max_tokens, temperature=0.0).strip()
+
+    def summarize_transcript(self, transcript: str) -> str:
         """
-        Translate medical diagnosis/terminology into kid-friendly storybook format
-        
+        Reduce a long transcript to a list of key medical facts
+
+        Chunks are summarized in parallel and their facts are merged in order.
+
         Args:
-            medical_text: The medical text to translate
-            
+            transcript: The full transcript text
+
         Returns:
-            Kid-friendly storybook version or None if error
+            Bullet list of medical facts, or the transcript itself if it is short
+            or no medical facts were found in it
         """
-        try:
-            prompt = f"""
-You are a medical translator who specializes in converting complex medical information into engaging, age-appropriate storybooks for elementary school children (ages 6-10). 
+        if estimate_tokens(transcript) <= LONG_TRANSCRIPT_TOKENS:
+            return transcript
+
+        chunks = chunk_transcript(transcript, max_tokens=CHUNK_TOKENS)
+        with span("summarize_transcript", chunks=len(chunks)):
+            with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_CHUNKS, len(chunks))) as pool:
+                chunk_facts: List[str] = list(pool.map(self._extract_medical_facts, chunks))
+
+        facts = []
+        seen = set()
+        for chunk_result in chunk_facts:
+            for line in chunk_result.splitlines():
+                fact = line.strip().lstrip('-*• ').strip()
+                if not fact or fact.lower().rstrip('.') == 'none':
+                    continue
+                # Overlapping chunks repeat facts near their boundaries
+                if fact.lower() in seen:
+                    continue
+                seen.add(fact.lower())
+                facts.append(f"- {fact}")
+
+        if not facts:
+            # No chunk yielded a fact; better the raw text than an empty prompt
+            return chunks[0] if len(chunks) == 1 else transcript
+        return '\n'.join(facts)
+
+    def _ready_story(self, medical_text: str, style: Optional[str],
+                     on_personalized: Optional[Callable[[str], None]]) -> Optional[str]:
+        """Story from the library or the near-duplicate cache, if one fits"""
+        if style:
+            match = self.story_library.lookup(medical_text, style)
+            count_cache("story_library", hit=bool(match))
+            if match:
+                if on_personalized:
+                    self.story_library.personalize_async(medical_text, self, on_personalized)
+                return match["story"]
+
+        cached_story = self.story_cache.lookup(medical_text)
+        count_cache("near_duplicate", hit=cached_story is not None)
+        return cached_story
+
+    def _language_cache(self, language: str) -> NearDuplicateCache:
+        """Stories already written in one language; English shares the main story cache"""
+        cache = self._language_caches.get(language)
+        if cache is None:
+            cache = self._language_caches.setdefault(language, get_shared_cache(self.cache_threshold, language))
+        return cache
+
+    def _story_prompt(self, source_text: str, languages: Optional[List[str]] = None) -> str:
+        if languages:
+            names = ', '.join(f"{language_name(code)} ({code})" for code in languages)
+            output_instructions = f"""
+Write the story in each of these languages:
+Languages: {', '.join(languages)}
+That is: {names}.
+
+Each version tells the same story, written naturally for a child who speaks that language rather than translated word for word. Keep the names of medicines, doses, schedules and durations exactly the same in every version.
+
+Respond with only a JSON object, no other text. Use the language codes as keys, and give each version a "title" and a "story" with paragraphs separated by blank lines:
+{{"{languages[0]}": {{"title": "...", "story": "First paragraph...\\n\\nSecond paragraph..."}}}}
+"""
+        else:
+            output_instructions = """
+Format your response as a story with a title.
+"""
+        return f"""
+You are a medical translator who specializes in converting complex medical information into engaging, age-appropriate storybooks for elementary school children (ages 6-10).
 
 Your task is to take the following medical text and transform it into a friendly, reassuring story that:
 1. Uses simple, elementary school vocabulary
@@ -45,51 +330,197 @@ Your task is to take the following medical text and transform it into a friendly
 6. Uses a warm, caring tone
 
 Medical text to translate:
-"{medical_text}"
-
+"{source_text}"
+{self._glossary_section(source_text)}
 Please create a short storybook passage (2-3 paragraphs) that explains this medical information in a way that would help a child understand what's happening with their health. Make it engaging and comforting.
+{output_instructions}"""
 
-Format your response as a story with a title.
-"""
+    def translate_to_storybook(self, medical_text: str, style: Optional[str] = None,
+                               on_personalized: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """
+        Translate medical diagnosis/terminology into kid-friendly storybook format
 
-            if self.use_messages_api:
-                message = self.client.messages.create(
-                    model="claude-3-sonnet-20240229",
-                    max_tokens=1000,
-                    temperature=0.7,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ]
-                )
-                return message.content[0].text
-            else:
-                message = self.client.completions.create(
-                    model="claude-2",
-                    max_tokens_to_sample=1000,
-                    temperature=0.7,
-                    prompt=f"\n\nHuman: {prompt}\n\nAssistant:"
+        When a style is given, common visits are answered instantly from the
+        story library. Inputs that closely match an earlier one reuse its
+        story. Long transcripts are first reduced to their key medical facts
+        so the story prompt stays small.
+
+        Args:
+            medical_text: The medical text to translate
+            style: Story style; enables instant answers from the story library
+            on_personalized: If a library story is returned, a personalized
+                story is generated in the background and passed to this callback
+
+        Returns:
+            Kid-friendly storybook version or None if error
+        """
+        with span("translate_to_storybook", style=style or "") as stage:
+            try:
+                ready_story = self._ready_story(medical_text, style, on_personalized)
+                if ready_story is not None:
+                    stage.set(source="ready")
+                    return ready_story
+
+                source_text = self.summarize_transcript(medical_text)
+                story = self._complete(
+                    self._story_prompt(source_text),
+                    max_tokens=self._story_max_tokens(source_text),
+                    temperature=0.7
                 )
-                return message.completion
-            
+                self.story_cache.add(medical_text, story)
+                stage.set(source="claude")
+                return story
+
+            except Exception as e:
+                print(f"Error translating medical text: {e}")
+                stage.fail(str(e))
+                return None
+
+    def translate_to_storybook_multilingual(self, medical_text: str, languages: List[str],
+                                            style: Optional[str] = None) -> Optional[Dict[str, str]]:
+        """
+        Write the same story in several languages with a single Claude request
+
+        Each language has its own story cache, so only the languages not yet
+        cached for this input are requested, in one structured response when
+        they fit its output budget and in as few as possible otherwise. A
+        language missing from a reply (usually because it was cut off) is
+        asked for once more on its own. English comes from the story library
+        only when it is the sole language, so every version tells one story.
+
+        Args:
+            medical_text: The medical text to translate
+            languages: Language codes (see story_languages.STORY_LANGUAGES)
+            style: Story style; enables instant answers from the story library
+                when only English is asked for
+
+        Returns:
+            Story by language code, in the order asked for (languages Claude
+            left out are missing), or None if error
+        """
+        languages = normalize_languages(languages)
+        with span("translate_multilingual", languages=','.join(languages)) as stage:
+            try:
+                stories: Dict[str, Optional[str]] = {}
+                for code in languages:
+                    if code == DEFAULT_LANGUAGE:
+                        # A library story would not match the translations Claude writes
+                        stories[code] = self._ready_story(medical_text, style if len(languages) == 1 else None, None)
+                    else:
+                        stories[code] = self._language_cache(code).lookup(medical_text)
+                        count_cache("story_language", hit=stories[code] is not None)
+
+                missing = [code for code in languages if stories[code] is None]
+                stage.set(requested=len(missing))
+                if missing:
+                    source_text = self.summarize_transcript(medical_text)
+                    story_tokens = self._story_max_tokens(source_text)
+                    per_request = max(1, MAX_MULTILINGUAL_TOKENS // story_tokens)
+                    requests = 0
+                    for attempt in range(2):
+                        for start in range(0, len(missing), per_request):
+                            group = missing[start:start + per_request]
+                            requests += 1
+                            for code, story in self._write_languages(source_text, group, story_tokens).items():
+                                self._language_cache(code).add(medical_text, story)
+                                stories[code] = story
+                        # Whatever was cut off or left out gets one more try, a language at a time
+                        missing = [code for code in missing if stories[code] is None]
+                        per_request = 1
+                        if not missing:
+                            break
+                    stage.set(claude_requests=requests)
+
+                ready = {code: story for code, story in stories.items() if story}
+                if not ready:
+                    stage.fail("No stories in the response")
+                    return None
+                return ready
+
+            except Exception as e:
+                print(f"Error translating medical text into several languages: {e}")
+                stage.fail(str(e))
+                return None
+
+    def _write_languages(self, source_text: str, languages: List[str], story_tokens: int) -> Dict[str, str]:
+        """One Claude request for the story in these languages; those cut off or left out are missing"""
+        max_tokens = min(MAX_MULTILINGUAL_TOKENS, story_tokens * len(languages))
+        if languages == [DEFAULT_LANGUAGE]:
+            # Plain markdown rather than JSON, so even a cut-off reply is usable
+            story = self._complete(self._story_prompt(source_text), max_tokens=max_tokens, temperature=0.7)
+            return {DEFAULT_LANGUAGE: story} if story else {}
+
+        response, stop_reason = self._complete_with_stop(
+            self._story_prompt(source_text, languages), max_tokens=max_tokens, temperature=0.7
+        )
+        if stop_reason == "max_tokens":
+            print(f"Story in {', '.join(languages)} was cut off at {max_tokens} tokens")
+        return parse_multilingual_stories(response, languages)
+
+    def stream_storybook(self, medical_text: str, style: Optional[str] = None,
+                         on_personalized: Optional[Callable[[str], None]] = None) -> Iterator[str]:
+        """
+        Translate medical text into a story, yielding text as Claude writes it
+
+        Library and cached stories are yielded in one piece. Feed the deltas to
+        an IncrementalStoryFormatter to show formatted paragraphs as they arrive.
+
+        Args:
+            medical_text: The medical text to translate
+            style: Story style; enables instant answers from the story library
+            on_personalized: See translate_to_storybook
+
+        Yields:
+            Pieces of story text
+
+        Raises:
+            Exception: The Claude request failed, possibly after some text was
+                already yielded; a partial story is not cached
+        """
+        # Timed by hand: a span cannot stay open across yields to the caller
+        started = time.perf_counter()
+        error = None
+        try:
+            ready_story = self._ready_story(medical_text, style, on_personalized)
+            if ready_story is not None:
+                yield ready_story
+                return
+
+            source_text = self.summarize_transcript(medical_text)
+            parts = []
+            for delta in self._stream(
+                self._story_prompt(source_text),
+                max_tokens=self._story_max_tokens(source_text),
+                temperature=0.7
+            ):
+                if not parts:
+                    observe("stream_storybook_first_token", time.perf_counter() - started)
+                parts.append(delta)
+                yield delta
+
+            if parts:
+                self.story_cache.add(medical_text, ''.join(parts))
+
         except Exception as e:
-            print(f"Error translating medical text: {e}")
-            return None
-            
+            print(f"Error streaming medical text translation: {e}")
+            error = str(e)
+            raise
+        finally:
+            observe("stream_storybook", time.perf_counter() - started, error)
+
     def get_medical_explanation(self, medical_text: str) -> Optional[str]:
         """
         Get a simple medical explanation suitable for parents
-        
+
         Args:
             medical_text: The medical text to explain
-            
+
         Returns:
             Parent-friendly explanation or None if error
         """
-        try:
-            prompt = f"""
+        with span("get_medical_explanation") as stage:
+            try:
+                prompt = f"""
 Please provide a clear, simple explanation of the following medical information that would be appropriate for parents to understand. Focus on:
 1. What this means in plain language
 2. What to expect
@@ -98,32 +529,13 @@ Please provide a clear, simple explanation of the following medical information
 
 Medical text:
 "{medical_text}"
-
+{self._glossary_section(medical_text)}
 Please provide a concise, informative explanation.
 """
 
-            if self.use_messages_api:
-                message = self.client.messages.create(
-                    model="claude-3-sonnet-20240229",
-                    max_tokens=800,
-                    temperature=0.3,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ]
-                )
-                return message.content[0].text
-            else:
-                message = self.client.completions.create(
-                    model="claude-2",
-                    max_tokens_to_sample=800,
-                    temperature=0.3,
-                    prompt=f"\n\nHuman: {prompt}\n\nAssistant:"
-                )
-                return message.completion
-            
-        except Exception as e:
-            print(f"Error getting medical explanation: {e}")
-            return None
+                return self._complete(prompt, max_tokens=800, temperature=0.3)
+
+            except Exception as e:
+                print(f"Error getting medical explanation: {e}")
+                stage.fail(str(e))
+                return None
@@ -0,0 +1,477 @@
+"""
+Local stand-in for the Anthropic Messages API, for load tests and offline benchmarks.
+
+Point MedicalTranslator at it with ANTHROPIC_BASE_URL=http://127.0.0.1:8787 and
+any non-empty ANTHROPIC_API_KEY. Supports /v1/messages (with streaming),
+/v1/messages/batches and the legacy /v1/complete endpoint, with configurable
+latency and injected rate-limit / overload / server errors.
+
+Usage:
+    python mock_anthropic_server.py --port 8787 --latency lognormal:-0.7,0.5 --rate-limit-rate 0.05
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from transcript_chunker import estimate_tokens
+
+CANNED_STORIES = [
+    {
+        "keywords": ["strep", "throat", "amoxicillin", "antibiotic"],
+        "text": (
+            "# The Brave Throat Defenders\n\n"
+            "Once upon a time, in the magical kingdom of your throat, some sneaky germs called "
+            "\"strep bacteria\" decided to cause trouble. They made your throat feel scratchy and sore, "
+            "like prickly thorns in a beautiful garden.\n\n"
+            "But don't worry! The wise doctor found the sneaky germs and called a superhero medicine "
+            "to help. This medicine is like a team of brave knights who march in twice every day to "
+            "chase the germs away.\n\n"
+            "For 10 whole days the medicine knights will work hard. You can help them by drinking lots "
+            "of water and getting plenty of rest. Soon your throat will be happy and healthy again!"
+        ),
+    },
+    {
+        "keywords": ["x-ray", "xray", "bone", "arm", "fracture"],
+        "text": (
+            "# The Amazing Picture Machine\n\n"
+            "After your big fall, the doctor wanted to make sure the bones in your arm were okay. "
+            "So they asked a very special camera for help!\n\n"
+            "This camera is called an X-ray machine, and it can see right through your skin to take "
+            "a picture of your bones. You just hold still like a statue for a few seconds.\n\n"
+            "It doesn't hurt one bit, and soon the doctor will look at the picture and know exactly "
+            "how to help your arm feel better."
+        ),
+    },
+    {
+        "keywords": [],
+        "text": (
+            "# Your Body's Helper Team\n\n"
+            "Inside your body lives a team of tiny helpers who work all day and all night to keep you "
+            "healthy and strong.\n\n"
+            "Today the doctor found something the helpers need a little extra support with, and gave "
+            "you a plan to give them a boost.\n\n"
+            "By following the doctor's plan and resting well, you are helping your helper team win. "
+            "You are brave, and you will feel better soon!"
+        ),
+    },
+]
+
+# The quoted text a MedicalTranslator prompt asks Claude to work on
+QUOTED_TEXT_PATTERN = re.compile(
+    r'^(?:Medical text to translate|Medical text|Transcript excerpt):\n"(.*?)"$', re.MULTILINE | re.DOTALL
+)
+
+CANNED_FACTS = (
+    "- Diagnosis discussed by the doctor\n"
+    "- Medicine prescribed with a daily schedule\n"
+    "- Rest and fluids recommended\n"
+    "- Follow-up visit if symptoms continue"
+)
+
+
+def parse_latency(spec: str):
+    """
+    Parse a latency distribution spec into a sampling function (seconds)
+
+    Formats: "fixed:0.5", "uniform:0.2,1.5", "exponential:0.8" (mean),
+    "lognormal:-0.7,0.5" (mu, sigma of the underlying normal).
+    """
+    kind, _, params = spec.partition(':')
+    values = [float(v) for v in params.split(',')] if params else []
+
+    if kind == "fixed":
+        return lambda rng: values[0] if values else 0.0
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "exponential":
+        return lambda rng: rng.expovariate(1.0 / values[0])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class MockConfig:
+    def __init__(self, latency: str = "fixed:0", token_delay: float = 0.0,
+                 rate_limit_rate: float = 0.0, overload_rate: float = 0.0,
+                 error_rate: float = 0.0, retry_after: int = 1,
+                 batch_item_delay: float = 0.05, seed: Optional[int] = None,
+                 stories: Optional[List[Dict]] = None):
+        """Settings shared by all request handlers of one mock server"""
+        self.sample_latency = parse_latency(latency)
+        self.token_delay = token_delay
+        self.rate_limit_rate = rate_limit_rate
+        self.overload_rate = overload_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.batch_item_delay = batch_item_delay
+        self.stories = stories or CANNED_STORIES
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.batches: Dict[str, Dict] = {}
+        self.stats = {"requests": 0, "streamed": 0, "rate_limited": 0,
+                      "overloaded": 0, "errors": 0, "batches": 0}
+
+    def random(self) -> float:
+        with self.lock:
+            return self.rng.random()
+
+    def latency(self) -> float:
+        with self.lock:
+            return max(0.0, self.sample_latency(self.rng))
+
+    def count(self, key: str):
+        with self.lock:
+            self.stats[key] += 1
+
+    def reply_for(self, prompt: str) -> str:
+        """Pick a canned reply that fits the prompt"""
+        if "List the key medical facts" in prompt:
+            return CANNED_FACTS
+
+        # Match whole words of the medical text only, so "warm" in the instructions never picks the arm story
+        quoted = QUOTED_TEXT_PATTERN.search(prompt)
+        lowered = (quoted.group(1) if quoted else prompt).lower()
+        text = self.stories[-1]["text"]
+        for story in self.stories:
+            if any(re.search(rf"\b{re.escape(keyword)}\b", lowered) for keyword in story.get("keywords", [])):
+                text = story["text"]
+                break
+
+        languages = re.search(r"^Languages: (.+)$", prompt, re.MULTILINE)
+        if languages:
+            # Multilingual request: the same canned story under every language code
+            title, _, body = text.strip().partition('\n')
+            version = {"title": title.lstrip('#').strip(), "story": body.strip()}
+            return json.dumps({code.strip(): version for code in languages.group(1).split(',')},
+                              ensure_ascii=False)
+        return text
+
+
+def _prompt_text(params: Dict) -> str:
+    """Flatten the user content of a Messages request into one string"""
+    parts = []
+    for message in params.get("messages", []):
+        content = message.get("content", "")
+        if isinstance(content, str):
+            parts.append(content)
+        else:
+            parts.extend(block.get("text", "") for block in content if isinstance(block, dict))
+    return '\n'.join(parts)
+
+
+def _message_body(params: Dict, text: str) -> Dict:
+    return {
+        "id": f"msg_mock_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": params.get("model", "mock"),
+        "content": [{"type": "text", "text": text}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {
+            "input_tokens": estimate_tokens(_prompt_text(params)),
+            "output_tokens": estimate_tokens(text),
+        },
+    }
+
+
+class MockAnthropicHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: MockConfig = None
+
+    def log_message(self, format, *args):
+        # Keep load-test output readable
+        pass
+
+    def _send_json(self, status: int, body: Dict, headers: Optional[Dict] = None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status: int, error_type: str, message: str, headers: Optional[Dict] = None):
+        self._send_json(status, {"type": "error", "error": {"type": error_type, "message": message}}, headers)
+
+    def _read_json(self) -> Dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _inject_failure(self) -> bool:
+        """Maybe answer with an injected failure; returns True if one was sent"""
+        config = self.config
+        roll = config.random()
+        if roll < config.rate_limit_rate:
+            config.count("rate_limited")
+            self._send_error(429, "rate_limit_error", "Mock rate limit exceeded",
+                             {"retry-after": str(config.retry_after)})
+            return True
+        roll -= config.rate_limit_rate
+        if roll < config.overload_rate:
+            config.count("overloaded")
+            self._send_error(529, "overloaded_error", "Mock server overloaded")
+            return True
+        roll -= config.overload_rate
+        if roll < config.error_rate:
+            config.count("errors")
+            self._send_error(500, "api_error", "Mock internal error")
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path == "/_mock/stats":
+            with self.config.lock:
+                stats = dict(self.config.stats)
+            self._send_json(200, stats)
+            return
+
+        match = re.fullmatch(r"/v1/messages/batches/([\w-]+)(/results)?", self.path.split('?')[0])
+        if not match:
+            self._send_error(404, "not_found_error", f"Unknown path {self.path}")
+            return
+
+        with self.config.lock:
+            batch = self.config.batches.get(match.group(1))
+            batch = dict(batch) if batch else None
+        if batch is None:
+            self._send_error(404, "not_found_error", "Batch not found")
+            return
+
+        if not match.group(2):
+            self._send_json(200, batch["info"])
+            return
+
+        if batch["info"]["processing_status"] != "ended":
+            self._send_error(400, "invalid_request_error", "Batch is still processing")
+            return
+        payload = ''.join(json.dumps(result) + '\n' for result in batch["results"]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-jsonl")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        self.config.count("requests")
+
+        if path == "/v1/messages":
+            self._handle_messages()
+        elif path == "/v1/complete":
+            self._handle_complete()
+        elif path == "/v1/messages/batches":
+            self._handle_batch_create()
+        elif re.fullmatch(r"/v1/messages/batches/[\w-]+/cancel", path):
+            self._handle_batch_cancel(path.split('/')[-2])
+        else:
+            self._send_error(404, "not_found_error", f"Unknown path {self.path}")
+
+    def _handle_messages(self):
+        params = self._read_json()
+        if self._inject_failure():
+            return
+
+        text = self.config.reply_for(_prompt_text(params))
+        time.sleep(self.config.latency())
+
+        if params.get("stream"):
+            self.config.count("streamed")
+            self._stream_message(params, text)
+        else:
+            self._send_json(200, _message_body(params, text))
+
+    def _stream_message(self, params: Dict, text: str):
+        """Send the reply as server-sent events, a few words per delta"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        body = _message_body(params, "")
+        body["content"] = []
+        body["stop_reason"] = None
+
+        def send(event: str, data: Dict):
+            self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send("message_start", {"type": "message_start", "message": body})
+        send("content_block_start", {"type": "content_block_start", "index": 0,
+                                     "content_block": {"type": "text", "text": ""}})
+        for piece in re.findall(r'\S+\s*|\s+', text):
+            if self.config.token_delay:
+                time.sleep(self.config.token_delay)
+            send("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                         "delta": {"type": "text_delta", "text": piece}})
+        send("content_block_stop", {"type": "content_block_stop", "index": 0})
+        send("message_delta", {"type": "message_delta",
+                               "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                               "usage": {"output_tokens": estimate_tokens(text)}})
+        send("message_stop", {"type": "message_stop"})
+
+    def _handle_complete(self):
+        params = self._read_json()
+        if self._inject_failure():
+            return
+
+        text = self.config.reply_for(params.get("prompt", ""))
+        time.sleep(self.config.latency())
+        self._send_json(200, {
+            "type": "completion",
+            "id": f"compl_mock_{uuid.uuid4().hex[:24]}",
+            "completion": text,
+            "stop_reason": "stop_sequence",
+            "model": params.get("model", "mock"),
+        })
+
+    def _handle_batch_create(self):
+        params = self._read_json()
+        if self._inject_failure():
+            return
+
+        requests = params.get("requests", [])
+        batch_id = f"msgbatch_mock_{uuid.uuid4().hex[:20]}"
+        info = {
+            "id": batch_id,
+            "type": "message_batch",
+            "processing_status": "in_progress",
+            "request_counts": {"processing": len(requests), "succeeded": 0,
+                               "errored": 0, "canceled": 0, "expired": 0},
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "ended_at": None,
+            "results_url": None,
+        }
+        with self.config.lock:
+            self.config.batches[batch_id] = {"info": info, "results": [], "canceled": False}
+            self.config.stats["batches"] += 1
+
+        threading.Thread(target=self._process_batch, args=(batch_id, requests), daemon=True).start()
+        self._send_json(200, info)
+
+    def _process_batch(self, batch_id: str, requests: List[Dict]):
+        config = self.config
+        for request in requests:
+            time.sleep(config.batch_item_delay)
+            with config.lock:
+                batch = config.batches[batch_id]
+                counts = batch["info"]["request_counts"]
+                counts["processing"] -= 1
+                if batch["canceled"]:
+                    counts["canceled"] += 1
+                    batch["results"].append({"custom_id": request.get("custom_id"),
+                                             "result": {"type": "canceled"}})
+                    continue
+                counts["succeeded"] += 1
+                params = request.get("params", {})
+                text = config.reply_for(_prompt_text(params))
+                batch["results"].append({"custom_id": request.get("custom_id"),
+                                         "result": {"type": "succeeded",
+                                                    "message": _message_body(params, text)}})
+
+        with config.lock:
+            info = config.batches[batch_id]["info"]
+            info["processing_status"] = "ended"
+            info["ended_at"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            info["results_url"] = f"/v1/messages/batches/{batch_id}/results"
+
+    def _handle_batch_cancel(self, batch_id: str):
+        with self.config.lock:
+            batch = self.config.batches.get(batch_id)
+            if batch is not None:
+                batch["canceled"] = True
+                if batch["info"]["processing_status"] == "in_progress":
+                    batch["info"]["processing_status"] = "canceling"
+                info = dict(batch["info"])
+        if batch is None:
+            self._send_error(404, "not_found_error", "Batch not found")
+            return
+        self._send_json(200, info)
+
+
+def create_server(host: str = "127.0.0.1", port: int = 8787, config: Optional[MockConfig] = None) -> ThreadingHTTPServer:
+    """
+    Build a mock server; call serve_forever() on it (or run it in a thread)
+
+    Args:
+        host: Interface to bind
+        port: Port to bind, 0 picks a free one
+        config: Latency and failure settings
+
+    Returns:
+        The HTTP server instance
+    """
+    handler = type("ConfiguredMockHandler", (MockAnthropicHandler,), {"config": config or MockConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_background_server(config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0):
+    """
+    Start a mock server on a daemon thread
+
+    Returns:
+        Tuple of (server, base_url); call server.shutdown() when done
+    """
+    server = create_server(host, port, config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    bound_host, bound_port = server.server_address[:2]
+    return server, f"http://{bound_host}:{bound_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Anthropic API stand-in for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency", default="fixed:0",
+                        help="fixed:S | uniform:LO,HI | exponential:MEAN | lognormal:MU,SIGMA")
+    parser.add_argument("--token-delay", type=float, default=0.0,
+                        help="Seconds between streamed deltas")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--overload-rate", type=float, default=0.0, help="Fraction of requests answered with 529")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry-after seconds sent with 429s")
+    parser.add_argument("--batch-item-delay", type=float, default=0.05)
+    parser.add_argument("--stories-file", help="JSON list of {keywords, text} canned stories")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    stories = None
+    if args.stories_file:
+        with open(args.stories_file, encoding="utf-8") as f:
+            stories = json.load(f)
+
+    config = MockConfig(
+        latency=args.latency,
+        token_delay=args.token_delay,
+        rate_limit_rate=args.rate_limit_rate,
+        overload_rate=args.overload_rate,
+        error_rate=args.error_rate,
+        retry_after=args.retry_after,
+        batch_item_delay=args.batch_item_delay,
+        seed=args.seed,
+        stories=stories,
+    )
+    server = create_server(args.host, args.port, config)
+    print(f"Mock Anthropic API listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
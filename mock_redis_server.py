@@ -0,0 +1,298 @@
+"""
+Local stand-in for a Redis server, for running replicas and benchmarks offline.
+
+Speaks the Redis protocol (RESP) and keeps everything in memory. It covers
+the commands RespBackend uses plus a few for poking at it by hand: PING,
+AUTH, SELECT, GET, SET (EX/PX/NX/XX), DEL, EXISTS, EXPIRE, PEXPIRE, TTL,
+KEYS, LPUSH, RPUSH, LPOP, RPOP, BRPOP, LLEN, LRANGE, LREM, LPOS, FLUSHDB and
+DBSIZE. There is one database, no persistence and no eviction.
+
+Usage:
+    python mock_redis_server.py --port 6390
+    SHARED_BACKEND_URL=redis://127.0.0.1:6390/0 streamlit run main.py
+"""
+import argparse
+import fnmatch
+import socketserver
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+Value = Union[bytes, List[bytes]]
+
+
+class RespStore:
+    def __init__(self):
+        """Keys, values and expiry times shared by every client connection"""
+        self.data: Dict[bytes, Value] = {}
+        self.expires: Dict[bytes, float] = {}
+        self.changed = threading.Condition()
+        self.commands = 0
+
+    def _alive(self, key: bytes) -> bool:
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _list(self, key: bytes, create: bool = False) -> Optional[List[bytes]]:
+        if not self._alive(key):
+            if not create:
+                return None
+            self.data[key] = []
+        value = self.data[key]
+        if not isinstance(value, list):
+            raise CommandError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _drop_if_empty(self, key: bytes):
+        if self.data.get(key) == []:
+            del self.data[key]
+            self.expires.pop(key, None)
+
+
+class CommandError(Exception):
+    """Sent back to the client as an error reply"""
+
+
+def _int(value: bytes) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        raise CommandError("ERR value is not an integer or out of range")
+
+
+def execute(store: RespStore, args: List[bytes]):
+    """Run one command against the store and return its reply"""
+    if not args:
+        raise CommandError("ERR empty command")
+    command = args[0].upper().decode("ascii", "replace")
+    params = args[1:]
+
+    if command == "BRPOP":
+        # Blocking: waits on the condition without holding it between checks
+        keys, timeout = params[:-1], float(params[-1])
+        deadline = time.monotonic() + timeout if timeout > 0 else None
+        with store.changed:
+            while True:
+                for key in keys:
+                    items = store._list(key)
+                    if items:
+                        value = items.pop()
+                        store._drop_if_empty(key)
+                        return [key, value]
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                store.changed.wait(remaining)
+
+    with store.changed:
+        store.commands += 1
+        if command == "PING":
+            return "PONG" if not params else params[0]
+        if command in ("AUTH", "SELECT"):
+            return "OK"
+        if command == "GET":
+            if not store._alive(params[0]):
+                return None
+            value = store.data[params[0]]
+            if isinstance(value, list):
+                raise CommandError("WRONGTYPE Operation against a key holding the wrong kind of value")
+            return value
+        if command == "SET":
+            key, value = params[0], params[1]
+            options = [p.upper() for p in params[2:]]
+            expires_at = None
+            if b"EX" in options:
+                expires_at = time.monotonic() + _int(params[2 + options.index(b"EX") + 1])
+            if b"PX" in options:
+                expires_at = time.monotonic() + _int(params[2 + options.index(b"PX") + 1]) / 1000
+            exists = store._alive(key)
+            if (b"NX" in options and exists) or (b"XX" in options and not exists):
+                return None
+            store.data[key] = value
+            if expires_at is None:
+                store.expires.pop(key, None)
+            else:
+                store.expires[key] = expires_at
+            return "OK"
+        if command == "DEL":
+            removed = 0
+            for key in params:
+                if store._alive(key):
+                    del store.data[key]
+                    store.expires.pop(key, None)
+                    removed += 1
+            return removed
+        if command == "EXISTS":
+            return sum(1 for key in params if store._alive(key))
+        if command in ("EXPIRE", "PEXPIRE"):
+            if not store._alive(params[0]):
+                return 0
+            scale = 1 if command == "EXPIRE" else 1000
+            store.expires[params[0]] = time.monotonic() + _int(params[1]) / scale
+            return 1
+        if command == "TTL":
+            if not store._alive(params[0]):
+                return -2
+            expires_at = store.expires.get(params[0])
+            return -1 if expires_at is None else int(expires_at - time.monotonic())
+        if command == "KEYS":
+            pattern = params[0].decode("utf-8", "replace")
+            return [key for key in list(store.data) if store._alive(key) and
+                    fnmatch.fnmatchcase(key.decode("utf-8", "replace"), pattern)]
+        if command in ("LPUSH", "RPUSH"):
+            items = store._list(params[0], create=True)
+            for value in params[1:]:
+                if command == "LPUSH":
+                    items.insert(0, value)
+                else:
+                    items.append(value)
+            store.changed.notify_all()
+            return len(items)
+        if command in ("LPOP", "RPOP"):
+            items = store._list(params[0])
+            if not items:
+                return None
+            value = items.pop(0) if command == "LPOP" else items.pop()
+            store._drop_if_empty(params[0])
+            return value
+        if command == "LLEN":
+            items = store._list(params[0])
+            return len(items) if items else 0
+        if command == "LRANGE":
+            items = store._list(params[0]) or []
+            start, stop = _int(params[1]), _int(params[2])
+            stop = len(items) if stop == -1 else stop + 1
+            return items[start:stop]
+        if command == "LREM":
+            items = store._list(params[0])
+            if not items:
+                return 0
+            count, value = _int(params[1]), params[2]
+            if count != 0:
+                raise CommandError("ERR only LREM with count 0 is supported")
+            kept = [item for item in items if item != value]
+            removed = len(items) - len(kept)
+            store.data[params[0]] = kept
+            store._drop_if_empty(params[0])
+            return removed
+        if command == "LPOS":
+            items = store._list(params[0]) or []
+            try:
+                return items.index(params[1])
+            except ValueError:
+                return None
+        if command == "FLUSHDB":
+            store.data.clear()
+            store.expires.clear()
+            return "OK"
+        if command == "DBSIZE":
+            return sum(1 for key in list(store.data) if store._alive(key))
+    raise CommandError(f"ERR unknown command '{command}'")
+
+
+def encode(reply) -> bytes:
+    """Serialize a reply in RESP"""
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, str):
+        return b"+" + reply.encode("utf-8") + b"\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(encode(item) for item in reply)
+    raise TypeError(f"Cannot encode {type(reply).__name__}")
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    store: RespStore
+
+    def _read_command(self) -> Optional[List[bytes]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline command, as typed into telnet
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            header = self.rfile.readline()
+            length = int(header[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        while True:
+            try:
+                args = self._read_command()
+            except (OSError, ValueError):
+                return
+            if args is None:
+                return
+            try:
+                reply = encode(execute(self.store, args))
+            except CommandError as e:
+                reply = b"-" + str(e).encode("utf-8") + b"\r\n"
+            except (IndexError, ValueError):
+                reply = b"-ERR wrong number of arguments\r\n"
+            try:
+                self.wfile.write(reply)
+                self.wfile.flush()
+            except OSError:
+                return
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def create_server(host: str = "127.0.0.1", port: int = 6390,
+                  store: Optional[RespStore] = None) -> socketserver.ThreadingTCPServer:
+    """
+    Build a stand-in server; call serve_forever() on it (or run it in a thread)
+
+    Args:
+        host: Interface to bind
+        port: Port to bind, 0 picks a free one
+        store: Data to serve; a fresh empty store by default
+    """
+    handler = type("ConfiguredRespHandler", (RespHandler,), {"store": store or RespStore()})
+    return _Server((host, port), handler)
+
+
+def start_background_server(host: str = "127.0.0.1", port: int = 0) -> Tuple[socketserver.ThreadingTCPServer, str]:
+    """
+    Start a stand-in server on a daemon thread
+
+    Returns:
+        Tuple of (server, url); call server.shutdown() when done
+    """
+    server = create_server(host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    bound_host, bound_port = server.server_address[:2]
+    return server, f"redis://{bound_host}:{bound_port}/0"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-memory Redis stand-in for running replicas offline")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port)
+    print(f"Redis stand-in listening on redis://{args.host}:{server.server_address[1]}/0")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+"""
+Offline narration of storybooks, for children who can't read yet.
+
+Paragraphs are spoken by a local text-to-speech engine: espeak-ng (or
+espeak) run as a subprocess, or pyttsx3 when no espeak binary is installed.
+Nothing goes over the network. Paragraphs render in parallel on a worker
+pool and come back in reading order, so the first one can play while the
+rest are still rendering. Audio is cached on disk by paragraph text, voice
+and speaking rate, so reading a story again, or another story that shares a
+paragraph, skips the engine.
+"""
+import hashlib
+import io
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import unicodedata
+import wave
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from instrumentation import count_cache, span
+from story_languages import DEFAULT_LANGUAGE, STORY_LANGUAGES, native_name
+from storybook_formatter import MULTILINGUAL_SEPARATOR, RTL_MARK
+
+NARRATION_WORKERS = int(os.getenv("NARRATION_WORKERS", "4"))
+# Words per minute; a little slower than espeak's default of 175 for young listeners
+NARRATION_RATE = int(os.getenv("NARRATION_RATE", "150"))
+DEFAULT_CACHE_DIR = os.getenv(
+    "NARRATION_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "narration")
+)
+MAX_CACHE_BYTES = int(os.getenv("NARRATION_CACHE_MB", "200")) * 1024 * 1024
+# The oldest cached audio is pruned after this many writes once the cache is over its size
+PRUNE_EVERY_WRITES = 32
+SYNTHESIS_TIMEOUT_SECONDS = 60
+# Silence between paragraphs when they are joined into one recording
+PARAGRAPH_PAUSE_SECONDS = 0.6
+
+# Story language -> espeak-ng voice; languages missing here are not narrated
+ESPEAK_VOICES = {
+    "en": "en-us",
+    "es": "es-419",
+    "zh": "cmn",
+    "vi": "vi",
+    "ar": "ar",
+    "ko": "ko",
+    "ru": "ru",
+    "fr": "fr-fr",
+    "pt": "pt-br",
+    "hi": "hi",
+    "ur": "ur",
+    "fa": "fa",
+    "he": "he",
+    "ja": "ja",
+}
+
+# Formatting that should not be read aloud
+MARKUP_PATTERN = re.compile(r'\*\*|(?<!\w)\*|\*(?!\w)|^#{1,6}\s+', re.MULTILINE)
+RULE_PATTERN = re.compile(r'^-{3,}$')
+LANGUAGE_LABEL_PATTERN = re.compile(r'^🌍 \*(.+)\*$')
+SILENT_CATEGORIES = {"So", "Sk", "Cf"}
+
+_pyttsx3_lock = threading.Lock()
+
+
+def detect_engine() -> Optional[str]:
+    """The best local text-to-speech engine available: "espeak-ng", "espeak", "pyttsx3" or None"""
+    for binary in ("espeak-ng", "espeak"):
+        if shutil.which(binary):
+            return binary
+    try:
+        import pyttsx3  # noqa: F401
+        return "pyttsx3"
+    except ImportError:
+        return None
+
+
+def speakable_text(paragraph: str) -> str:
+    """A formatted paragraph with its markdown, emoji and direction marks removed"""
+    text = MARKUP_PATTERN.sub('', paragraph.replace(RTL_MARK, ''))
+    # Combining marks belong to the character before them: kept in words
+    # (Hindi, Vietnamese), dropped with emoji (variation selectors)
+    kept = []
+    dropped = True
+    for char in text:
+        category = unicodedata.category(char)
+        if category == "Mn":
+            if not dropped:
+                kept.append(char)
+            continue
+        dropped = category in SILENT_CATEGORIES
+        if not dropped:
+            kept.append(char)
+    return ' '.join(''.join(kept).split())
+
+
+def narration_sections(formatted_story: str, language: str = DEFAULT_LANGUAGE) -> List[Tuple[str, List[str]]]:
+    """
+    Split a formatted story into what should be read aloud, by language
+
+    Multilingual stories (see StorybookFormatter.format_multilingual) are
+    split on their language labels; anything unlabelled is taken to be in
+    the given language.
+
+    Args:
+        formatted_story: Output of StorybookFormatter
+        language: Language code of unlabelled text
+
+    Returns:
+        List of (language code, speakable paragraphs) in reading order
+    """
+    codes_by_label = {native_name(code): code for code in STORY_LANGUAGES}
+    sections = []
+    for section in formatted_story.split(MULTILINGUAL_SEPARATOR):
+        blocks = [block.strip() for block in re.split(r'\n\s*\n', section) if block.strip()]
+        section_language = language
+        if blocks:
+            label = LANGUAGE_LABEL_PATTERN.match(blocks[0])
+            if label and label.group(1) in codes_by_label:
+                section_language = codes_by_label[label.group(1)]
+                blocks = blocks[1:]
+        paragraphs = [speakable_text(block) for block in blocks if not RULE_PATTERN.match(block)]
+        paragraphs = [paragraph for paragraph in paragraphs if paragraph]
+        if paragraphs:
+            sections.append((section_language, paragraphs))
+    return sections
+
+
+def _clean_wav(data: bytes) -> bytes:
+    """Rewrite a WAV with correct sizes; espeak leaves them unset when writing to a pipe"""
+    with wave.open(io.BytesIO(data), "rb") as source:
+        params = source.getparams()
+        frames = source.readframes(source.getnframes())
+    output = io.BytesIO()
+    with wave.open(output, "wb") as target:
+        target.setnchannels(params.nchannels)
+        target.setsampwidth(params.sampwidth)
+        target.setframerate(params.framerate)
+        target.writeframes(frames)
+    return output.getvalue()
+
+
+def join_wav(recordings: List[bytes], pause_seconds: float = PARAGRAPH_PAUSE_SECONDS) -> Optional[bytes]:
+    """
+    Join paragraph recordings into one WAV with a short pause between them
+
+    Recordings whose format differs from the first are left out.
+
+    Returns:
+        WAV bytes, or None if there was nothing to join
+    """
+    params = None
+    output = io.BytesIO()
+    with wave.open(output, "wb") as target:
+        for data in recordings:
+            with wave.open(io.BytesIO(data), "rb") as source:
+                current = source.getparams()
+                if params is None:
+                    params = current
+                    target.setnchannels(params.nchannels)
+                    target.setsampwidth(params.sampwidth)
+                    target.setframerate(params.framerate)
+                elif current[:3] != params[:3]:
+                    continue
+                else:
+                    pause_frames = int(params.framerate * pause_seconds)
+                    target.writeframes(b"\0" * pause_frames * params.sampwidth * params.nchannels)
+                target.writeframes(source.readframes(source.getnframes()))
+        if params is None:
+            target.setnchannels(1)
+            target.setsampwidth(2)
+            target.setframerate(22050)
+    return output.getvalue() if params is not None else None
+
+
+class Narrator:
+    def __init__(self, engine: Optional[str] = None, rate: int = NARRATION_RATE,
+                 workers: int = NARRATION_WORKERS, cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+                 max_cache_bytes: int = MAX_CACHE_BYTES):
+        """
+        Read storybooks aloud with a local text-to-speech engine
+
+        Args:
+            engine: "espeak-ng", "espeak" or "pyttsx3"; the best available by default
+            rate: Speaking rate in words per minute
+            workers: Paragraphs rendered at once. pyttsx3 drives one speech
+                engine, so with it paragraphs render one at a time
+            cache_dir: Folder for cached audio; None keeps nothing on disk
+            max_cache_bytes: Size the cache folder is pruned back to
+        """
+        self.engine = engine or detect_engine()
+        self.rate = rate
+        self.cache_dir = cache_dir
+        self.max_cache_bytes = max_cache_bytes
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="narration")
+        self._lock = threading.Lock()
+        # Paragraphs being rendered, so sessions reading the same story share the work
+        self._inflight: Dict[str, Future] = {}
+        self._writes = 0
+
+    @property
+    def available(self) -> bool:
+        return self.engine is not None
+
+    def voice_for(self, language: str) -> Optional[str]:
+        """The engine's voice for a story language, or None if it can't be narrated"""
+        if self.engine == "pyttsx3":
+            # pyttsx3 voices are matched by language when rendering
+            return language
+        return ESPEAK_VOICES.get(language)
+
+    def _cache_key(self, text: str, voice: str) -> str:
+        return hashlib.sha256(f"{self.engine}\0{voice}\0{self.rate}\0{text}".encode("utf-8")).hexdigest()
+
+    def _cache_path(self, key: str) -> Optional[str]:
+        return os.path.join(self.cache_dir, f"{key}.wav") if self.cache_dir else None
+
+    def _cached(self, key: str) -> Optional[bytes]:
+        path = self._cache_path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            # Marks the entry as recently used for pruning
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _store(self, key: str, data: bytes):
+        path = self._cache_path(key)
+        if path is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error caching narration: {e}")
+            return
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % PRUNE_EVERY_WRITES == 0
+        if prune:
+            self._prune()
+
+    def _prune(self):
+        """Drop the least recently used audio until the cache fits its size"""
+        try:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".wav"):
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                    entries.append((stat.st_mtime, stat.st_size, name))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_cache_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self.cache_dir, name))
+                total -= size
+            except OSError:
+                pass
+
+    def _synthesize(self, text: str, voice: str) -> bytes:
+        if self.engine == "pyttsx3":
+            return self._synthesize_pyttsx3(text, voice)
+        result = subprocess.run(
+            [self.engine, "-v", voice, "-s", str(self.rate), "-b", "1", "--stdout"],
+            input=text.encode("utf-8"), capture_output=True,
+            timeout=SYNTHESIS_TIMEOUT_SECONDS, check=True
+        )
+        return _clean_wav(result.stdout)
+
+    def _synthesize_pyttsx3(self, text: str, language: str) -> bytes:
+        import pyttsx3
+
+        fd, path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            with _pyttsx3_lock:
+                engine = pyttsx3.init()
+                engine.setProperty("rate", self.rate)
+                for voice in engine.getProperty("voices"):
+                    languages = [str(code).lower().lstrip("\x05") for code in getattr(voice, "languages", [])]
+                    if any(code.startswith(language) for code in languages):
+                        engine.setProperty("voice", voice.id)
+                        break
+                engine.save_to_file(text, path)
+                engine.runAndWait()
+                engine.stop()
+            with open(path, "rb") as f:
+                return _clean_wav(f.read())
+        finally:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _render(self, key: str, text: str, voice: str) -> Optional[bytes]:
+        try:
+            with span("narrate_paragraph", engine=self.engine, voice=voice) as stage:
+                try:
+                    data = self._synthesize(text, voice)
+                except Exception as e:
+                    print(f"Error narrating paragraph: {e}")
+                    stage.fail(str(e))
+                    return None
+            self._store(key, data)
+            return data
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _submit(self, text: str, voice: str) -> Future:
+        """Cached audio right away, or a render on the pool shared with anyone asking for the same"""
+        key = self._cache_key(text, voice)
+        data = self._cached(key)
+        count_cache("narration", hit=data is not None)
+        if data is not None:
+            future = Future()
+            future.set_result(data)
+            return future
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._inflight[key] = self._pool.submit(self._render, key, text, voice)
+        return future
+
+    def narrate(self, formatted_story: str, language: str = DEFAULT_LANGUAGE) -> Iterator[Tuple[str, Optional[bytes]]]:
+        """
+        Read a formatted story aloud, one paragraph at a time
+
+        Every paragraph is queued for rendering at once, in reading order, and
+        each is yielded as soon as it and the ones before it are ready, so
+        playback can start with the first paragraph.
+
+        Args:
+            formatted_story: Output of StorybookFormatter
+            language: Language of text without a language label
+
+        Yields:
+            Tuples of (paragraph text, WAV bytes or None if that paragraph failed)
+        """
+        if not self.available:
+            print("Error narrating story: no offline text-to-speech engine; install espeak-ng or pyttsx3")
+            return
+
+        pending = []
+        for section_language, paragraphs in narration_sections(formatted_story, language):
+            voice = self.voice_for(section_language)
+            if voice is None:
+                print(f"Narration is not available in {section_language}; skipping that part")
+                continue
+            pending.extend((paragraph, self._submit(paragraph, voice)) for paragraph in paragraphs)
+
+        for paragraph, future in pending:
+            yield paragraph, future.result()
+
+    def narrate_to_wav(self, formatted_story: str, language: str = DEFAULT_LANGUAGE) -> Optional[bytes]:
+        """
+        Read a whole story into one recording
+
+        Returns:
+            WAV bytes, or None if nothing could be narrated
+        """
+        return join_wav([audio for _, audio in self.narrate(formatted_story, language) if audio])
+
+    def shutdown(self):
+        # Cancel paragraphs still waiting by hand; shutdown(cancel_futures=True) needs Python 3.9
+        with self._lock:
+            futures = list(self._inflight.values())
+        for future in futures:
+            future.cancel()
+        self._pool.shutdown(wait=False)
+
+
+_shared_narrator: Optional[Narrator] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_narrator() -> Narrator:
+    """One narrator, worker pool and audio cache for every session in this process"""
+    global _shared_narrator
+    with _shared_lock:
+        if _shared_narrator is None:
+            _shared_narrator = Narrator()
+        return _shared_narrator
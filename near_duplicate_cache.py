@@ -0,0 +1,369 @@
+import difflib
+import functools
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from medical_glossary import get_shared_glossary
+from shared_backend import BACKEND_ERRORS, SharedBackend, get_shared_backend
+
+# Common shorthand from prescriptions and visit notes, expanded before comparing
+ABBREVIATIONS = {
+    "bid": "twice daily",
+    "b.i.d": "twice daily",
+    "tid": "three times daily",
+    "t.i.d": "three times daily",
+    "qid": "four times daily",
+    "q.i.d": "four times daily",
+    "qd": "once daily",
+    "od": "once daily",
+    "qhs": "at bedtime",
+    "prn": "as needed",
+    "po": "by mouth",
+    "abx": "antibiotics",
+    "antibiotic": "antibiotics",
+    "dx": "diagnosis",
+    "rx": "prescription",
+    "hx": "history",
+    "sx": "symptoms",
+    "fx": "fracture",
+    "uri": "upper respiratory infection",
+    "om": "ear infection",
+    "otitis": "ear infection",
+    "strep": "strep throat",
+    "xray": "x-ray",
+    "amox": "amoxicillin",
+    "tylenol": "acetaminophen",
+    "motrin": "ibuprofen",
+    "advil": "ibuprofen",
+    "wks": "weeks",
+    "wk": "week",
+    "hrs": "hours",
+    "hr": "hour",
+    "mg": "milligrams",
+    "ml": "milliliters",
+}
+
+# Words that carry no medical meaning for matching purposes
+STOPWORDS = frozenset("""
+a an and are as at be been but by for from has have he her his i in is it its
+me my of on or our she so that the their them they this to was we were will with
+you your patient child kid doctor said says needs need take taking should
+""".split())
+
+# Words that flip the meaning of a note ("no fracture"); like numbers, they must match exactly
+NEGATION_TOKENS = frozenset("""
+no not none never negative without denies denied ruled
+""".split())
+# Cues that negate the word after them; "no fracture" becomes the single token "no_fracture"
+PREFIX_NEGATIONS = NEGATION_TOKENS - {"negative", "ruled"}
+NEGATED_PREFIX = "no_"
+
+# Which side a note is about; "left wrist" and "right wrist" need different stories
+LATERALITY_TOKENS = frozenset({"left", "right", "bilateral", "both"})
+
+# "x10d", "x 10 days", "10d" -> "10 days"
+DURATION_PATTERN = re.compile(r'\bx?\s?(\d+)\s?d(?:ays?)?\b')
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9.\-]*")
+
+# Mersenne prime used for the universal hash family
+_PRIME = (1 << 61) - 1
+
+# Stories other replicas can reuse are kept in the shared backend this long
+SHARED_TTL_SECONDS = 30 * 24 * 3600
+
+
+def normalize_tokens(text: str) -> FrozenSet[str]:
+    """
+    Normalize medical text into a set of comparable tokens
+
+    Lowercases, expands abbreviations and duration shorthand, and drops stopwords.
+    A negation is bound to the word after it ("no fracture" -> "no_fracture"),
+    so "fracture, no swelling" and "swelling, no fracture" stay different.
+
+    Args:
+        text: Raw input typed or dictated by a parent
+
+    Returns:
+        Set of normalized tokens
+    """
+    text = DURATION_PATTERN.sub(r' \1 days ', text.lower())
+    tokens = set()
+    negation = None
+    for raw in TOKEN_PATTERN.findall(text):
+        sentence_end = raw.endswith('.')
+        raw = raw.rstrip('.-')
+        if raw in PREFIX_NEGATIONS:
+            negation = raw
+        else:
+            expanded = ABBREVIATIONS.get(raw, raw)
+            for token in expanded.split():
+                if token in STOPWORDS:
+                    continue
+                if negation is not None:
+                    token = NEGATED_PREFIX + token
+                    negation = None
+                tokens.add(token)
+        if negation is not None and sentence_end:
+            tokens.add(negation)
+            negation = None
+    if negation is not None:
+        tokens.add(negation)
+    return frozenset(tokens)
+
+
+def same_medical_content(old: str, new: str) -> bool:
+    """
+    Whether an edit left the medical content of a text alone
+
+    The two texts are diffed word by word; the edit is harmless when every
+    changed word normalizes away (punctuation, casing, filler words). Any
+    changed medication, dosage, duration or diagnosis counts as a change.
+
+    Args:
+        old: Text a story was written from
+        new: The same text after the parent's edits
+
+    Returns:
+        True if a story written from old still fits new
+    """
+    old_words = [word.rstrip('.-') for word in TOKEN_PATTERN.findall(old.lower())]
+    new_words = [word.rstrip('.-') for word in TOKEN_PATTERN.findall(new.lower())]
+    matcher = difflib.SequenceMatcher(a=old_words, b=new_words, autojunk=False)
+    changed = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            changed.extend(old_words[i1:i2] + new_words[j1:j2])
+    return not normalize_tokens(" ".join(changed))
+
+
+@functools.lru_cache(maxsize=None)
+def _medication_names() -> Dict[str, str]:
+    """Single-word medication names and brands from the glossary, mapped to the drug"""
+    forms = get_shared_glossary().forms_in_category("medication")
+    return {form: term for form, term in forms.items() if ' ' not in form}
+
+
+def _hard_tokens(tokens: FrozenSet[str]) -> FrozenSet[str]:
+    """Numbers, negations, sides and drugs, which a reused story must share exactly"""
+    medications = _medication_names()
+    hard = set()
+    for token in tokens:
+        if (token in NEGATION_TOKENS or token in LATERALITY_TOKENS or token.startswith(NEGATED_PREFIX)
+                or any(c.isdigit() for c in token)):
+            hard.add(token)
+        elif token in medications:
+            hard.add(medications[token])
+    return frozenset(hard)
+
+
+def _shared_key(tokens: FrozenSet[str]) -> str:
+    return hashlib.sha256("\n".join(sorted(tokens)).encode("utf-8")).hexdigest()
+
+
+class NearDuplicateCache:
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, bands: int = 16,
+                 max_entries: int = 100_000, shared: Optional[SharedBackend] = None,
+                 namespace: str = "story"):
+        """
+        MinHash/LSH index mapping previously seen inputs to their generated stories
+
+        With a shared backend, stories are also published for other replicas.
+        Those are matched by their exact normalized tokens only; a story found
+        that way joins the local index, so near-duplicates of it hit locally
+        from then on.
+
+        Args:
+            threshold: Minimum Jaccard similarity of normalized tokens to count as a hit
+            num_perm: Number of MinHash permutations (must be divisible by bands)
+            bands: Number of LSH bands; more bands find lower-similarity candidates
+            max_entries: Oldest entries are evicted beyond this size
+            shared: Backend shared with other replicas, if any
+            namespace: Shared backend namespace, so each language's stories are kept apart
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+        self.shared = shared
+        self.namespace = namespace
+
+        # Deterministic permutations so signatures are stable across processes
+        seed = hashlib.blake2b(b"near-duplicate-cache", digest_size=8).digest()
+        state = int.from_bytes(seed, "big")
+        self._perms: List[Tuple[int, int]] = []
+        for _ in range(num_perm):
+            state = (state * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            a = state % (_PRIME - 1) + 1
+            state = (state * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            b = state % _PRIME
+            self._perms.append((a, b))
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[FrozenSet[str], Tuple[str, Tuple[int, ...]]]" = OrderedDict()
+        self._buckets: List[Dict[Tuple[int, ...], set]] = [dict() for _ in range(bands)]
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    def _signature(self, tokens: FrozenSet[str]) -> Tuple[int, ...]:
+        hashes = [int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "big")
+                  for t in tokens] or [0]
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in self._perms)
+
+    def _band_keys(self, signature: Tuple[int, ...]):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def lookup(self, text: str) -> Optional[str]:
+        """
+        Find a cached story for an input similar enough to this one
+
+        Dosages, durations, negations, sides and medications must match
+        exactly, so "10 days" never reuses a "5 days" story, "no fracture"
+        never reuses a "fracture" story and azithromycin never reuses an
+        amoxicillin story, however similar the rest of the text is.
+
+        Args:
+            text: The medical text about to be translated
+
+        Returns:
+            The cached story, or None if there is no close enough match
+        """
+        tokens = normalize_tokens(text)
+        if not tokens:
+            return None
+
+        with self._lock:
+            exact = self._entries.get(tokens)
+            if exact is not None:
+                self._entries.move_to_end(tokens)
+                self.hits += 1
+                return exact[0]
+
+        signature = self._signature(tokens)
+        hard_tokens = _hard_tokens(tokens)
+
+        with self._lock:
+            candidates = set()
+            for band, key in self._band_keys(signature):
+                candidates.update(self._buckets[band].get(key, ()))
+
+            best_story = None
+            best_score = self.threshold
+            for candidate in candidates:
+                if _hard_tokens(candidate) != hard_tokens:
+                    continue
+                score = len(tokens & candidate) / len(tokens | candidate)
+                if score >= best_score:
+                    best_score = score
+                    best_story = self._entries[candidate][0]
+                    best_key = candidate
+
+            if best_story is not None:
+                self._entries.move_to_end(best_key)
+                self.hits += 1
+                return best_story
+
+        shared_story = self._lookup_shared(tokens)
+        with self._lock:
+            if shared_story is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.shared_hits += 1
+        self._index(tokens, shared_story, signature)
+        return shared_story
+
+    def _lookup_shared(self, tokens: FrozenSet[str]) -> Optional[str]:
+        if self.shared is None:
+            return None
+        try:
+            return self.shared.get(self.namespace, _shared_key(tokens))
+        except BACKEND_ERRORS as e:
+            print(f"Error reading shared story cache: {e}")
+            return None
+
+    def add(self, text: str, story: str):
+        """
+        Remember the story generated for an input
+
+        Args:
+            text: The medical text that was translated
+            story: The story Claude produced for it
+        """
+        tokens = normalize_tokens(text)
+        if not tokens:
+            return
+
+        self._index(tokens, story, self._signature(tokens))
+        if self.shared is not None:
+            try:
+                self.shared.set(self.namespace, _shared_key(tokens), story, ttl=SHARED_TTL_SECONDS)
+            except BACKEND_ERRORS as e:
+                print(f"Error writing shared story cache: {e}")
+
+    def _index(self, tokens: FrozenSet[str], story: str, signature: Tuple[int, ...]):
+        with self._lock:
+            if tokens in self._entries:
+                self._entries[tokens] = (story, signature)
+                self._entries.move_to_end(tokens)
+                return
+
+            self._entries[tokens] = (story, signature)
+            for band, key in self._band_keys(signature):
+                self._buckets[band].setdefault(key, set()).add(tokens)
+
+            while len(self._entries) > self.max_entries:
+                old_tokens, (_, old_signature) = self._entries.popitem(last=False)
+                for band, key in self._band_keys(old_signature):
+                    bucket = self._buckets[band].get(key)
+                    if bucket is not None:
+                        bucket.discard(old_tokens)
+                        if not bucket:
+                            del self._buckets[band][key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters for this cache"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "shared_hits": self.shared_hits,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_shared_caches: Dict[str, NearDuplicateCache] = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_cache(threshold: float = 0.8, language: str = "en") -> NearDuplicateCache:
+    """
+    Process-wide cache shared by every Streamlit session
+
+    Backed by the SHARED_BACKEND_URL backend, when set, so replicas reuse
+    each other's stories.
+
+    Args:
+        threshold: Similarity threshold used when the cache is first created
+        language: Stories in each language get a cache of their own
+    """
+    with _shared_lock:
+        cache = _shared_caches.get(language)
+        if cache is None:
+            namespace = "story" if language == "en" else f"story_{language}"
+            cache = _shared_caches[language] = NearDuplicateCache(
+                threshold=threshold, shared=get_shared_backend(), namespace=namespace
+            )
+        return cache
@@ -0,0 +1,300 @@
+"""
+Headless batch pipeline: audio recordings or text notes in, storybooks out.
+
+Each input flows through load -> transcribe -> translate -> format
+(-> narrate) -> write stages. Every stage runs its own worker threads and hands items to the next
+stage through a bounded queue, so a slow stage applies backpressure instead of
+piling up work in memory.
+
+Usage:
+    python pipeline.py recordings/ notes/*.txt --out storybooks/ --style magical \\
+        --transcribe-workers 1 --translate-workers 4 --narrate
+"""
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from storybook_formatter import ChapterBookWriter, StorybookFormatter
+
+AUDIO_EXTENSIONS = {".wav", ".mp3", ".m4a", ".flac", ".ogg", ".webm"}
+TEXT_EXTENSIONS = {".txt", ".md"}
+
+_STOP = object()
+
+
+def discover_inputs(paths: Iterable[str]) -> List[str]:
+    """
+    Expand files and folders into the list of supported input files
+
+    Args:
+        paths: Files and/or directories given on the command line
+
+    Returns:
+        Sorted list of audio and text files
+    """
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in files:
+                    found.append(os.path.join(root, name))
+        else:
+            found.append(path)
+
+    supported = AUDIO_EXTENSIONS | TEXT_EXTENSIONS
+    return sorted(p for p in found if os.path.splitext(p)[1].lower() in supported)
+
+
+class _Stage:
+    def __init__(self, name: str, workers: int, handler: Callable[[Dict], Dict],
+                 inbox: "queue.Queue", outbox: "queue.Queue", downstream_workers: int):
+        """A pool of worker threads applying one handler between two queues"""
+        self.name = name
+        self.workers = workers
+        self.handler = handler
+        self.inbox = inbox
+        self.outbox = outbox
+        self.downstream_workers = downstream_workers
+        self._remaining = workers
+        self._lock = threading.Lock()
+        self.threads: List[threading.Thread] = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _run(self):
+        while True:
+            item = self.inbox.get()
+            if item is _STOP:
+                break
+            if not item.get("error"):
+                started = time.perf_counter()
+                try:
+                    item = self.handler(item)
+                except Exception as e:
+                    item["error"] = f"{self.name}: {e}"
+                item["timings"][self.name] = time.perf_counter() - started
+            self.outbox.put(item)
+
+        # The last worker to finish tells every downstream worker to stop
+        with self._lock:
+            self._remaining -= 1
+            last = self._remaining == 0
+        if last:
+            for _ in range(self.downstream_workers):
+                self.outbox.put(_STOP)
+
+
+class StoryPipeline:
+    def __init__(self, style: str = "friendly", transcribe_workers: int = 1,
+                 translate_workers: int = 4, format_workers: int = 1, queue_size: int = 8,
+                 model_size: str = "base", translator=None, narrate: bool = False,
+                 progress: Optional[Callable[[Dict], None]] = None):
+        """
+        Configure a batch run
+
+        Args:
+            style: Story style for every output
+            transcribe_workers: Parallel Whisper transcriptions (each loads its own model)
+            translate_workers: Parallel Claude requests
+            format_workers: Parallel formatting workers
+            queue_size: Capacity of each queue between stages
+            model_size: Whisper model size for audio inputs
+            translator: MedicalTranslator to use; created on first use if not given
+            narrate: Also write a spoken version of each story (needs espeak-ng or pyttsx3)
+            progress: Called with each finished item
+        """
+        self.style = style
+        self.transcribe_workers = max(1, transcribe_workers)
+        self.translate_workers = max(1, translate_workers)
+        self.format_workers = max(1, format_workers)
+        self.queue_size = max(1, queue_size)
+        self.model_size = model_size
+        self.translator = translator
+        self.narrate = narrate
+        self.progress = progress
+        self.formatter = StorybookFormatter()
+        self._stt_local = threading.local()
+
+    def _load(self, item: Dict) -> Dict:
+        if item["kind"] == "text":
+            with open(item["source"], encoding="utf-8") as f:
+                item["original"] = f.read().strip()
+        return item
+
+    def _transcribe(self, item: Dict) -> Dict:
+        if item["kind"] != "audio":
+            return item
+
+        # Whisper models are not safe to share between threads
+        stt = getattr(self._stt_local, "stt", None)
+        if stt is None:
+            from speech_to_text import SpeechToText
+            stt = self._stt_local.stt = SpeechToText(self.model_size)
+
+        text = stt.transcribe_audio(item["source"])
+        if not text:
+            raise RuntimeError("no speech recognized")
+        item["original"] = text
+        return item
+
+    def _translate(self, item: Dict) -> Dict:
+        if not item.get("original"):
+            raise RuntimeError("empty input")
+        story = self.translator.translate_to_storybook(item["original"], self.style)
+        if not story:
+            raise RuntimeError("Claude returned no story")
+        item["story"] = story
+        return item
+
+    def _format(self, item: Dict) -> Dict:
+        item["formatted"] = self.formatter.format_storybook(item["story"], self.style)
+        return item
+
+    def _narrate(self, item: Dict) -> Dict:
+        # The narrator renders paragraphs on its own pool, so one worker keeps it busy
+        from narration import get_shared_narrator
+
+        audio = get_shared_narrator().narrate_to_wav(item["formatted"])
+        if audio is None:
+            # The written story is still good without its narration
+            item["narration_error"] = "no audio; is espeak-ng or pyttsx3 installed?"
+        else:
+            item["audio"] = audio
+        return item
+
+    def run(self, paths: Iterable[str], out_dir: str) -> Dict:
+        """
+        Process every input and write the results
+
+        Writes stories.jsonl (one record per input), one markdown file per
+        story (plus a WAV file when narrating), and book.md with every
+        successful story as a chapter.
+
+        Args:
+            paths: Input files and folders
+            out_dir: Output directory (created if missing)
+
+        Returns:
+            Summary with counts and total wall time
+        """
+        inputs = discover_inputs(paths)
+        os.makedirs(out_dir, exist_ok=True)
+        if self.translator is None:
+            from medical_translator import MedicalTranslator
+            self.translator = MedicalTranslator()
+
+        stage_specs = [
+            ("load", 1, self._load),
+            ("transcribe", self.transcribe_workers, self._transcribe),
+            ("translate", self.translate_workers, self._translate),
+            ("format", self.format_workers, self._format),
+        ]
+        if self.narrate:
+            stage_specs.append(("narrate", 1, self._narrate))
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(len(stage_specs) + 1)]
+        stages = []
+        for i, (name, workers, handler) in enumerate(stage_specs):
+            downstream = stage_specs[i + 1][1] if i + 1 < len(stage_specs) else 1
+            stages.append(_Stage(name, workers, handler, queues[i], queues[i + 1], downstream))
+
+        started = time.perf_counter()
+        for stage in stages:
+            stage.start()
+
+        def feed():
+            for index, path in enumerate(inputs):
+                kind = "audio" if os.path.splitext(path)[1].lower() in AUDIO_EXTENSIONS else "text"
+                queues[0].put({"index": index, "source": path, "kind": kind, "style": self.style, "timings": {}})
+            queues[0].put(_STOP)
+
+        threading.Thread(target=feed, name="feed", daemon=True).start()
+
+        results = self._write_results(queues[-1], out_dir)
+        elapsed = time.perf_counter() - started
+
+        succeeded = sum(1 for r in results if not r.get("error"))
+        return {
+            "inputs": len(inputs),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "seconds": elapsed,
+            "items_per_second": len(results) / elapsed if elapsed else 0.0,
+        }
+
+    def _write_results(self, inbox: "queue.Queue", out_dir: str) -> List[Dict]:
+        """Single writer so output files never interleave"""
+        results = []
+        jsonl_path = os.path.join(out_dir, "stories.jsonl")
+        with open(jsonl_path, "w", encoding="utf-8") as jsonl:
+            while True:
+                item = inbox.get()
+                if item is _STOP:
+                    break
+                if not item.get("error"):
+                    stem = os.path.splitext(os.path.basename(item["source"]))[0]
+                    item["output"] = os.path.join(out_dir, f"{item['index']:04d}_{stem}.md")
+                    with open(item["output"], "w", encoding="utf-8") as f:
+                        f.write(item["formatted"] + "\n")
+                audio = item.pop("audio", None)
+                if audio is not None:
+                    item["audio_output"] = os.path.splitext(item["output"])[0] + ".wav"
+                    with open(item["audio_output"], "wb") as f:
+                        f.write(audio)
+
+                jsonl.write(json.dumps(item, ensure_ascii=False) + "\n")
+                jsonl.flush()
+                results.append(item)
+                if self.progress:
+                    self.progress(item)
+
+        # Chapters follow input order, not completion order
+        results.sort(key=lambda r: r["index"])
+        book = ChapterBookWriter([r["formatted"] for r in results if not r.get("error")])
+        with open(os.path.join(out_dir, "book.md"), "w", encoding="utf-8") as f:
+            book.write_to(f)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Turn folders of recordings or notes into storybooks")
+    parser.add_argument("inputs", nargs="+", help="Audio/text files or folders")
+    parser.add_argument("--out", default="storybooks", help="Output directory")
+    parser.add_argument("--style", default="friendly", choices=["friendly", "adventure", "magical", "superhero"])
+    parser.add_argument("--model", default="base", help="Whisper model size for audio inputs")
+    parser.add_argument("--transcribe-workers", type=int, default=1)
+    parser.add_argument("--translate-workers", type=int, default=4)
+    parser.add_argument("--format-workers", type=int, default=1)
+    parser.add_argument("--queue-size", type=int, default=8, help="Capacity of each queue between stages")
+    parser.add_argument("--narrate", action="store_true", help="Also write a spoken WAV of each story")
+    args = parser.parse_args()
+
+    def report(item: Dict):
+        status = f"error: {item['error']}" if item.get("error") else "ok"
+        total = sum(item["timings"].values())
+        print(f"[{item['index'] + 1}] {item['source']} - {status} ({total:.1f}s)")
+
+    pipeline = StoryPipeline(
+        style=args.style,
+        transcribe_workers=args.transcribe_workers,
+        translate_workers=args.translate_workers,
+        format_workers=args.format_workers,
+        queue_size=args.queue_size,
+        model_size=args.model,
+        narrate=args.narrate,
+        progress=report,
+    )
+    summary = pipeline.run(args.inputs, args.out)
+    print(f"Done: {summary['succeeded']}/{summary['inputs']} stories in {summary['seconds']:.1f}s "
+          f"({summary['items_per_second']:.2f}/s), written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+On-demand profiling of the next N runs with cProfile and tracemalloc.
+
+Arm the profiler with STORYBOOK_PROFILE_RUNS=N at startup, or from the admin
+controls in the Streamlit sidebar, and the next N runs are captured. A run is
+one Streamlit script run or one background job (Whisper or Claude). Each
+captured run writes, to STORYBOOK_PROFILE_DIR:
+
+    <stamp>_<label>.prof       raw cProfile data, for pstats or snakeviz
+    <stamp>_<label>_hot.txt    functions ranked by cumulative and own time
+    <stamp>_<label>_alloc.txt  allocation sites that grew during the run
+    <stamp>_<label>.collapsed  collapsed stacks for flamegraph.pl or speedscope
+
+cProfile sees only the thread it runs on, so each run is profiled where it
+executes: script runs on the session thread, story jobs on their worker
+thread, transcriptions inside the Whisper worker process. Only one cProfile
+can be active per process (Python 3.12 enforces this), so runs that start
+while another is being profiled go unprofiled and leave the armed count for
+a later run.
+"""
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+PROFILE_DIR = os.getenv("STORYBOOK_PROFILE_DIR", "profiles")
+PROFILE_RUNS = int(os.getenv("STORYBOOK_PROFILE_RUNS", "0"))
+
+HOT_FUNCTIONS = 40
+ALLOCATION_SITES = 30
+TRACEMALLOC_FRAMES = 10
+
+# Stacks deeper than this are cut off in the collapsed output
+MAX_STACK_DEPTH = 64
+
+FuncKey = Tuple[str, int, str]
+
+
+def _frame_name(func: FuncKey) -> str:
+    filename, line, name = func
+    if filename == "~":
+        # Built-ins show up as ('~', 0, '<built-in method ...>')
+        return name.strip("<>")
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def collapsed_stacks(stats: pstats.Stats) -> List[str]:
+    """
+    Flame-graph input ("root;child;leaf microseconds") from cProfile data
+
+    cProfile records caller/callee edges rather than whole stacks, so stacks
+    are rebuilt by walking down from the entry points, sharing each function's
+    own time among the paths in proportion to the time each caller spent in it.
+    """
+    raw = stats.stats
+    callees: Dict[FuncKey, List[Tuple[FuncKey, float]]] = {}
+    for func, (_, _, _, _, callers) in raw.items():
+        for caller, caller_stats in callers.items():
+            callees.setdefault(caller, []).append((func, caller_stats[3]))
+
+    roots = [func for func, entry in raw.items() if not entry[4]]
+    totals: Dict[str, float] = {}
+
+    def walk(func: FuncKey, path: Tuple[str, ...], share: float, on_path: frozenset):
+        own_time = raw[func][2] * share
+        stack = path + (_frame_name(func),)
+        if own_time > 0:
+            key = ';'.join(stack)
+            totals[key] = totals.get(key, 0.0) + own_time
+        if len(stack) >= MAX_STACK_DEPTH:
+            return
+        for callee, edge_time in callees.get(func, []):
+            callee_total = raw[callee][3]
+            if callee in on_path or callee_total <= 0 or edge_time <= 0:
+                continue
+            walk(callee, stack, share * min(1.0, edge_time / callee_total), on_path | {callee})
+
+    for root in roots:
+        walk(root, (), 1.0, frozenset([root]))
+
+    return [f"{stack} {max(1, int(seconds * 1e6))}" for stack, seconds in
+            sorted(totals.items(), key=lambda item: -item[1])]
+
+
+class Profiler:
+    def __init__(self, output_dir: str = PROFILE_DIR, runs: int = PROFILE_RUNS):
+        """
+        Profile a limited number of upcoming runs
+
+        Args:
+            output_dir: Where reports are written
+            runs: Runs to capture, counting from now
+        """
+        self.output_dir = output_dir
+        self._remaining = max(0, runs)
+        self._lock = threading.Lock()
+        self._tracemalloc_users = 0
+        self._active = False
+        self.reports: List[str] = []
+
+    @property
+    def remaining(self) -> int:
+        return self._remaining
+
+    def arm(self, runs: int):
+        """Capture the next runs (replaces any count left over)"""
+        with self._lock:
+            self._remaining = max(0, runs)
+
+    def claim(self) -> bool:
+        """Use up one armed run; False if the profiler is not armed"""
+        if not self._remaining:
+            return False
+        with self._lock:
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            return True
+
+    def _begin(self, force: bool) -> bool:
+        """Take the process's one profiling slot, using up an armed run unless forced"""
+        with self._lock:
+            if self._active or not (force or self._remaining > 0):
+                return False
+            if not force:
+                self._remaining -= 1
+            self._active = True
+            return True
+
+    def _end(self):
+        with self._lock:
+            self._active = False
+
+    def _start_tracemalloc(self):
+        with self._lock:
+            self._tracemalloc_users += 1
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def _stop_tracemalloc(self):
+        with self._lock:
+            self._tracemalloc_users -= 1
+            if self._tracemalloc_users == 0 and tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    @contextmanager
+    def profile(self, label: str, force: bool = False):
+        """
+        Profile the enclosed block if a run is armed (or force is set)
+
+        Args:
+            label: Name used in the report file names
+            force: Profile even if no run is armed, e.g. in a worker process
+                that was told to profile by its parent
+
+        A block that starts while another is being profiled runs unprofiled.
+        """
+        if not (self._remaining or force) or not self._begin(force):
+            yield
+            return
+
+        self._start_tracemalloc()
+        before = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Another profiler (a debugger, or one started outside this class) holds the process
+            print(f"Error starting profile for {label}: {e}")
+            self._stop_tracemalloc()
+            with self._lock:
+                if not force:
+                    self._remaining += 1
+            self._end()
+            yield
+            return
+
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._end()
+            elapsed = time.perf_counter() - started
+            after = tracemalloc.take_snapshot()
+            self._stop_tracemalloc()
+            try:
+                self._write_reports(label, profile, before, after, elapsed)
+            except OSError as e:
+                print(f"Error writing profile for {label}: {e}")
+
+    def _write_reports(self, label: str, profile: cProfile.Profile,
+                       before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, elapsed: float):
+        os.makedirs(self.output_dir, exist_ok=True)
+        safe_label = re.sub(r'[^A-Za-z0-9_.-]+', '_', label)
+        stamp = time.strftime("%Y%m%d_%H%M%S") + f"_{int(time.time() * 1000) % 1000:03d}"
+        base = os.path.join(self.output_dir, f"{stamp}_{safe_label}")
+
+        profile.dump_stats(base + ".prof")
+
+        report = io.StringIO()
+        report.write(f"{label}: {elapsed * 1000:.1f} ms wall time\n\n")
+        stats = pstats.Stats(profile, stream=report)
+        stats.strip_dirs()
+        report.write("== By cumulative time ==\n")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(HOT_FUNCTIONS)
+        report.write("== By own time ==\n")
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(HOT_FUNCTIONS)
+        with open(base + "_hot.txt", "w", encoding="utf-8") as f:
+            f.write(report.getvalue())
+
+        # Exclude the profiler's own bookkeeping from the allocation report
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        growth = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+        with open(base + "_alloc.txt", "w", encoding="utf-8") as f:
+            f.write(f"{label}: allocation sites by growth during the run\n\n")
+            for stat in growth[:ALLOCATION_SITES]:
+                f.write(f"{stat}\n")
+
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            f.write('\n'.join(collapsed_stacks(pstats.Stats(profile))) + '\n')
+
+        with self._lock:
+            self.reports.append(base)
+            del self.reports[:-50]
+
+
+_shared_profiler: Optional[Profiler] = None
+_shared_lock = threading.Lock()
+
+
+def get_profiler() -> Profiler:
+    """The profiler shared by every session in this process"""
+    global _shared_profiler
+    with _shared_lock:
+        if _shared_profiler is None:
+            _shared_profiler = Profiler()
+        return _shared_profiler
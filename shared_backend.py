@@ -0,0 +1,422 @@
+"""
+Storage shared by every replica of the app: a key/value cache and work queues.
+
+Replicas behind a load balancer each keep their own in-memory caches and
+worker pools. Pointing them at one backend lets them reuse each other's
+stories and transcripts, see each other's jobs, and pull Whisper work from one
+queue, so a busy replica's recordings are transcribed by an idle one.
+
+Two implementations:
+
+    SQLiteBackend   one file, for replicas on a single machine (WAL mode)
+    RespBackend     any server speaking the Redis protocol (RESP), for
+                    replicas spread across machines; no client library needed
+
+Choose one with SHARED_BACKEND_URL; without it every replica works alone.
+
+    SHARED_BACKEND_URL=sqlite:///data/shared.db     (sqlite:////abs/path.db)
+    SHARED_BACKEND_URL=redis://:password@cache-host:6379/0
+
+Values are strings (callers store JSON). Queues are FIFO and each item is
+handed to exactly one claim().
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+SHARED_BACKEND_URL = os.getenv("SHARED_BACKEND_URL", "")
+
+# How often SQLite claims look for new work while they wait
+SQLITE_POLL_SECONDS = 0.05
+# Expired cache rows are purged after this many writes
+SQLITE_PURGE_EVERY = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (namespace, key)
+);
+CREATE TABLE IF NOT EXISTS queue (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    queue TEXT NOT NULL,
+    item_id TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    enqueued_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS queue_order ON queue (queue, seq);
+"""
+
+
+class SharedBackend(ABC):
+    """Interface shared by the backends"""
+
+    @abstractmethod
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        """The stored value, or None if missing or expired"""
+
+    @abstractmethod
+    def set(self, namespace: str, key: str, value: str, ttl: Optional[float] = None):
+        """Store a value, replacing any earlier one; ttl is in seconds"""
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str):
+        """Drop a value if it exists"""
+
+    @abstractmethod
+    def push(self, queue: str, item_id: str, payload: str):
+        """Add an item to the back of a queue"""
+
+    @abstractmethod
+    def claim(self, queue: str, timeout: float = 1.0) -> Optional[Tuple[str, str]]:
+        """
+        Take the item at the front of a queue, waiting up to timeout seconds
+
+        Returns:
+            (item_id, payload), or None if the queue stayed empty
+        """
+
+    @abstractmethod
+    def remove(self, queue: str, item_id: str) -> bool:
+        """Drop an item that has not been claimed yet; False if it is gone"""
+
+    @abstractmethod
+    def queue_length(self, queue: str) -> int:
+        """Items waiting in a queue"""
+
+    @abstractmethod
+    def queue_position(self, queue: str, item_id: str) -> Optional[int]:
+        """1-based place of an item in its queue, or None once it was claimed"""
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend(SharedBackend):
+    def __init__(self, path: str):
+        """
+        Shared backend in one SQLite file, for replicas on the same machine
+
+        Args:
+            path: Database file; created if missing
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        # Autocommit; claims open their own write transaction
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return row[0]
+
+    def set(self, namespace: str, key: str, value: str, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, value, expires_at)
+            )
+            self._writes += 1
+            if self._writes % SQLITE_PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def push(self, queue: str, item_id: str, payload: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO queue (queue, item_id, payload, enqueued_at) VALUES (?, ?, ?, ?)",
+                (queue, item_id, payload, time.time())
+            )
+
+    def claim(self, queue: str, timeout: float = 1.0) -> Optional[Tuple[str, str]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                # IMMEDIATE takes the write lock up front, so two replicas never claim the same row
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self._conn.execute(
+                        "SELECT seq, item_id, payload FROM queue WHERE queue = ? ORDER BY seq LIMIT 1", (queue,)
+                    ).fetchone()
+                    if row is not None:
+                        self._conn.execute("DELETE FROM queue WHERE seq = ?", (row[0],))
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            if row is not None:
+                return row[1], row[2]
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(SQLITE_POLL_SECONDS)
+
+    def remove(self, queue: str, item_id: str) -> bool:
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM queue WHERE queue = ? AND item_id = ?", (queue, item_id))
+        return cursor.rowcount > 0
+
+    def queue_length(self, queue: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM queue WHERE queue = ?", (queue,)).fetchone()[0]
+
+    def queue_position(self, queue: str, item_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM queue WHERE queue = ? AND seq <= "
+                "(SELECT seq FROM queue WHERE queue = ? AND item_id = ?)",
+                (queue, queue, item_id)
+            ).fetchone()
+        return row[0] or None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RespError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+
+# What a backend call can raise when the backend is unreachable or broken
+BACKEND_ERRORS = (OSError, RespError, sqlite3.Error, ValueError)
+
+
+class RespConnection:
+    def __init__(self, host: str, port: int, db: int = 0, password: Optional[str] = None,
+                 timeout: float = 10.0):
+        """
+        One connection to a Redis-protocol server
+
+        Args:
+            host: Server host
+            port: Server port
+            db: Database number, selected on connect
+            password: Sent with AUTH on connect, if given
+            timeout: Socket timeout in seconds (blocking commands add their own wait)
+        """
+        self.timeout = timeout
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+        if password:
+            self.execute("AUTH", password)
+        if db:
+            self.execute("SELECT", db)
+
+    def execute(self, *args, wait: float = 0.0):
+        """
+        Send one command and return its reply
+
+        Args:
+            args: Command name and arguments
+            wait: Extra seconds the server may block before replying (BRPOP)
+
+        Raises:
+            RespError: The server answered with an error
+        """
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._sock.settimeout(self.timeout + wait)
+        self._sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode("utf-8")
+        if kind == b"-":
+            raise RespError(body.decode("utf-8"))
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            count = int(body)
+            if count < 0:
+                return None
+            return [self._read_reply() for _ in range(count)]
+        raise RespError(f"Unexpected reply {line!r}")
+
+    def close(self):
+        try:
+            self._reader.close()
+            self._sock.close()
+        except OSError:
+            pass
+
+
+class RespBackend(SharedBackend):
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, db: int = 0,
+                 password: Optional[str] = None, prefix: str = "storybook:"):
+        """
+        Shared backend on a Redis-protocol server, for replicas on many machines
+
+        Each thread gets its own connection, since claim() blocks its
+        connection while it waits. queue_position() needs LPOS (Redis 6.0.6+).
+
+        Args:
+            host: Server host
+            port: Server port
+            db: Database number
+            password: Server password, if any
+            prefix: Prepended to every key, so several apps can share a server
+        """
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.prefix = prefix
+        self._local = threading.local()
+        self._connections: List[RespConnection] = []
+        self._lock = threading.Lock()
+
+    def _connection(self) -> RespConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = RespConnection(self.host, self.port, self.db, self.password)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _execute(self, *args, wait: float = 0.0):
+        try:
+            return self._connection().execute(*args, wait=wait)
+        except (OSError, ConnectionError):
+            # Reconnect once; a server restart or idle timeout drops the socket
+            conn = getattr(self._local, "conn", None)
+            if conn is not None:
+                conn.close()
+            self._local.conn = None
+            return self._connection().execute(*args, wait=wait)
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}{namespace}:{key}"
+
+    def _queue_key(self, queue: str) -> str:
+        return f"{self.prefix}queue:{queue}"
+
+    def _payload_key(self, item_id: str) -> str:
+        return f"{self.prefix}payload:{item_id}"
+
+    def get(self, namespace: str, key: str) -> Optional[str]:
+        return self._execute("GET", self._key(namespace, key))
+
+    def set(self, namespace: str, key: str, value: str, ttl: Optional[float] = None):
+        if ttl:
+            self._execute("SET", self._key(namespace, key), value, "PX", max(1, int(ttl * 1000)))
+        else:
+            self._execute("SET", self._key(namespace, key), value)
+
+    def delete(self, namespace: str, key: str):
+        self._execute("DEL", self._key(namespace, key))
+
+    def push(self, queue: str, item_id: str, payload: str):
+        # Payload first, so a claim never finds an id without its payload
+        self._execute("SET", self._payload_key(item_id), payload)
+        self._execute("LPUSH", self._queue_key(queue), item_id)
+
+    def claim(self, queue: str, timeout: float = 1.0) -> Optional[Tuple[str, str]]:
+        reply = self._execute("BRPOP", self._queue_key(queue), f"{max(timeout, 0.01):.3f}", wait=timeout)
+        if not reply:
+            return None
+        item_id = reply[1]
+        payload_key = self._payload_key(item_id)
+        payload = self._execute("GET", payload_key)
+        self._execute("DEL", payload_key)
+        if payload is None:
+            return None
+        return item_id, payload
+
+    def remove(self, queue: str, item_id: str) -> bool:
+        removed = self._execute("LREM", self._queue_key(queue), 0, item_id)
+        if removed:
+            self._execute("DEL", self._payload_key(item_id))
+        return bool(removed)
+
+    def queue_length(self, queue: str) -> int:
+        return self._execute("LLEN", self._queue_key(queue))
+
+    def queue_position(self, queue: str, item_id: str) -> Optional[int]:
+        # Items are pushed on the left and claimed from the right
+        index = self._execute("LPOS", self._queue_key(queue), item_id)
+        if index is None:
+            return None
+        return self.queue_length(queue) - index
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+
+def open_backend(url: str) -> Optional[SharedBackend]:
+    """
+    Backend for a SHARED_BACKEND_URL
+
+    Returns:
+        The backend, or None if the URL is empty or cannot be used
+    """
+    if not url:
+        return None
+    try:
+        if url.startswith("sqlite:///"):
+            return SQLiteBackend(url[len("sqlite:///"):])
+        parsed = urlparse(url)
+        if parsed.scheme == "redis":
+            db = int(parsed.path.strip("/") or 0)
+            password = unquote(parsed.password) if parsed.password else None
+            backend = RespBackend(parsed.hostname or "127.0.0.1", parsed.port or 6379, db, password)
+            backend._execute("PING")
+            return backend
+        print(f"Error opening shared backend: unsupported URL {url!r}")
+    except BACKEND_ERRORS as e:
+        print(f"Error opening shared backend {url!r}: {e}")
+    return None
+
+
+_shared_backend: Optional[SharedBackend] = None
+_shared_checked = False
+_shared_lock = threading.Lock()
+
+
+def get_shared_backend() -> Optional[SharedBackend]:
+    """The backend from SHARED_BACKEND_URL, or None if replicas don't share one"""
+    global _shared_backend, _shared_checked
+    with _shared_lock:
+        if not _shared_checked:
+            _shared_checked = True
+            _shared_backend = open_backend(SHARED_BACKEND_URL)
+        return _shared_backend
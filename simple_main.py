@@ -1,7 +1,12 @@
 import streamlit as st
 import os
+from job_executor import get_job_executor
 from medical_translator import MedicalTranslator
-from storybook_formatter import StorybookFormatter
+from story_exporter import BOOK_FORMAT_LABELS, EXPORT_FORMATS, book_formats, get_shared_exporter
+from profiling import get_profiler
+from story_store import get_shared_store
+from storybook_formatter import ChapterBookWriter, StorybookFormatter
+from streamlit_helpers import current_book_id, show_admin_controls, show_story_history
 
 # Page configuration
 st.set_page_config(
@@ -15,13 +20,19 @@ if 'translator' not in st.session_state:
     st.session_state.translator = MedicalTranslator()
 if 'formatter' not in st.session_state:
     st.session_state.formatter = StorybookFormatter()
-if 'stories' not in st.session_state:
-    st.session_state.stories = []
+if 'chapter_book' not in st.session_state:
+    st.session_state.chapter_book = ChapterBookWriter()
 
 def main():
+    show_admin_controls()
+    
     st.title("🏥📚 Medical Storybook Translator")
     st.markdown("*Transform medical visits into kid-friendly storybooks!*")
     
+    # Stories are saved in the story store, not in session memory
+    store = get_shared_store()
+    book_id = current_book_id()
+    
     # Check API Key
     api_key = os.getenv("ANTHROPIC_API_KEY")
     if not api_key:
@@ -63,15 +74,13 @@ def main():
         if st.button("🪄 Create Storybook", type="primary") and medical_text:
             with st.spinner("🪄 Creating your storybook..."):
                 try:
-                    story = st.session_state.translator.translate_to_storybook(medical_text)
+                    # Waits its turn when every Claude slot on the server is busy
+                    with get_job_executor().claude_admission.slot():
+                        story = st.session_state.translator.translate_to_storybook(medical_text, story_style)
                     
                     if story:
                         formatted_story = st.session_state.formatter.format_storybook(story, story_style)
-                        st.session_state.stories.append({
-                            'original': medical_text,
-                            'story': formatted_story,
-                            'timestamp': st.session_state.get('timestamp', 'Now')
-                        })
+                        store.add(book_id, formatted_story, original=medical_text, style=story_style)
                         st.success("📚 Storybook created!")
                         st.rerun()
                     else:
@@ -100,14 +109,12 @@ def main():
             if st.button("🪄 Create Story from Sample"):
                 with st.spinner("🪄 Creating your storybook..."):
                     try:
-                        story = st.session_state.translator.translate_to_storybook(st.session_state['sample_text'])
+                        with get_job_executor().claude_admission.slot():
+                            story = st.session_state.translator.translate_to_storybook(st.session_state['sample_text'], story_style)
                         if story:
                             formatted_story = st.session_state.formatter.format_storybook(story, story_style)
-                            st.session_state.stories.append({
-                                'original': st.session_state['sample_text'],
-                                'story': formatted_story,
-                                'timestamp': 'Sample'
-                            })
+                            store.add(book_id, formatted_story, original=st.session_state['sample_text'],
+                                      style=story_style, timestamp='Sample')
                             del st.session_state['sample_text']
                             st.success("📚 Sample storybook created!")
                             st.rerun()
@@ -117,9 +124,9 @@ def main():
     with col2:
         st.header("📚 Your Storybooks")
         
-        if st.session_state.stories:
+        latest_story = store.latest(book_id)
+        if latest_story:
             # Show latest story
-            latest_story = st.session_state.stories[-1]
             st.markdown(latest_story['story'])
             
             # Add interactive elements
@@ -128,30 +135,43 @@ def main():
                 st.markdown("---")
                 st.markdown(interactive_story)
             
-            # Story history
-            if len(st.session_state.stories) > 1:
-                st.subheader("📖 Previous Stories")
-                for i, story_data in enumerate(reversed(st.session_state.stories[:-1])):
-                    with st.expander(f"Story {len(st.session_state.stories) - i - 1} - {story_data['timestamp']}"):
-                        st.markdown(story_data['story'])
+            # Story history, one page at a time
+            show_story_history(store, book_id)
             
             # Export options
             st.subheader("💾 Export Options")
             
+            book_format = st.selectbox(
+                "📁 Book Format",
+                # PDF only when its fonts can show every story's script
+                book_formats(store.languages(book_id)),
+                format_func=BOOK_FORMAT_LABELS.get
+            )
+            
             if st.button("📄 Create Complete Storybook"):
-                all_stories = [story['story'] for story in st.session_state.stories]
-                complete_book = st.session_state.formatter.create_chapter_format(all_stories)
+                all_stories = store.iter_stories(book_id)
+                if book_format == "md":
+                    # Only stories added since the last export get rendered
+                    st.session_state.chapter_book.sync(all_stories)
+                    complete_book = st.session_state.chapter_book.getvalue()
+                    book_mime = "text/markdown"
+                else:
+                    # Chapters rendered in an earlier export come from the exporter's cache
+                    complete_book = get_shared_exporter().export_bytes(all_stories, book_format, story_style)
+                    book_mime = EXPORT_FORMATS[book_format]["mime"]
                 
                 st.download_button(
                     label="📥 Download Complete Storybook",
                     data=complete_book,
-                    file_name=f"medical_storybook.md",
-                    mime="text/markdown"
+                    file_name=f"medical_storybook.{book_format}",
+                    mime=book_mime
                 )
             
             # Clear stories
             if st.button("🗑️ Clear All Stories"):
-                st.session_state.stories = []
+                store.clear(book_id)
+                st.session_state.chapter_book.clear()
+                st.session_state.history_page = 0
                 st.rerun()
         else:
             st.info("👈 Enter medical information to create your first storybook!")
@@ -173,4 +193,6 @@ def main():
     st.markdown("*Made with ❤️ to help make medical visits less scary for kids*")
 
 if __name__ == "__main__":
-    main()
+    # Profiled when STORYBOOK_PROFILE_RUNS or the admin controls armed the profiler
+    with get_profiler().profile("simple_main"):
+        main()
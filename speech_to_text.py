@@ -2,13 +2,19 @@ import whisper
 import os
 from typing import Optional
 
+from instrumentation import count_audio, span
+
 class SpeechToText:
     def __init__(self, model_size: str = "base"):
         """
         Initialize Whisper model for speech-to-text conversion
         Model sizes: tiny, base, small, medium, large
         """
-        self.model = whisper.load_model(model_size)
+        self.model_size = model_size
+        # Length of the audio in the last transcribe_audio() call, for callers in other processes
+        self.last_audio_seconds: Optional[float] = None
+        with span("load_whisper_model", model=model_size):
+            self.model = whisper.load_model(model_size)
         
     def transcribe_audio(self, audio_file_path: str) -> Optional[str]:
         """
@@ -20,17 +26,49 @@ class SpeechToText:
         Returns:
             Transcribed text or None if error
         """
-        try:
-            if not os.path.exists(audio_file_path):
-                print(f"Audio file not found: {audio_file_path}")
-                return None
+        self.last_audio_seconds = None
+        with span("transcribe_audio", model=self.model_size) as stage:
+            try:
+                if not os.path.exists(audio_file_path):
+                    print(f"Audio file not found: {audio_file_path}")
+                    stage.fail("audio file not found")
+                    return None
+                    
+                result = self.model.transcribe(audio_file_path)
+                if result.get("segments"):
+                    audio_seconds = self.last_audio_seconds = result["segments"][-1]["end"]
+                    stage.set(audio_seconds=audio_seconds)
+                    count_audio("transcribe_audio", audio_seconds)
+                return result["text"].strip()
                 
-            result = self.model.transcribe(audio_file_path)
-            return result["text"].strip()
+            except Exception as e:
+                print(f"Error transcribing audio: {e}")
+                stage.fail(str(e))
+                return None
             
-        except Exception as e:
-            print(f"Error transcribing audio: {e}")
-            return None
+    def transcribe_samples(self, samples, prompt: Optional[str] = None) -> Optional[str]:
+        """
+        Transcribe audio that is already in memory
+        
+        Args:
+            samples: 16 kHz mono float32 numpy array
+            prompt: Text spoken just before this audio, to keep the wording consistent
+            
+        Returns:
+            Transcribed text or None if error
+        """
+        with span("transcribe_samples", model=self.model_size) as stage:
+            try:
+                result = self.model.transcribe(samples, initial_prompt=prompt or None, fp16=False)
+                audio_seconds = len(samples) / 16000
+                stage.set(audio_seconds=audio_seconds)
+                count_audio("transcribe_samples", audio_seconds)
+                return result["text"].strip()
+                
+            except Exception as e:
+                print(f"Error transcribing audio samples: {e}")
+                stage.fail(str(e))
+                return None
             
     def transcribe_with_timestamps(self, audio_file_path: str) -> Optional[dict]:
         """
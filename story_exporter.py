@@ -0,0 +1,562 @@
+"""
+Export storybooks as HTML, EPUB or PDF.
+
+Templates and markdown patterns are compiled once per process, and every
+rendered chapter is cached by content hash and style, so exporting a long
+book again only renders the chapters that are new. Output is produced as a
+stream of byte chunks. PDFs are written directly with the standard PDF fonts,
+with no external services or PDF libraries.
+"""
+import hashlib
+import html
+import re
+import threading
+import time
+import unicodedata
+import uuid
+import zipfile
+from collections import OrderedDict
+from string import Template
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+BOOK_TITLE = "Your Complete Health Storybook"
+
+# Accent colors per story style, shared by all formats
+STYLE_COLORS = {
+    "friendly": ("#FF6B9D", (1.0, 0.42, 0.62)),
+    "adventure": ("#2E8B57", (0.18, 0.55, 0.34)),
+    "magical": ("#8A2BE2", (0.54, 0.17, 0.89)),
+    "superhero": ("#1E6FD9", (0.12, 0.44, 0.85)),
+}
+
+EXPORT_FORMATS = {
+    "html": {"mime": "text/html", "extension": "html", "label": "Web Page (HTML)"},
+    "epub": {"mime": "application/epub+zip", "extension": "epub", "label": "E-Book (EPUB)"},
+    "pdf": {"mime": "application/pdf", "extension": "pdf", "label": "PDF"},
+}
+
+# Every whole-book download the apps offer: Markdown from ChapterBookWriter, then the exporter's formats
+BOOK_FORMAT_LABELS = {"md": "Markdown"}
+BOOK_FORMAT_LABELS.update((fmt, info["label"]) for fmt, info in EXPORT_FORMATS.items())
+
+# Story languages whose letters all exist in the PDF standard fonts (Windows-1252)
+PDF_LANGUAGES = frozenset({"en", "es", "fr", "pt", "tl", "ht", "so"})
+
+# Markdown subset produced by StorybookFormatter, compiled once
+HEADING_PATTERN = re.compile(r'^(#{1,6})\s+(.*)$')
+BOLD_PATTERN = re.compile(r'\*\*(.+?)\*\*')
+ITALIC_PATTERN = re.compile(r'(?<!\*)\*(?!\*)(.+?)(?<!\*)\*(?!\*)')
+RULE_PATTERN = re.compile(r'^-{3,}$')
+BLOCK_SPLIT_PATTERN = re.compile(r'\n\s*\n')
+
+# Anything outside the PDF standard fonts' character set (mostly emoji)
+PDF_UNSUPPORTED_PATTERN = re.compile('[^\n\x20-\x7e\xa0-\xff\u2013\u2014\u2018\u2019\u201c\u201d\u2022\u2026]')
+
+CSS_TEMPLATE = Template("""
+body { font-family: Georgia, "Times New Roman", serif; line-height: 1.6; margin: 2em auto; max-width: 42em; padding: 0 1em; color: #333; }
+h1, h2, h3 { color: $accent; }
+h1 { text-align: center; }
+hr { border: none; border-top: 2px dashed $accent; margin: 2em 0; }
+section.chapter { page-break-before: always; }
+""".strip())
+
+HTML_HEAD_TEMPLATE = Template("""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>$title</title>
+<style>
+$css
+</style>
+</head>
+<body>
+<h1>$title</h1>
+""")
+
+HTML_CHAPTER_TEMPLATE = Template("""<section class="chapter" id="chapter-$number">
+<h2>Chapter $number</h2>
+$body
+</section>
+""")
+
+HTML_FOOT = "</body>\n</html>\n"
+
+XHTML_CHAPTER_TEMPLATE = Template("""<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="en">
+<head>
+<meta charset="utf-8"/>
+<title>Chapter $number</title>
+<link rel="stylesheet" type="text/css" href="style.css"/>
+</head>
+<body>
+<section class="chapter" epub:type="chapter">
+<h2>Chapter $number</h2>
+$body
+</section>
+</body>
+</html>
+""")
+
+EPUB_CONTAINER = """<?xml version="1.0" encoding="utf-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+<rootfiles>
+<rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+</rootfiles>
+</container>
+"""
+
+EPUB_OPF_TEMPLATE = Template("""<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">
+<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+<dc:identifier id="book-id">urn:uuid:$book_id</dc:identifier>
+<dc:title>$title</dc:title>
+<dc:language>en</dc:language>
+<meta property="dcterms:modified">$modified</meta>
+</metadata>
+<manifest>
+<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+<item id="css" href="style.css" media-type="text/css"/>
+$manifest
+</manifest>
+<spine>
+$spine
+</spine>
+</package>
+""")
+
+EPUB_NAV_TEMPLATE = Template("""<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" lang="en">
+<head><meta charset="utf-8"/><title>$title</title></head>
+<body>
+<nav epub:type="toc" id="toc">
+<h1>$title</h1>
+<ol>
+$items
+</ol>
+</nav>
+</body>
+</html>
+""")
+
+# Helvetica advance widths (1/1000 em) for printable ASCII, from the standard AFM metrics
+_HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+
+PDF_PAGE_WIDTH = 612
+PDF_PAGE_HEIGHT = 792
+PDF_MARGIN = 72
+
+# (font, size, space after) for each kind of line the PDF layout produces
+PDF_LINE_STYLES = {
+    "title": ("F2", 22, 14),
+    "heading": ("F2", 16, 10),
+    "bold": ("F2", 12, 4),
+    "body": ("F1", 12, 4),
+}
+
+
+def _content_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _inline_html(text: str) -> str:
+    text = html.escape(text, quote=False)
+    text = BOLD_PATTERN.sub(r'<strong>\1</strong>', text)
+    return ITALIC_PATTERN.sub(r'<em>\1</em>', text)
+
+
+def markdown_to_html(text: str) -> str:
+    """
+    Convert the markdown produced by StorybookFormatter into (X)HTML
+
+    Handles headings, bold/italic, horizontal rules and paragraphs; single
+    line breaks inside a paragraph become <br/>. Blocks take their direction
+    from their own text, so right-to-left translations read correctly.
+    """
+    blocks = []
+    for block in BLOCK_SPLIT_PATTERN.split(text.strip()):
+        block = block.strip()
+        if not block:
+            continue
+        heading = HEADING_PATTERN.match(block)
+        if heading and '\n' not in block:
+            level = min(6, len(heading.group(1)) + 1)
+            blocks.append(f'<h{level} dir="auto">{_inline_html(heading.group(2))}</h{level}>')
+        elif RULE_PATTERN.match(block):
+            blocks.append("<hr/>")
+        else:
+            lines = [_inline_html(line.strip()) for line in block.split('\n')]
+            blocks.append(f'<p dir="auto">{"<br/>".join(lines)}</p>')
+    return '\n'.join(blocks)
+
+
+def pdf_supported(text: str) -> bool:
+    """Whether the PDF standard fonts can show every letter and digit in the text"""
+    for char in unicodedata.normalize("NFC", text):
+        if unicodedata.category(char)[0] in "LN":
+            try:
+                char.encode("cp1252")
+            except UnicodeEncodeError:
+                return False
+    return True
+
+
+def book_formats(languages: Iterable[str]) -> List[str]:
+    """
+    The whole-book downloads to offer for stories in these languages
+
+    PDF is left out when any language needs letters the standard fonts lack.
+    """
+    if set(languages) <= PDF_LANGUAGES:
+        return list(BOOK_FORMAT_LABELS)
+    return [fmt for fmt in BOOK_FORMAT_LABELS if fmt != "pdf"]
+
+
+def _pdf_text(text: str) -> str:
+    """Reduce text to what the standard PDF fonts can show"""
+    text = PDF_UNSUPPORTED_PATTERN.sub('', text)
+    return re.sub(r'[ \t]{2,}', ' ', text).strip()
+
+
+def _pdf_text_width(text: str, size: float, bold: bool) -> float:
+    width = 0
+    for char in text:
+        code = ord(char)
+        width += _HELVETICA_WIDTHS[code - 32] if 32 <= code < 127 else 556
+    # Helvetica-Bold runs about 5% wider than the regular face
+    return width * size / 1000.0 * (1.05 if bold else 1.0)
+
+
+def _wrap_pdf_line(text: str, font: str, size: float, max_width: float) -> List[str]:
+    words = text.split()
+    lines = []
+    current = ""
+    for word in words:
+        candidate = f"{current} {word}" if current else word
+        if current and _pdf_text_width(candidate, size, font == "F2") > max_width:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+    return lines
+
+
+def layout_pdf_lines(text: str) -> List[Tuple[str, str]]:
+    """
+    Break story markdown into (line style, text) pairs wrapped to the page width
+
+    Args:
+        text: Story markdown
+
+    Returns:
+        Lines ready for pagination; ("gap", "") marks a paragraph break
+    """
+    max_width = PDF_PAGE_WIDTH - 2 * PDF_MARGIN
+    laid_out: List[Tuple[str, str]] = []
+    for block in BLOCK_SPLIT_PATTERN.split(text.strip()):
+        block = block.strip()
+        if not block or RULE_PATTERN.match(block):
+            continue
+        heading = HEADING_PATTERN.match(block)
+        if heading and '\n' not in block:
+            kind, content = "heading", heading.group(2)
+        elif block.startswith("**") and block.endswith("**") and block.count("**") == 2:
+            kind, content = "heading", block[2:-2]
+        else:
+            kind, content = "body", block
+
+        for source_line in content.split('\n'):
+            line_kind = kind
+            if kind == "body" and source_line.strip().startswith("**"):
+                line_kind = "bold"
+            clean = _pdf_text(BOLD_PATTERN.sub(r'\1', source_line))
+            if not clean:
+                continue
+            font, size, _ = PDF_LINE_STYLES[line_kind]
+            laid_out.extend((line_kind, wrapped) for wrapped in _wrap_pdf_line(clean, font, size, max_width))
+        laid_out.append(("gap", ""))
+    return laid_out
+
+
+def _pdf_escape(text: str) -> bytes:
+    encoded = text.encode("cp1252", errors="ignore")
+    return encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+class _StreamingZipSink:
+    """
+    File-like target for zipfile that hands out bytes as each entry completes
+
+    zipfile only seeks back within the entry it is writing, so everything
+    before the current entry can be drained and sent to the client.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._base = 0
+        self._position = 0
+
+    def write(self, data: bytes) -> int:
+        offset = self._position - self._base
+        self._buffer[offset:offset + len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, position: int, whence: int = 0) -> int:
+        if whence == 1:
+            position += self._position
+        elif whence == 2:
+            position += self._base + len(self._buffer)
+        if position < self._base:
+            raise OSError("Cannot seek into data that was already streamed")
+        self._position = position
+        return position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._base += len(self._buffer)
+        self._buffer = bytearray()
+        self._position = self._base
+        return data
+
+
+class StoryExporter:
+    def __init__(self, cache_size: int = 1024):
+        """
+        Render storybooks to HTML, EPUB and PDF with a per-chapter render cache
+
+        Args:
+            cache_size: Rendered chapters kept in memory (least recently used are dropped)
+        """
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, str, str], object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, kind: str, story: str, style: str, render: Callable[[str], object]):
+        key = (kind, _content_key(story), style)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+            self.misses += 1
+
+        rendered = render(story)
+        with self._lock:
+            self._cache[key] = rendered
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return rendered
+
+    def stats(self) -> Dict[str, float]:
+        """Chapter render cache counters"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def export(self, stories: Iterable[str], fmt: str, style: str = "friendly",
+               title: str = BOOK_TITLE) -> Iterator[bytes]:
+        """
+        Stream a storybook in the requested format
+
+        Args:
+            stories: Formatted stories, one per chapter; any iterable, such as
+                StoryStore.iter_stories(), is read once as the file is written
+            fmt: "html", "epub" or "pdf"
+            style: Story style used for accent colors
+            title: Book title
+
+        Returns:
+            Iterator of byte chunks making up the file
+        """
+        if fmt == "html":
+            return self.export_html(stories, style, title)
+        if fmt == "epub":
+            return self.export_epub(stories, style, title)
+        if fmt == "pdf":
+            return self.export_pdf(stories, style, title)
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    def export_bytes(self, stories: Iterable[str], fmt: str, style: str = "friendly",
+                     title: str = BOOK_TITLE) -> bytes:
+        """The whole exported file at once, for APIs that need a complete payload"""
+        return b''.join(self.export(stories, fmt, style, title))
+
+    def export_html(self, stories: Iterable[str], style: str = "friendly",
+                    title: str = BOOK_TITLE) -> Iterator[bytes]:
+        accent = STYLE_COLORS.get(style, STYLE_COLORS["friendly"])[0]
+        yield HTML_HEAD_TEMPLATE.substitute(
+            title=html.escape(title),
+            css=CSS_TEMPLATE.substitute(accent=accent)
+        ).encode("utf-8")
+        for number, story in enumerate(stories, 1):
+            body = self._cached("html", story, style, markdown_to_html)
+            yield HTML_CHAPTER_TEMPLATE.substitute(number=number, body=body).encode("utf-8")
+        yield HTML_FOOT.encode("utf-8")
+
+    def export_epub(self, stories: Iterable[str], style: str = "friendly",
+                    title: str = BOOK_TITLE) -> Iterator[bytes]:
+        accent = STYLE_COLORS.get(style, STYLE_COLORS["friendly"])[0]
+        sink = _StreamingZipSink()
+        with zipfile.ZipFile(sink, "w") as book:
+            # The mimetype entry must come first and be stored uncompressed
+            book.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+            book.writestr("META-INF/container.xml", EPUB_CONTAINER, compress_type=zipfile.ZIP_DEFLATED)
+            book.writestr("OEBPS/style.css", CSS_TEMPLATE.substitute(accent=accent), compress_type=zipfile.ZIP_DEFLATED)
+            yield sink.drain()
+
+            chapter_count = 0
+            for number, story in enumerate(stories, 1):
+                body = self._cached("xhtml", story, style, markdown_to_html)
+                book.writestr(f"OEBPS/chapter_{number}.xhtml",
+                              XHTML_CHAPTER_TEMPLATE.substitute(number=number, body=body),
+                              compress_type=zipfile.ZIP_DEFLATED)
+                chapter_count = number
+                yield sink.drain()
+
+            chapter_ids = [f"chapter_{number}" for number in range(1, chapter_count + 1)]
+            book.writestr("OEBPS/nav.xhtml", EPUB_NAV_TEMPLATE.substitute(
+                title=html.escape(title),
+                items='\n'.join(f'<li><a href="{cid}.xhtml">Chapter {cid.split("_")[1]}</a></li>' for cid in chapter_ids)
+            ), compress_type=zipfile.ZIP_DEFLATED)
+            book.writestr("OEBPS/content.opf", EPUB_OPF_TEMPLATE.substitute(
+                book_id=uuid.uuid4(),
+                title=html.escape(title),
+                modified=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                manifest='\n'.join(f'<item id="{cid}" href="{cid}.xhtml" media-type="application/xhtml+xml"/>'
+                                   for cid in chapter_ids),
+                spine='\n'.join(f'<itemref idref="{cid}"/>' for cid in chapter_ids)
+            ), compress_type=zipfile.ZIP_DEFLATED)
+        yield sink.drain()
+
+    def export_pdf(self, stories: Iterable[str], style: str = "friendly",
+                   title: str = BOOK_TITLE) -> Iterator[bytes]:
+        """
+        Stream a PDF built with the Helvetica standard fonts
+
+        Emoji and other symbols outside the standard font encoding are left
+        out. Stories in other scripts (see pdf_supported) cannot be shown and
+        raise ValueError when their chapter is reached; check before exporting.
+        """
+        accent = STYLE_COLORS.get(style, STYLE_COLORS["friendly"])[1]
+        color = f"{accent[0]:.2f} {accent[1]:.2f} {accent[2]:.2f} rg".encode("ascii")
+
+        # Object 1 is the catalog, 2 the page tree; both are written last
+        offsets: Dict[int, int] = {}
+        position = 0
+        next_object = 3
+        page_objects: List[int] = []
+
+        def emit(object_number: int, body: bytes) -> bytes:
+            nonlocal position
+            offsets[object_number] = position
+            chunk = b"%d 0 obj\n" % object_number + body + b"\nendobj\n"
+            position += len(chunk)
+            return chunk
+
+        header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+        position = len(header)
+        yield header
+        yield emit(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+        yield emit(4, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+        next_object = 5
+
+        def book_lines() -> Iterator[Tuple[str, str]]:
+            # Laid out one chapter at a time as pages are written
+            yield "title", _pdf_text(title)
+            yield "gap", ""
+            for number, story in enumerate(stories, 1):
+                if not pdf_supported(story):
+                    raise ValueError(f"Chapter {number} uses letters the PDF fonts cannot show; "
+                                     "export it as HTML or EPUB instead")
+                yield "heading", f"Chapter {number}"
+                yield from self._cached("pdf", story, style, layout_pdf_lines)
+
+        def page_chunks(page_lines: List[Tuple[str, str]]) -> bytes:
+            nonlocal next_object
+            ops = [b"BT"]
+            y = PDF_PAGE_HEIGHT - PDF_MARGIN
+            for kind, text in page_lines:
+                if kind == "gap":
+                    y -= 8
+                    continue
+                font, size, after = PDF_LINE_STYLES[kind]
+                y -= size
+                ops.append(color if kind in ("title", "heading") else b"0 0 0 rg")
+                ops.append(b"/%s %d Tf 1 0 0 1 %d %d Tm (%s) Tj" % (
+                    font.encode("ascii"), size, PDF_MARGIN, y, _pdf_escape(text)))
+                y -= after
+            ops.append(b"ET")
+            content = b"\n".join(ops)
+
+            content_number, page_number = next_object, next_object + 1
+            next_object += 2
+            page_objects.append(page_number)
+            return (
+                emit(content_number, b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+                + emit(page_number, b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+                                    b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>"
+                       % (PDF_PAGE_WIDTH, PDF_PAGE_HEIGHT, content_number))
+            )
+
+        page: List[Tuple[str, str]] = []
+        remaining = PDF_PAGE_HEIGHT - 2 * PDF_MARGIN
+        for kind, text in book_lines():
+            height = 8 if kind == "gap" else sum(PDF_LINE_STYLES[kind][1:])
+            # Start each chapter on a new page, and keep headings with their text
+            new_chapter = kind == "heading" and text.startswith("Chapter ") and any(k not in ("title", "gap") for k, _ in page)
+            if page and (height > remaining or new_chapter or (kind == "heading" and remaining < 80)):
+                yield page_chunks(page)
+                page = []
+                remaining = PDF_PAGE_HEIGHT - 2 * PDF_MARGIN
+            if kind == "gap" and not page:
+                continue
+            page.append((kind, text))
+            remaining -= height
+        if page or not page_objects:
+            yield page_chunks(page)
+
+        kids = b" ".join(b"%d 0 R" % number for number in page_objects)
+        yield emit(2, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_objects)))
+        yield emit(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+        object_count = next_object
+        xref = [b"xref\n0 %d\n" % object_count, b"0000000000 65535 f \n"]
+        for number in range(1, object_count):
+            xref.append(b"%010d 00000 n \n" % offsets[number])
+        yield b"".join(xref) + b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (object_count, position)
+
+
+_shared_exporter: Optional[StoryExporter] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_exporter() -> StoryExporter:
+    """Process-wide exporter so every session shares the chapter cache"""
+    global _shared_exporter
+    with _shared_lock:
+        if _shared_exporter is None:
+            _shared_exporter = StoryExporter()
+        return _shared_exporter
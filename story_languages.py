@@ -0,0 +1,63 @@
+"""
+Languages stories can be written in, and the text direction of their scripts.
+"""
+import unicodedata
+from typing import Dict, List, Tuple
+
+# Code -> (English name used in prompts, native name shown to families)
+STORY_LANGUAGES: Dict[str, Tuple[str, str]] = {
+    "en": ("English", "English"),
+    "es": ("Spanish", "Español"),
+    "zh": ("Simplified Chinese", "简体中文"),
+    "vi": ("Vietnamese", "Tiếng Việt"),
+    "ar": ("Arabic", "العربية"),
+    "tl": ("Tagalog", "Tagalog"),
+    "ko": ("Korean", "한국어"),
+    "ru": ("Russian", "Русский"),
+    "fr": ("French", "Français"),
+    "pt": ("Portuguese", "Português"),
+    "ht": ("Haitian Creole", "Kreyòl Ayisyen"),
+    "hi": ("Hindi", "हिन्दी"),
+    "ur": ("Urdu", "اردو"),
+    "fa": ("Persian", "فارسی"),
+    "he": ("Hebrew", "עברית"),
+    "ja": ("Japanese", "日本語"),
+    "so": ("Somali", "Soomaali"),
+}
+
+DEFAULT_LANGUAGE = "en"
+
+
+def language_name(code: str) -> str:
+    """English name of a language, for prompts"""
+    return STORY_LANGUAGES.get(code, (code, code))[0]
+
+
+def native_name(code: str) -> str:
+    """A language's name in that language, for labels"""
+    return STORY_LANGUAGES.get(code, (code, code))[1]
+
+
+def normalize_languages(codes: List[str]) -> List[str]:
+    """Known codes in the order given, without repeats; English if none are left"""
+    languages = []
+    for code in codes:
+        code = code.strip().lower()
+        if code in STORY_LANGUAGES and code not in languages:
+            languages.append(code)
+    return languages or [DEFAULT_LANGUAGE]
+
+
+def text_direction(text: str) -> str:
+    """
+    "rtl" if most letters in the text belong to a right-to-left script
+    (Arabic, Hebrew, Persian, Urdu), otherwise "ltr"
+    """
+    rtl = ltr = 0
+    for char in text:
+        direction = unicodedata.bidirectional(char)
+        if direction in ("R", "AL"):
+            rtl += 1
+        elif direction == "L":
+            ltr += 1
+    return "rtl" if rtl > ltr else "ltr"
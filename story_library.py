@@ -0,0 +1,345 @@
+"""
+Pre-generated stories for the most common pediatric visits.
+
+Incoming text is matched against each condition's keywords through an inverted
+index, so a confident match returns a finished story without calling Claude.
+A match only counts when neither the condition nor its treatment is negated
+("strep test was negative", "antibiotics will not help"), nothing rules the
+entry out ("viral"), the entry covers most of the medical terms in the text,
+and the text mentions nothing serious the entry does not cover.
+Refresh the stories offline with:
+
+    python story_library.py --refresh
+"""
+import argparse
+import json
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from medical_glossary import MedicalGlossary, get_shared_glossary
+from near_duplicate_cache import NEGATION_TOKENS, normalize_tokens
+
+DEFAULT_LIBRARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "story_library.json")
+
+PRIMARY_WEIGHT = 1.0
+SECONDARY_WEIGHT = 0.25
+
+# Share of the text's glossary terms a condition's entry must cover
+MIN_TERM_COVERAGE = 0.5
+# Everyday care terms that say nothing about which condition a note is about
+ROUTINE_TERMS = frozenset({
+    "acetaminophen", "acute", "as needed", "by mouth", "diagnosis", "dosage", "fever",
+    "follow-up", "four times daily", "ibuprofen", "pediatrician", "symptoms",
+    "three times daily", "twice daily",
+})
+# A negation cue this many words before a matched phrase negates it ("no sign of strep")
+NEGATION_WINDOW = 4
+# Cues that negate a phrase from after it ("strep test was negative", "fracture ruled out")
+TRAILING_NEGATIONS = frozenset({"negative", "ruled"})
+# A treatment is also negated by any cue after it ("antibiotics will not help")
+TREATMENT_NEGATIONS = TRAILING_NEGATIONS | NEGATION_TOKENS
+# Mentions that no pre-written story for a common visit should paper over
+SERIOUS_TOKENS = frozenset("""
+cancer leukemia lymphoma tumor tumour malignant oncology chemotherapy chemo radiation
+surgery operation transplant biopsy seizure seizures epilepsy meningitis sepsis
+diabetes insulin icu intensive admitted hospitalized hospitalization
+""".split())
+CLAUSE_PATTERN = re.compile(r'[;!?\n]|\.(?=\s|$)|,|\bbut\b|\bhowever\b')
+
+# Theme hints used when regenerating each style's story with Claude
+STYLE_THEMES = {
+    "friendly": "a gentle story starring friendly animal characters",
+    "adventure": "an exciting explorer adventure",
+    "magical": "a magical kingdom tale with wizards and enchantments",
+    "superhero": "a superhero story where medicine and doctors are heroes",
+}
+
+
+class StoryLibrary:
+    def __init__(self, path: str = DEFAULT_LIBRARY_PATH, min_confidence: float = 0.7,
+                 glossary: Optional[MedicalGlossary] = None):
+        """
+        Load the curated story library and build its keyword index
+
+        Args:
+            path: JSON file with conditions, keywords and per-style stories
+            min_confidence: Matches below this confidence fall through to Claude
+            glossary: Medical terms used to check an entry covers the text;
+                the shared glossary by default
+        """
+        self.path = path
+        self.min_confidence = min_confidence
+        self.glossary = glossary or get_shared_glossary()
+        self.conditions: List[Dict] = []
+        self._phrases: List[Tuple[int, frozenset, float]] = []
+        self._index: Dict[str, Set[int]] = {}
+        # Per condition: glossary terms and tokens its source text, keywords and stories cover
+        self._covered_terms: List[Set[str]] = []
+        self._covered_tokens: List[frozenset] = []
+        # Per condition: the treatment its stories promise, and words that rule it out
+        self._treatments: List[List[frozenset]] = []
+        self._exclusions: List[List[frozenset]] = []
+        self._personalizer = None
+        self._personalizer_lock = threading.Lock()
+
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.conditions = json.load(f).get("conditions", [])
+        except (OSError, ValueError) as e:
+            print(f"Error loading story library: {e}")
+
+        self._build_index()
+
+    def _build_index(self):
+        """Map each normalized keyword token to the phrases that contain it"""
+        for condition_idx, condition in enumerate(self.conditions):
+            keywords = [(k, PRIMARY_WEIGHT) for k in condition.get("primary_keywords", [])]
+            keywords += [(k, SECONDARY_WEIGHT) for k in condition.get("secondary_keywords", [])]
+            for keyword, weight in keywords:
+                tokens = normalize_tokens(keyword)
+                if not tokens:
+                    continue
+                phrase_idx = len(self._phrases)
+                self._phrases.append((condition_idx, tokens, weight))
+                for token in tokens:
+                    self._index.setdefault(token, set()).add(phrase_idx)
+
+            covered_text = ' '.join([condition.get("source_text", "")]
+                                    + [keyword for keyword, _ in keywords]
+                                    + list(condition.get("stories", {}).values()))
+            self._covered_terms.append({entry["term"] for entry in self.glossary.find_terms(covered_text)})
+            self._covered_tokens.append(normalize_tokens(covered_text))
+            self._treatments.append([normalize_tokens(t) for t in condition.get("treatments", [])])
+            self._exclusions.append([normalize_tokens(k) for k in condition.get("excluded_keywords", [])])
+
+    def _matched_phrases(self, tokens: frozenset) -> List[Tuple[int, frozenset, float]]:
+        """Keyword phrases whose every token appears in the text"""
+        candidate_phrases = set()
+        for token in tokens:
+            candidate_phrases.update(self._index.get(token, ()))
+        return [self._phrases[idx] for idx in candidate_phrases if self._phrases[idx][1] <= tokens]
+
+    def score(self, text: str) -> Dict[str, float]:
+        """
+        Score every condition mentioned in the text
+
+        Args:
+            text: Medical text typed or transcribed for the visit
+
+        Returns:
+            Mapping of condition id to keyword score (0-1)
+        """
+        matched = self._matched_phrases(normalize_tokens(text))
+        mentions = self._mentions(text, [phrase for _, phrase, _ in matched])
+
+        # Each condition scores its best primary phrase plus any supporting terms;
+        # a keyword only ever mentioned negated ("no cough") does not count
+        primary: Dict[int, float] = {}
+        secondary: Dict[int, float] = {}
+        for (condition_idx, phrase_tokens, weight), (mentioned, negated) in zip(matched, mentions):
+            if mentioned and negated == mentioned:
+                continue
+            if weight >= PRIMARY_WEIGHT:
+                primary[condition_idx] = max(primary.get(condition_idx, 0.0), weight)
+            else:
+                secondary[condition_idx] = secondary.get(condition_idx, 0.0) + weight
+
+        scores = {}
+        for condition_idx in set(primary) | set(secondary):
+            total = primary.get(condition_idx, 0.0) + secondary.get(condition_idx, 0.0)
+            scores[self.conditions[condition_idx]["id"]] = min(1.0, total)
+        return scores
+
+    @staticmethod
+    def _mentions(text: str, phrases: List[frozenset],
+                  trailing: frozenset = TRAILING_NEGATIONS) -> List[Tuple[int, int]]:
+        """How often each phrase is mentioned in the text, and how many of those mentions are negated"""
+        counts = [(0, 0)] * len(phrases)
+        for clause in CLAUSE_PATTERN.split(text.lower()):
+            # Ordered normalized tokens, one clause at a time, so cues don't leak across sentences
+            words = [token for word in clause.split() for token in sorted(normalize_tokens(word))]
+            for phrase_idx, phrase in enumerate(phrases):
+                positions = [i for i, word in enumerate(words) if word in phrase]
+                if not positions or not phrase <= set(words):
+                    continue
+                before = words[max(0, positions[0] - NEGATION_WINDOW):positions[0]]
+                after = words[positions[-1] + 1:positions[-1] + 1 + NEGATION_WINDOW]
+                mentioned, negated = counts[phrase_idx]
+                if NEGATION_TOKENS & set(before) or trailing & set(after):
+                    negated += 1
+                counts[phrase_idx] = (mentioned + 1, negated)
+        return counts
+
+    def _negated(self, text: str, condition_idx: int) -> bool:
+        """Whether every mention of the condition is negated, or any mention of its treatment"""
+        phrases = [phrase for idx, phrase, weight in self._phrases
+                   if idx == condition_idx and weight >= PRIMARY_WEIGHT]
+        counts = self._mentions(text, phrases)
+        mentioned = sum(m for m, _ in counts)
+        if mentioned and sum(n for _, n in counts) == mentioned:
+            return True
+        return any(n for _, n in self._mentions(text, self._treatments[condition_idx], TREATMENT_NEGATIONS))
+
+    def _excluded(self, text: str, condition_idx: int) -> bool:
+        """Whether the text mentions something that rules the entry out ("viral" for strep)"""
+        tokens = normalize_tokens(text)
+        return any(keyword <= tokens for keyword in self._exclusions[condition_idx])
+
+    def _covers(self, text: str, condition_idx: int) -> bool:
+        """Whether the condition's entry accounts for the text's medical terms"""
+        if SERIOUS_TOKENS & (normalize_tokens(text) - self._covered_tokens[condition_idx]):
+            return False
+        terms = {entry["term"] for entry in self.glossary.find_terms(text)} - ROUTINE_TERMS
+        if not terms:
+            return True
+        return len(terms & self._covered_terms[condition_idx]) / len(terms) >= MIN_TERM_COVERAGE
+
+    def lookup(self, text: str, style: str = "friendly") -> Optional[Dict]:
+        """
+        Find a pre-generated story for the text
+
+        Confidence drops when the text also mentions another condition, so mixed
+        visits ("asthma and an ear infection") still go to Claude. So do notes
+        that negate the condition or its treatment, mention something that
+        rules the entry out or serious terms it does not cover, or whose
+        medical terms the entry mostly does not cover.
+
+        Args:
+            text: Medical text typed or transcribed for the visit
+            style: Story style the user picked
+
+        Returns:
+            Dict with condition, story and confidence, or None if no confident match
+        """
+        scores = self.score(text)
+        if not scores:
+            return None
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        best_id, best_score = ranked[0]
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        confidence = best_score - 0.5 * runner_up
+        if confidence < self.min_confidence:
+            return None
+
+        condition_idx = next(i for i, c in enumerate(self.conditions) if c["id"] == best_id)
+        if (self._negated(text, condition_idx) or self._excluded(text, condition_idx)
+                or not self._covers(text, condition_idx)):
+            return None
+
+        condition = self.conditions[condition_idx]
+        stories = condition.get("stories", {})
+        story = stories.get(style) or stories.get("friendly")
+        if not story:
+            return None
+
+        return {
+            "condition": best_id,
+            "story": story,
+            "confidence": confidence,
+        }
+
+    def personalize_async(self, medical_text: str, translator,
+                          on_done: Optional[Callable[[str], None]] = None) -> Future:
+        """
+        Generate a personalized story in the background after an instant match
+
+        Args:
+            medical_text: The parent's actual text, with its specific details
+            translator: MedicalTranslator used to write the personalized story
+            on_done: Called with the new story once it is ready
+
+        Returns:
+            Future resolving to the personalized story (or None on error)
+        """
+        with self._personalizer_lock:
+            if self._personalizer is None:
+                self._personalizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="personalize")
+
+        def run():
+            story = translator.translate_to_storybook(medical_text)
+            if story and on_done:
+                on_done(story)
+            return story
+
+        return self._personalizer.submit(run)
+
+    def refresh(self, translator, styles: Optional[List[str]] = None) -> int:
+        """
+        Regenerate every library story with Claude and save the file
+
+        Args:
+            translator: MedicalTranslator used to write the stories
+            styles: Styles to regenerate, defaults to all of them
+
+        Returns:
+            Number of stories updated
+        """
+        updated = 0
+        for condition in self.conditions:
+            for style in styles or list(STYLE_THEMES):
+                prompt_text = f"{condition['source_text']}\n\nTell it as {STYLE_THEMES[style]}."
+                story = translator.translate_to_storybook(prompt_text)
+                if story:
+                    condition.setdefault("stories", {})[style] = story.strip()
+                    updated += 1
+                    print(f"Refreshed {condition['id']} ({style})")
+                else:
+                    print(f"Kept existing story for {condition['id']} ({style})")
+
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        data["conditions"] = self.conditions
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+
+        return updated
+
+
+_shared_library: Optional[StoryLibrary] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_library() -> StoryLibrary:
+    """Process-wide library shared by every Streamlit session"""
+    global _shared_library
+    with _shared_lock:
+        if _shared_library is None:
+            _shared_library = StoryLibrary()
+        return _shared_library
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or refresh the pre-generated story library")
+    parser.add_argument("--path", default=DEFAULT_LIBRARY_PATH)
+    parser.add_argument("--refresh", action="store_true", help="Regenerate stories with Claude")
+    parser.add_argument("--style", action="append", choices=list(STYLE_THEMES),
+                        help="Only refresh these styles (repeatable)")
+    parser.add_argument("--match", help="Show how a piece of text matches the library")
+    args = parser.parse_args()
+
+    library = StoryLibrary(args.path)
+
+    if args.match:
+        print(json.dumps(library.score(args.match), indent=2))
+        match = library.lookup(args.match)
+        print(f"Instant match: {match['condition']} ({match['confidence']:.2f})" if match else "No instant match")
+    elif args.refresh:
+        from medical_translator import MedicalTranslator
+        from near_duplicate_cache import NearDuplicateCache
+
+        # A private exact-match cache keeps styles from reusing each other's stories
+        translator = MedicalTranslator(story_cache=NearDuplicateCache(threshold=1.0))
+        count = library.refresh(translator, args.style)
+        print(f"Updated {count} stories in {args.path}")
+    else:
+        for condition in library.conditions:
+            print(f"{condition['id']}: {', '.join(sorted(condition.get('stories', {})))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Persistent story history in SQLite.
+
+Stories are saved to a local database in WAL mode, so the history survives
+restarts and stays out of server memory. The UI asks for one page of story
+summaries at a time and loads a full story only when it is shown. An FTS5
+index over titles, visit notes and stories backs the history search.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, List, Optional, Set
+
+from story_languages import DEFAULT_LANGUAGE
+
+DEFAULT_STORE_PATH = os.getenv(
+    "STORY_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "stories.db")
+)
+
+HISTORY_PAGE_SIZE = 5
+
+# Columns for history listings; story bodies stay in the database until needed
+SUMMARY_COLUMNS = "id, book, title, style, timestamp, substr(original, 1, 160) AS preview"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stories (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    book TEXT NOT NULL,
+    title TEXT NOT NULL DEFAULT '',
+    style TEXT NOT NULL DEFAULT 'friendly',
+    timestamp TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    original TEXT NOT NULL DEFAULT '',
+    story TEXT NOT NULL,
+    languages TEXT NOT NULL DEFAULT 'en'
+);
+CREATE INDEX IF NOT EXISTS stories_book ON stories (book, id);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS stories_fts USING fts5(
+    title, original, story, content='stories', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS stories_ai AFTER INSERT ON stories BEGIN
+    INSERT INTO stories_fts (rowid, title, original, story)
+    VALUES (new.id, new.title, new.original, new.story);
+END;
+CREATE TRIGGER IF NOT EXISTS stories_ad AFTER DELETE ON stories BEGIN
+    INSERT INTO stories_fts (stories_fts, rowid, title, original, story)
+    VALUES ('delete', old.id, old.title, old.original, old.story);
+END;
+CREATE TRIGGER IF NOT EXISTS stories_au AFTER UPDATE ON stories BEGIN
+    INSERT INTO stories_fts (stories_fts, rowid, title, original, story)
+    VALUES ('delete', old.id, old.title, old.original, old.story);
+    INSERT INTO stories_fts (rowid, title, original, story)
+    VALUES (new.id, new.title, new.original, new.story);
+END;
+"""
+
+
+def new_book_id() -> str:
+    """Random id for a new story collection"""
+    return uuid.uuid4().hex[:12]
+
+
+def story_title(story: str) -> str:
+    """The first heading of a formatted story, or its first line"""
+    first_line = ""
+    for line in story.splitlines():
+        if line.strip():
+            if line.startswith('#'):
+                return line.strip('#').strip()
+            first_line = first_line or line.strip()
+    return first_line[:80]
+
+
+def _fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query that matches every word as a prefix"""
+    words = [w.replace('"', '') for w in text.split()]
+    return ' '.join(f'"{w}"*' for w in words if w)
+
+
+class StoryStore:
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        """
+        Open (or create) the story database
+
+        Args:
+            path: SQLite file; ":memory:" keeps everything in memory
+        """
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Streamlit runs every session on its own thread; they share one
+        # connection behind a lock, so this process's reads and writes take
+        # turns. WAL lets other processes on the same file (the API server)
+        # keep reading while one of them writes.
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(stories)")}
+            if "languages" not in columns:
+                # Databases from before stories were written in several languages
+                self._conn.execute("ALTER TABLE stories ADD COLUMN languages TEXT NOT NULL DEFAULT 'en'")
+            try:
+                self._conn.executescript(FTS_SCHEMA)
+                self.full_text_search = True
+            except sqlite3.OperationalError as e:
+                # SQLite built without FTS5: search falls back to LIKE
+                print(f"Full-text search unavailable: {e}")
+                self.full_text_search = False
+
+    def add(self, book: str, story: str, original: str = "", style: str = "friendly",
+            timestamp: Optional[str] = None, languages: Optional[List[str]] = None) -> int:
+        """
+        Save a story
+
+        Args:
+            book: Collection the story belongs to
+            story: Formatted story
+            original: Medical text the story was made from
+            style: Story style
+            timestamp: Display timestamp; defaults to now
+            languages: Language codes the story is written in, in order;
+                stored comma-separated, English by default
+
+        Returns:
+            Id of the new story
+        """
+        timestamp = timestamp or time.strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO stories (book, title, style, timestamp, created_at, original, story, languages) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (book, story_title(story), style, timestamp, time.time(), original, story,
+                 ','.join(languages or [DEFAULT_LANGUAGE]))
+            )
+            return cursor.lastrowid
+
+    def update_story(self, story_id: int, story: str):
+        """Replace the text of a saved story, e.g. once a personalized version arrives"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE stories SET story = ?, title = ? WHERE id = ?",
+                (story, story_title(story), story_id)
+            )
+
+    def get(self, story_id: int) -> Optional[Dict]:
+        """One full story, or None if it does not exist"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM stories WHERE id = ?", (story_id,)).fetchone()
+        return dict(row) if row else None
+
+    def latest(self, book: str) -> Optional[Dict]:
+        """The newest full story in a collection"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM stories WHERE book = ? ORDER BY id DESC LIMIT 1", (book,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def languages(self, book: str) -> Set[str]:
+        """Every language code used by the stories in a collection"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT languages FROM stories WHERE book = ?", (book,)
+            ).fetchall()
+        return {code for row in rows for code in row["languages"].split(',')}
+
+    def _search_clause(self, search: Optional[str]):
+        if not search or not search.strip():
+            return "", []
+        if self.full_text_search:
+            query = _fts_query(search)
+            if query:
+                return " AND id IN (SELECT rowid FROM stories_fts WHERE stories_fts MATCH ?)", [query]
+            return "", []
+        pattern = f"%{search.strip()}%"
+        return " AND (title LIKE ? OR original LIKE ? OR story LIKE ?)", [pattern] * 3
+
+    def count(self, book: str, search: Optional[str] = None) -> int:
+        """Number of stories in a collection, optionally only those matching a search"""
+        clause, params = self._search_clause(search)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT COUNT(*) FROM stories WHERE book = ?{clause}", [book] + params
+            ).fetchone()
+        return row[0]
+
+    def page(self, book: str, page: int = 0, page_size: int = HISTORY_PAGE_SIZE,
+             search: Optional[str] = None, skip_latest: bool = False) -> List[Dict]:
+        """
+        One page of story summaries, newest first
+
+        Summaries carry the title, style, timestamp and a short preview of the
+        visit notes but not the story itself; load it with get().
+
+        Args:
+            book: Collection to list
+            page: Zero-based page number
+            page_size: Stories per page
+            search: Only stories matching these words
+            skip_latest: Leave out the newest story (already shown on its own)
+
+        Returns:
+            List of summary dicts
+        """
+        clause, params = self._search_clause(search)
+        offset = max(0, page) * page_size + (1 if skip_latest else 0)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {SUMMARY_COLUMNS} FROM stories WHERE book = ?{clause} "
+                "ORDER BY id DESC LIMIT ? OFFSET ?",
+                [book] + params + [page_size, offset]
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def iter_stories(self, book: str, batch_size: int = 50) -> Iterator[str]:
+        """
+        Yield every story in a collection, oldest first, for book exports
+
+        Stories are fetched in batches so a long history is never loaded at once.
+        """
+        last_id = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, story FROM stories WHERE book = ? AND id > ? ORDER BY id LIMIT ?",
+                    (book, last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row["story"]
+            last_id = rows[-1]["id"]
+
+    def clear(self, book: str) -> int:
+        """
+        Delete every story in a collection
+
+        Returns:
+            Number of stories deleted
+        """
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM stories WHERE book = ?", (book,)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_shared_store: Optional[StoryStore] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_store() -> StoryStore:
+    """The store shared by every session in this server process"""
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = StoryStore()
+        return _shared_store
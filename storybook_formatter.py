@@ -1,7 +1,133 @@
+import hashlib
 import re
-from typing import Dict, List, Optional
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from instrumentation import count_cache, span
+from story_languages import native_name, text_direction
+
+BOOK_HEADER = "📚 **Your Complete Health Storybook** 📚\n\n"
+DEFAULT_TITLE = "Your Health Story"
+TITLE_SEARCH_LINES = 3
+
+# Rendered stories shared by every formatter (and so every Streamlit session)
+RENDER_CACHE_SIZE = 2048
+
+# Scripts without capital letters (Chinese, Arabic, Hindi, ...) can't signal a
+# title with upper case; a short line that doesn't end a sentence counts instead
+CASELESS_TITLE_MAX_CHARS = 40
+SENTENCE_ENDINGS = ".!?。！？؟।۔:"
+
+# Keeps emoji markers and trailing punctuation on the correct side of right-to-left text
+RTL_MARK = "\u200f"
+
+MULTILINGUAL_SEPARATOR = "\n\n---\n\n"
+
+
+def _is_caseless_title(line: str) -> bool:
+    text = line.strip()
+    letters = [c for c in text if c.isalpha()]
+    return (bool(letters) and not any(c.isupper() or c.islower() for c in letters)
+            and len(text) <= CASELESS_TITLE_MAX_CHARS and text[-1] not in SENTENCE_ENDINGS)
+
+
+def _is_title_line(line: str) -> bool:
+    """Whether a line near the top of a story looks like its title"""
+    return bool(line.strip()) and (line.startswith('#') or line.isupper() or 'title' in line.lower()
+                                   or _is_caseless_title(line))
+
+
+def _bidi(text: str) -> str:
+    """Mark right-to-left text so markers and punctuation around it display in order"""
+    return f"{RTL_MARK}{text}{RTL_MARK}" if text_direction(text) == "rtl" else text
+
+
+class ChapterBookWriter:
+    def __init__(self, stories: Optional[Iterable[str]] = None):
+        """
+        Build a multi-chapter storybook one chapter at a time
+
+        Each chapter is rendered once when it is added; the book itself is only
+        joined (or streamed) when it is exported.
+
+        Args:
+            stories: Initial stories to add as chapters
+        """
+        self._sources: List[str] = []
+        self._chapters: List[str] = []
+        for story in stories or []:
+            self.add_chapter(story)
+
+    def _render_chapter(self, number: int, story: str) -> str:
+        return f"## Chapter {number}\n\n{story}\n\n---\n\n"
+
+    def add_chapter(self, story: str):
+        """Render and append a new chapter"""
+        self._sources.append(story)
+        self._chapters.append(self._render_chapter(len(self._chapters) + 1, story))
+
+    def sync(self, stories: Iterable[str]):
+        """
+        Bring the book in line with the current list of stories
+
+        Only new or replaced stories are rendered; unchanged chapters are
+        detected by identity or equality, so syncing an unchanged list (even
+        one freshly loaded from the story store) costs almost nothing.
+
+        Args:
+            stories: All stories in chapter order; any iterable, such as
+                StoryStore.iter_stories(), read once
+        """
+        count = 0
+        for i, story in enumerate(stories):
+            count = i + 1
+            if i >= len(self._chapters):
+                self.add_chapter(story)
+            elif story is not self._sources[i] and story != self._sources[i]:
+                self._sources[i] = story
+                self._chapters[i] = self._render_chapter(i + 1, story)
+
+        # Stories were removed: drop the chapters past the end
+        del self._sources[count:]
+        del self._chapters[count:]
+
+    def clear(self):
+        """Remove every chapter"""
+        self._sources = []
+        self._chapters = []
+
+    def __len__(self) -> int:
+        return len(self._chapters)
+
+    def iter_chunks(self) -> Iterator[str]:
+        """Yield the book piece by piece, for streamed downloads"""
+        if not self._chapters:
+            return
+        yield BOOK_HEADER
+        yield from self._chapters
+
+    def iter_bytes(self, encoding: str = "utf-8") -> Iterator[bytes]:
+        """Yield the encoded book piece by piece"""
+        for chunk in self.iter_chunks():
+            yield chunk.encode(encoding)
+
+    def write_to(self, stream: TextIO):
+        """Write the book to a file-like object without building one big string"""
+        for chunk in self.iter_chunks():
+            stream.write(chunk)
+
+    def getvalue(self) -> str:
+        """The whole book as a single string"""
+        return ''.join(self.iter_chunks())
+
 
 class StorybookFormatter:
+    _render_cache: "OrderedDict[Tuple, str]" = OrderedDict()
+    _render_lock = threading.Lock()
+    _render_hits = 0
+    _render_misses = 0
+
     def __init__(self):
         """Initialize the storybook formatter with styling options"""
         self.story_templates = {
@@ -11,10 +137,62 @@ class StorybookFormatter:
             "superhero": "🦸 **{title}** 🦸\n\n{content}"
         }
         
+    def _memoized(self, operation: str, text: str, options: Tuple, render: Callable[[], str]) -> str:
+        """Return a cached rendering keyed by content hash and options, rendering on a miss"""
+        digest = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+        key = (operation, digest, options)
+        cls = StorybookFormatter
+
+        with cls._render_lock:
+            cached = cls._render_cache.get(key)
+            if cached is not None:
+                cls._render_cache.move_to_end(key)
+                cls._render_hits += 1
+            else:
+                cls._render_misses += 1
+        count_cache(operation, hit=cached is not None)
+        if cached is not None:
+            return cached
+
+        rendered = render()
+        with cls._render_lock:
+            cls._render_cache[key] = rendered
+            while len(cls._render_cache) > RENDER_CACHE_SIZE:
+                cls._render_cache.popitem(last=False)
+        return rendered
+
+    @classmethod
+    def cache_stats(cls) -> Dict[str, float]:
+        """
+        Hit/miss counters for the shared render cache
+
+        Returns:
+            Dict with entries, hits, misses and hit_rate
+        """
+        with cls._render_lock:
+            total = cls._render_hits + cls._render_misses
+            return {
+                "entries": len(cls._render_cache),
+                "hits": cls._render_hits,
+                "misses": cls._render_misses,
+                "hit_rate": cls._render_hits / total if total else 0.0,
+            }
+
+    @classmethod
+    def clear_cache(cls):
+        """Drop every cached rendering and reset the counters"""
+        with cls._render_lock:
+            cls._render_cache.clear()
+            cls._render_hits = 0
+            cls._render_misses = 0
+
     def format_storybook(self, story_text: str, style: str = "friendly") -> str:
         """
         Format the story text with appropriate styling and structure
         
+        Results are memoized by content hash and style, so Streamlit reruns
+        that re-display the same stories skip the formatting work.
+        
         Args:
             story_text: The story content from Claude
             style: The visual style to apply
@@ -22,15 +200,23 @@ class StorybookFormatter:
         Returns:
             Formatted storybook text
         """
+        template = self.story_templates.get(style, self.story_templates["friendly"])
+        with span("format_storybook", style=style):
+            return self._memoized(
+                "format", story_text, (template,),
+                lambda: self._format_storybook_uncached(story_text, style)
+            )
+
+    def _format_storybook_uncached(self, story_text: str, style: str) -> str:
         try:
             # Extract title if present
             lines = story_text.strip().split('\n')
-            title = "Your Health Story"
+            title = DEFAULT_TITLE
             content = story_text
             
             # Look for a title in the first few lines
             for i, line in enumerate(lines[:3]):
-                if line.strip() and (line.startswith('#') or line.isupper() or 'title' in line.lower()):
+                if _is_title_line(line):
                     title = line.strip('#').strip()
                     content = '\n'.join(lines[i+1:]).strip()
                     break
@@ -40,7 +226,7 @@ class StorybookFormatter:
             
             # Apply template
             template = self.story_templates.get(style, self.story_templates["friendly"])
-            formatted_story = template.format(title=title, content=content)
+            formatted_story = template.format(title=_bidi(title), content=content)
             
             return formatted_story
             
@@ -55,6 +241,7 @@ class StorybookFormatter:
         formatted_paragraphs = []
         for i, paragraph in enumerate(paragraphs):
             # Add some visual elements
+            paragraph = _bidi(paragraph)
             if i == 0:
                 paragraph = f"🌈 {paragraph}"
             elif i == len(paragraphs) - 1:
@@ -66,6 +253,27 @@ class StorybookFormatter:
             
         return '\n\n'.join(formatted_paragraphs)
         
+    def format_multilingual(self, stories: Dict[str, str], style: str = "friendly") -> str:
+        """
+        Format the same story in several languages as one storybook
+
+        Each language is formatted on its own and labelled with its native
+        name; a single language is formatted exactly like format_storybook.
+
+        Args:
+            stories: Story text by language code, in display order
+            style: The visual style to apply
+
+        Returns:
+            Formatted storybook with one section per language
+        """
+        if len(stories) == 1:
+            return self.format_storybook(next(iter(stories.values())), style)
+        return MULTILINGUAL_SEPARATOR.join(
+            f"🌍 *{native_name(code)}*\n\n{self.format_storybook(story, style)}"
+            for code, story in stories.items()
+        )
+
     def create_chapter_format(self, stories: List[str]) -> str:
         """
         Create a multi-chapter storybook format
@@ -76,15 +284,7 @@ class StorybookFormatter:
         Returns:
             Combined storybook with chapters
         """
-        if not stories:
-            return ""
-            
-        chapter_book = "📚 **Your Complete Health Storybook** 📚\n\n"
-        
-        for i, story in enumerate(stories, 1):
-            chapter_book += f"## Chapter {i}\n\n{story}\n\n---\n\n"
-            
-        return chapter_book
+        return ChapterBookWriter(stories).getvalue()
         
     def add_interactive_elements(self, story: str) -> str:
         """
@@ -96,6 +296,9 @@ class StorybookFormatter:
         Returns:
             Story with interactive elements
         """
+        return self._memoized("interactive", story, (), lambda: self._add_interactive_elements_uncached(story))
+
+    def _add_interactive_elements_uncached(self, story: str) -> str:
         interactive_story = story + "\n\n"
         
         # Add reflection questions
@@ -109,3 +312,157 @@ class StorybookFormatter:
         interactive_story += "Draw a picture of the helpful characters from your story!\n\n"
         
         return interactive_story
+
+
+class IncrementalStoryFormatter:
+    def __init__(self, style: str = "friendly", templates: Optional[Dict[str, str]] = None):
+        """
+        Format a story while it is still streaming in
+
+        Produces the same text as StorybookFormatter.format_storybook on the
+        full story, but emits the title as soon as it is known and each
+        paragraph as soon as the next one starts. The last paragraph is held
+        back until finish() so it can get the closing 💝 marker.
+
+        Args:
+            style: The visual style to apply
+            templates: Story templates; defaults to StorybookFormatter's
+        """
+        templates = templates or StorybookFormatter().story_templates
+        self.template = templates.get(style, templates["friendly"])
+
+        self._state = "title"
+        self._buffer = ""
+        self._raw_parts: List[str] = []
+        self._title_lines: List[str] = []
+        self._pending: Optional[str] = None
+        self._paragraph_count = 0
+        self._output: List[str] = []
+        self.finished = False
+
+    @property
+    def raw_text(self) -> str:
+        """Everything fed in so far, unformatted"""
+        return ''.join(self._raw_parts)
+
+    @property
+    def text(self) -> str:
+        """Formatted text emitted so far"""
+        return ''.join(self._output)
+
+    def preview(self) -> str:
+        """Formatted text so far plus the paragraphs still being written, for live display"""
+        tail = []
+        if self._state == "title":
+            tail = ['\n'.join(self._title_lines + [self._buffer]).strip()]
+        else:
+            if self._pending is not None:
+                tail.append(self._pending)
+            if self._buffer.strip():
+                tail.append(self._buffer.strip())
+        tail = [t for t in tail if t]
+        if not tail:
+            return self.text
+        separator = '\n\n' if self._paragraph_count else ''
+        return self.text + separator + '\n\n'.join(tail)
+
+    def _emit(self, text: str) -> str:
+        self._output.append(text)
+        return text
+
+    def _start_body(self, title: str, content: str) -> str:
+        self._state = "body"
+        self._buffer = content.lstrip()
+        header = self.template.replace("{content}", "").format(title=_bidi(title))
+        return self._emit(header) + self._drain_paragraphs()
+
+    def _consume_title_lines(self, at_end: bool) -> str:
+        """Look for the title among the first complete lines"""
+        while '\n' in self._buffer or (at_end and self._buffer):
+            line, newline, self._buffer = self._buffer.partition('\n')
+            if not self._title_lines:
+                # format_storybook strips leading whitespace before looking
+                if not line.strip() and newline:
+                    continue
+                line = line.lstrip()
+            self._title_lines.append(line)
+            if _is_title_line(line):
+                return self._start_body(line.strip('#').strip(), self._buffer)
+            if len(self._title_lines) >= TITLE_SEARCH_LINES:
+                break
+
+        if len(self._title_lines) >= TITLE_SEARCH_LINES or at_end:
+            return self._start_body(DEFAULT_TITLE, '\n'.join(self._title_lines + [self._buffer]))
+        return ""
+
+    def _paragraph(self, text: str, last: bool) -> str:
+        if self._paragraph_count == 0:
+            marker = "🌈"
+        elif last:
+            marker = "💝"
+        else:
+            marker = "📖"
+        separator = '\n\n' if self._paragraph_count else ''
+        self._paragraph_count += 1
+        return self._emit(f"{separator}{marker} {_bidi(text)}")
+
+    def _drain_paragraphs(self) -> str:
+        """Emit every paragraph that is known not to be the last one"""
+        emitted = ""
+        while True:
+            if self._pending is not None and self._buffer.strip():
+                emitted += self._paragraph(self._pending, last=False)
+                self._pending = None
+            if '\n\n' not in self._buffer:
+                return emitted
+            paragraph, _, self._buffer = self._buffer.partition('\n\n')
+            paragraph = paragraph.strip()
+            if paragraph:
+                self._pending = paragraph
+
+    def feed(self, delta: str) -> str:
+        """
+        Add the next piece of streamed text
+
+        Args:
+            delta: Newly received text
+
+        Returns:
+            Newly formatted text to append to the display (may be empty)
+        """
+        if self.finished or not delta:
+            return ""
+        self._raw_parts.append(delta)
+        self._buffer += delta
+
+        if self._state == "title":
+            return self._consume_title_lines(at_end=False)
+        return self._drain_paragraphs()
+
+    def finish(self) -> str:
+        """
+        Flush the remaining text once the stream has ended
+
+        Returns:
+            The final formatted text to append, including the last paragraph
+        """
+        if self.finished:
+            return ""
+
+        emitted = ""
+        if self._state == "title":
+            emitted += self._consume_title_lines(at_end=True)
+            if self._state == "title":
+                emitted += self._start_body(DEFAULT_TITLE, "")
+
+        emitted += self._drain_paragraphs()
+        remainder = self._buffer.strip()
+        self._buffer = ""
+        if self._pending is not None:
+            emitted += self._paragraph(self._pending, last=not remainder)
+            self._pending = None
+        if remainder:
+            emitted += self._paragraph(remainder, last=True)
+
+        self.finished = True
+        return emitted
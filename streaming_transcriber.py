@@ -0,0 +1,236 @@
+"""
+Incremental transcription of audio that arrives a few milliseconds at a time.
+
+StreamingTranscriber only manages the audio buffer and decides what to
+transcribe next; the caller runs Whisper on each request (in a worker process,
+off the event loop) and hands the text back. Recent audio is re-transcribed
+every second or so as a partial transcript. Once the speaker pauses, or the
+window grows too long, the window is transcribed one last time, committed as a
+final segment and dropped, so each Whisper call covers at most one window and
+stopping only costs one short transcription of the unfinished tail.
+"""
+from fractions import Fraction
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+WHISPER_SAMPLE_RATE = 16000
+
+# Zero crossings of the resampling filter on each side, at the lower of the two rates
+RESAMPLE_ZERO_CROSSINGS = 16
+# Passband edge as a share of the lower Nyquist frequency; the rest is the transition band
+RESAMPLE_ROLLOFF = 0.9
+# Unusual rates are approximated by a ratio with at most this many filter phases
+MAX_RESAMPLE_PHASES = 1000
+
+ENCODINGS = {
+    "pcm_s16le": np.dtype("<i2"),
+    "pcm_f32le": np.dtype("<f4"),
+}
+
+
+class TranscriptionRequest(NamedTuple):
+    kind: str              # "partial" or "final"
+    end: int               # Absolute sample index the request covers up to
+    samples: np.ndarray    # 16 kHz mono float32 audio
+    prompt: str            # Committed text before this window, for context
+
+
+class Resampler:
+    def __init__(self, source_rate: int, target_rate: int = WHISPER_SAMPLE_RATE):
+        """
+        Streaming polyphase resampler with an anti-aliasing low-pass filter
+
+        Feed consecutive frames to process(); the filter history and the
+        output phase carry over between frames, so frame boundaries leave no
+        clicks or drift. Output is delayed by half the filter length, a
+        millisecond or two.
+
+        Args:
+            source_rate: Sample rate of the incoming audio
+            target_rate: Sample rate to produce
+        """
+        self.source_rate = source_rate
+        ratio = Fraction(target_rate, source_rate).limit_denominator(MAX_RESAMPLE_PHASES)
+        self.up, self.down = ratio.numerator, ratio.denominator
+        factor = max(self.up, self.down)
+
+        # Windowed-sinc low-pass at the upsampled rate, cutting off below the lower Nyquist
+        taps_per_phase = 2 * RESAMPLE_ZERO_CROSSINGS * -(-factor // self.up)
+        length = taps_per_phase * self.up
+        cutoff = RESAMPLE_ROLLOFF / (2 * factor)
+        n = np.arange(length) - (length - 1) / 2
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, 8.0) * self.up
+        # phases[p][j] weights input sample i - j for outputs landing on phase p
+        self.phases = kernel.reshape(taps_per_phase, self.up).T.astype(np.float32)
+        self.taps = taps_per_phase
+
+        self._history = np.zeros(taps_per_phase - 1, dtype=np.float32)
+        self._consumed = 0    # Input samples before the current frame
+        self._next_time = 0   # Upsampled time of the next output sample
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """Resample the next frame of float32 samples"""
+        if self.up == self.down:
+            return samples
+        buffer = np.concatenate((self._history, samples))
+        available = self._consumed + len(samples)
+        # Outputs whose newest input sample has arrived
+        count = max(0, -(-(available * self.up - self._next_time) // self.down))
+        times = self._next_time + np.arange(count) * self.down
+        newest = times // self.up - self._consumed + len(self._history)
+        window = newest[:, np.newaxis] - np.arange(self.taps)[np.newaxis, :]
+        output = np.einsum("ij,ij->i", buffer[window], self.phases[times % self.up])
+
+        self._next_time += count * self.down
+        self._consumed = available
+        self._history = buffer[len(buffer) - (self.taps - 1):]
+        return output.astype(np.float32)
+
+
+def decode_pcm(data: bytes, encoding: str = "pcm_s16le", sample_rate: int = WHISPER_SAMPLE_RATE,
+               resampler: Optional[Resampler] = None) -> np.ndarray:
+    """
+    Convert a raw PCM frame into 16 kHz mono float32 samples
+
+    Args:
+        data: Little-endian mono PCM bytes
+        encoding: "pcm_s16le" or "pcm_f32le"
+        sample_rate: Sample rate of the frame
+        resampler: Resampler carrying state from the previous frames of the
+            same stream; a fresh one (for a single self-contained frame) by default
+
+    Returns:
+        Samples in [-1, 1] at 16 kHz
+    """
+    dtype = ENCODINGS.get(encoding)
+    if dtype is None:
+        raise ValueError(f"Unsupported encoding {encoding!r}; use one of {sorted(ENCODINGS)}")
+    usable = len(data) - len(data) % dtype.itemsize
+    samples = np.frombuffer(data[:usable], dtype=dtype).astype(np.float32)
+    if dtype.kind == "i":
+        samples /= 32768.0
+
+    if sample_rate != WHISPER_SAMPLE_RATE:
+        samples = (resampler or Resampler(sample_rate)).process(samples)
+    return samples
+
+
+class StreamingTranscriber:
+    def __init__(self, partial_every: float = 1.0, max_window: float = 20.0,
+                 min_final: float = 2.0, silence_seconds: float = 0.6, silence_rms: float = 0.01):
+        """
+        Track streamed audio and plan the Whisper calls for it
+
+        Args:
+            partial_every: Seconds of new audio between partial transcripts
+            max_window: Longest window before it is finalized regardless of pauses
+            min_final: Shortest window that a pause can finalize
+            silence_seconds: Length of the pause that ends a segment
+            silence_rms: Level below which audio counts as silence
+        """
+        self.partial_samples = int(partial_every * WHISPER_SAMPLE_RATE)
+        self.max_window_samples = int(max_window * WHISPER_SAMPLE_RATE)
+        self.min_final_samples = int(min_final * WHISPER_SAMPLE_RATE)
+        self.silence_samples = int(silence_seconds * WHISPER_SAMPLE_RATE)
+        self.silence_rms = silence_rms
+
+        self._chunks: List[np.ndarray] = []
+        self._resampler: Optional[Resampler] = None
+        self._window_start = 0       # Absolute index of the first uncommitted sample
+        self._received = 0           # Absolute index just past the last sample
+        self._last_partial_end = 0
+        self.segments: List[str] = []
+
+    @property
+    def transcript(self) -> str:
+        """Everything committed so far"""
+        return ' '.join(self.segments)
+
+    @property
+    def seconds_received(self) -> float:
+        return self._received / WHISPER_SAMPLE_RATE
+
+    def add_samples(self, samples: np.ndarray):
+        """Append 16 kHz mono float32 samples"""
+        if len(samples):
+            self._chunks.append(samples)
+            self._received += len(samples)
+
+    def add_pcm(self, data: bytes, encoding: str = "pcm_s16le", sample_rate: int = WHISPER_SAMPLE_RATE):
+        """Append one raw PCM frame from the client"""
+        resampler = self._resampler
+        if sample_rate != WHISPER_SAMPLE_RATE and (resampler is None or resampler.source_rate != sample_rate):
+            self._resampler = Resampler(sample_rate)
+        self.add_samples(decode_pcm(data, encoding, sample_rate, self._resampler))
+
+    def _window(self) -> np.ndarray:
+        if len(self._chunks) > 1:
+            self._chunks = [np.concatenate(self._chunks)]
+        return self._chunks[0] if self._chunks else np.zeros(0, dtype=np.float32)
+
+    def _trailing_silence(self) -> bool:
+        tail = []
+        needed = self.silence_samples
+        for chunk in reversed(self._chunks):
+            tail.append(chunk[-needed:])
+            needed -= len(tail[-1])
+            if needed <= 0:
+                break
+        if needed > 0:
+            return False
+        samples = np.concatenate(tail[::-1])
+        return float(np.sqrt(np.mean(samples * samples))) < self.silence_rms
+
+    def pending(self, final: bool = False) -> Optional[TranscriptionRequest]:
+        """
+        The next Whisper call worth making, if any
+
+        Args:
+            final: The stream has ended; finalize whatever is left
+
+        Returns:
+            A request to transcribe and pass back to complete(), or None
+        """
+        window_length = self._received - self._window_start
+        if final:
+            if window_length < WHISPER_SAMPLE_RATE // 10:
+                return None
+            kind = "final"
+        elif window_length >= self.max_window_samples:
+            kind = "final"
+        elif window_length >= self.min_final_samples and self._trailing_silence():
+            kind = "final"
+        elif self._received - self._last_partial_end >= self.partial_samples:
+            kind = "partial"
+        else:
+            return None
+
+        if kind == "partial":
+            self._last_partial_end = self._received
+        return TranscriptionRequest(kind, self._received, self._window(), self.transcript[-200:])
+
+    def complete(self, request: TranscriptionRequest, text: Optional[str]) -> Dict:
+        """
+        Record the transcription of a request
+
+        Args:
+            request: Request returned by pending()
+            text: Whisper output for its samples
+
+        Returns:
+            Message for the client: {"type": "partial" | "final", "text", "transcript"}
+        """
+        text = (text or "").strip()
+        if request.kind == "partial":
+            return {"type": "partial", "text": text, "transcript": self.transcript}
+
+        # Drop the committed samples; audio that arrived meanwhile stays
+        drop = request.end - self._window_start
+        window = self._window()
+        self._chunks = [window[drop:]] if len(window) > drop else []
+        self._window_start = request.end
+        self._last_partial_end = max(self._last_partial_end, request.end)
+        if text:
+            self.segments.append(text)
+        return {"type": "final", "text": text, "transcript": self.transcript}
@@ -1,7 +1,12 @@
 import streamlit as st
 import os
+from job_executor import get_job_executor
 from medical_translator import MedicalTranslator
-from storybook_formatter import StorybookFormatter
+from story_exporter import BOOK_FORMAT_LABELS, EXPORT_FORMATS, book_formats, get_shared_exporter
+from profiling import get_profiler
+from story_store import get_shared_store
+from storybook_formatter import ChapterBookWriter, IncrementalStoryFormatter, StorybookFormatter
+from streamlit_helpers import current_book_id, show_admin_controls, show_story_history
 
 # Page configuration with kid-friendly theme
 st.set_page_config(
@@ -85,14 +90,16 @@ if 'translator' not in st.session_state:
     st.session_state.translator = MedicalTranslator()
 if 'formatter' not in st.session_state:
     st.session_state.formatter = StorybookFormatter()
-if 'stories' not in st.session_state:
-    st.session_state.stories = []
+if 'chapter_book' not in st.session_state:
+    st.session_state.chapter_book = ChapterBookWriter()
 if 'transcribed_text' not in st.session_state:
     st.session_state.transcribed_text = ""
 if 'show_review' not in st.session_state:
     st.session_state.show_review = False
 
 def main():
+    show_admin_controls()
+    
     # Fun animated title
     st.markdown('<h1 class="big-title">🌈 My Medical Story Maker 🌈</h1>', unsafe_allow_html=True)
     st.markdown('<p style="text-align: center; font-size: 1.5rem; color: #FF6B9D;">✨ Turn doctor visits into magical stories! ✨</p>', unsafe_allow_html=True)
@@ -125,6 +132,12 @@ def main():
             }[x]
         )
         
+        personalize_stories = st.checkbox(
+            "✨ Personalize instant stories",
+            value=True,
+            help="Common visits get a ready-made story right away, then a personalized one replaces it"
+        )
+        
         st.markdown('</div>', unsafe_allow_html=True)
         
         # Instructions for parents
@@ -145,6 +158,10 @@ def main():
         """)
         st.markdown('</div>', unsafe_allow_html=True)
     
+    # Stories are saved in the story store, not in session memory
+    store = get_shared_store()
+    book_id = current_book_id()
+    
     # Main interface with kid-friendly design
     col1, col2 = st.columns([1, 1])
     
@@ -185,16 +202,41 @@ def main():
                 if st.button("✨ Create Magic Story!", type="primary"):
                     with st.spinner("🪄 Creating your magical story..."):
                         try:
-                            story = st.session_state.translator.translate_to_storybook(reviewed_text)
+                            story_entry = {
+                                'original': reviewed_text,
+                                'timestamp': "Now",
+                                'style': story_style
+                            }
+                            formatter = st.session_state.formatter
+                            
+                            def use_personalized_story(personalized, entry=story_entry, style=story_style):
+                                # Runs on a background thread once the personalized story arrives
+                                entry['story'] = formatter.format_storybook(personalized, style)
+                                if 'id' in entry:
+                                    store.update_story(entry['id'], entry['story'])
+                            
+                            # Show paragraphs as soon as Claude finishes writing them
+                            story_preview = st.empty()
+                            live_story = IncrementalStoryFormatter(story_style, formatter.story_templates)
+                            # Waits its turn when every Claude slot on the server is busy
+                            with get_job_executor().claude_admission.slot():
+                                for delta in st.session_state.translator.stream_storybook(
+                                    reviewed_text,
+                                    story_style,
+                                    on_personalized=use_personalized_story if personalize_stories else None
+                                ):
+                                    live_story.feed(delta)
+                                    story_preview.markdown(live_story.preview())
+                            live_story.finish()
+                            story = live_story.raw_text
                             
                             if story:
-                                formatted_story = st.session_state.formatter.format_storybook(story, story_style)
-                                st.session_state.stories.append({
-                                    'original': reviewed_text,
-                                    'story': formatted_story,
-                                    'timestamp': "Now",
-                                    'style': story_style
-                                })
+                                saved_story = story_entry.setdefault('story', live_story.text)
+                                story_entry['id'] = store.add(book_id, saved_story, original=reviewed_text,
+                                                              style=story_style, timestamp=story_entry['timestamp'])
+                                if story_entry['story'] is not saved_story:
+                                    # The personalized story arrived while this one was being saved
+                                    store.update_story(story_entry['id'], story_entry['story'])
                                 st.session_state.show_review = False
                                 st.session_state.transcribed_text = ""
                                 st.success("📚 Your story is ready!")
@@ -239,9 +281,9 @@ def main():
         st.markdown('<div class="fun-box">', unsafe_allow_html=True)
         st.markdown("## 📚 Your Magical Stories!")
         
-        if st.session_state.stories:
+        latest_story = store.latest(book_id)
+        if latest_story:
             # Show latest story with fun styling
-            latest_story = st.session_state.stories[-1]
             st.markdown('<div class="story-display">', unsafe_allow_html=True)
             st.markdown(latest_story['story'])
             st.markdown('</div>', unsafe_allow_html=True)
@@ -253,19 +295,17 @@ def main():
                 st.markdown(interactive_story)
                 st.markdown('</div>', unsafe_allow_html=True)
             
-            # Story history
-            if len(st.session_state.stories) > 1:
-                st.markdown("### 📖 Your Story Collection")
-                for i, story_data in enumerate(reversed(st.session_state.stories[:-1])):
-                    theme_emoji = {
-                        "friendly": "🐻", "adventure": "🗺️", 
-                        "magical": "✨", "superhero": "🦸"
-                    }.get(story_data.get('style', 'friendly'), '📚')
-                    
-                    with st.expander(f"{theme_emoji} Story {len(st.session_state.stories) - i - 1}"):
-                        st.markdown('<div class="story-display">', unsafe_allow_html=True)
-                        st.markdown(story_data['story'])
-                        st.markdown('</div>', unsafe_allow_html=True)
+            # Story history, one page at a time
+            theme_emoji = {
+                "friendly": "🐻", "adventure": "🗺️", 
+                "magical": "✨", "superhero": "🦸"
+            }
+            show_story_history(
+                store,
+                book_id,
+                heading="📖 Your Story Collection",
+                label=lambda story_data: f"{theme_emoji.get(story_data['style'], '📚')} {story_data['title']}"
+            )
             
             # Export options with kid-friendly design
             st.markdown("### 💾 Save Your Stories!")
@@ -273,20 +313,37 @@ def main():
             col_save1, col_save2 = st.columns(2)
             
             with col_save1:
+                book_format = st.selectbox(
+                    "📁 Book Format",
+                    # PDF only when its fonts can show every story's script
+                    book_formats(store.languages(book_id)),
+                    format_func=BOOK_FORMAT_LABELS.get
+                )
+                
                 if st.button("📄 Make Story Book"):
-                    all_stories = [story['story'] for story in st.session_state.stories]
-                    complete_book = st.session_state.formatter.create_chapter_format(all_stories)
+                    all_stories = store.iter_stories(book_id)
+                    if book_format == "md":
+                        # Only stories added since the last export get rendered
+                        st.session_state.chapter_book.sync(all_stories)
+                        complete_book = st.session_state.chapter_book.getvalue()
+                        book_mime = "text/markdown"
+                    else:
+                        # Chapters rendered in an earlier export come from the exporter's cache
+                        complete_book = get_shared_exporter().export_bytes(all_stories, book_format, story_style)
+                        book_mime = EXPORT_FORMATS[book_format]["mime"]
                     
                     st.download_button(
                         label="📥 Download Story Book",
                         data=complete_book,
-                        file_name=f"my_medical_storybook.md",
-                        mime="text/markdown"
+                        file_name=f"my_medical_storybook.{book_format}",
+                        mime=book_mime
                     )
             
             with col_save2:
                 if st.button("🗑️ Clear All Stories"):
-                    st.session_state.stories = []
+                    store.clear(book_id)
+                    st.session_state.chapter_book.clear()
+                    st.session_state.history_page = 0
                     st.rerun()
         else:
             # Welcome message with animations
@@ -334,4 +391,6 @@ def main():
     """, unsafe_allow_html=True)
 
 if __name__ == "__main__":
-    main()
+    # Profiled when STORYBOOK_PROFILE_RUNS or the admin controls armed the profiler
+    with get_profiler().profile("streamlit_app"):
+        main()
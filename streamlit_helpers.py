@@ -0,0 +1,177 @@
+"""
+Streamlit pieces shared by the app entry points: URL query parameters that
+survive a page refresh, the lazily created recorder, the paginated story
+history, and admin controls.
+"""
+import math
+import os
+from typing import Callable, Dict, Optional
+
+import streamlit as st
+
+from admission_control import ServerBusy
+from profiling import get_profiler
+from story_store import HISTORY_PAGE_SIZE, StoryStore, new_book_id
+
+# Admin controls appear only when the URL carries ?admin=<this token>
+ADMIN_TOKEN = os.getenv("STORYBOOK_ADMIN_TOKEN", "")
+
+
+def get_query_param(name: str) -> Optional[str]:
+    """A value from the page URL, on both old and new Streamlit versions"""
+    if hasattr(st, "query_params"):
+        return st.query_params.get(name)
+    values = st.experimental_get_query_params().get(name)
+    return values[0] if values else None
+
+
+def set_query_param(name: str, value: Optional[str]):
+    """Set (or remove, when value is None) a value in the page URL"""
+    if hasattr(st, "query_params"):
+        if value:
+            st.query_params[name] = value
+        else:
+            st.query_params.pop(name, None)
+    else:
+        params = st.experimental_get_query_params()
+        if value:
+            params[name] = value
+        else:
+            params.pop(name, None)
+        st.experimental_set_query_params(**params)
+
+
+def current_book_id() -> str:
+    """
+    Id of this visitor's story collection
+
+    Kept in the URL, so a refresh or a bookmark opens the same stories.
+    """
+    if 'book_id' not in st.session_state:
+        st.session_state.book_id = get_query_param('book') or new_book_id()
+        set_query_param('book', st.session_state.book_id)
+    return st.session_state.book_id
+
+
+def get_recorder():
+    """
+    This session's AudioRecorder
+
+    Created on first use, so sounddevice and PortAudio are only loaded once
+    someone sets up a microphone or starts recording.
+    """
+    if st.session_state.get('recorder') is None:
+        from audio_recorder import AudioRecorder
+        st.session_state.recorder = AudioRecorder()
+    return st.session_state.recorder
+
+
+def choose_microphone(label: str = "🎤 Select Microphone"):
+    """
+    Microphone picker
+
+    Listing devices loads PortAudio, so the system default microphone is used
+    until the user asks to pick another one.
+    """
+    if not st.checkbox("Choose a microphone", key="choose_microphone",
+                       help="The system default microphone is used otherwise"):
+        return
+
+    recorder = get_recorder()
+    devices = recorder.get_available_devices()
+    input_devices = [f"{i}: {device['name']}" for i, device in enumerate(devices)
+                     if device['max_input_channels'] > 0]
+
+    if input_devices:
+        selected_device = st.selectbox(label, input_devices)
+        recorder.set_device(int(selected_device.split(':')[0]))
+
+
+def job_status_message(job_executor, job, working: str) -> str:
+    """Progress line for a background job, or its place in line while it waits for a worker"""
+    position = job_executor.queue_position(job.id)
+    if position:
+        return f"⏳ Lots of stories are being made right now... you're number {position} in line ({job.elapsed:.0f}s)"
+    return f"{working} ({job.elapsed:.0f}s)"
+
+
+def show_busy(error: ServerBusy):
+    """Explain a job that was turned away because the queue is full"""
+    st.warning(f"⏳ {error}. Please try again in about {error.retry_after:.0f} seconds.")
+
+
+def show_story_history(store: StoryStore, book_id: str, heading: str = "📖 Previous Stories",
+                       label: Optional[Callable[[Dict], str]] = None):
+    """
+    Searchable, paginated list of earlier stories
+
+    Only the summaries for the visible page are queried; a story's text is
+    loaded when its expander is rendered.
+
+    Args:
+        store: Story store
+        book_id: Collection to list
+        heading: Section heading
+        label: Builds the expander label from a story summary
+    """
+    if store.count(book_id) < 2:
+        return
+
+    st.subheader(heading)
+    search = st.text_input("🔍 Search stories", key="history_search")
+
+    # Without a search the newest story is already shown above the history
+    skip_latest = not search
+    matches = store.count(book_id, search) - (1 if skip_latest else 0)
+    if matches <= 0:
+        st.caption("No stories found")
+        return
+
+    pages = math.ceil(matches / HISTORY_PAGE_SIZE)
+    page = min(st.session_state.get('history_page', 0), pages - 1)
+
+    for summary in store.page(book_id, page, search=search, skip_latest=skip_latest):
+        title = label(summary) if label else f"{summary['title']} - {summary['timestamp']}"
+        with st.expander(title):
+            story = store.get(summary['id'])
+            if story:
+                st.markdown(story['story'])
+
+    if pages > 1:
+        col_newer, col_page, col_older = st.columns([1, 2, 1])
+        with col_newer:
+            if st.button("◀ Newer", disabled=page == 0, key="history_newer"):
+                st.session_state.history_page = page - 1
+                st.rerun()
+        with col_page:
+            st.caption(f"Page {page + 1} of {pages}")
+        with col_older:
+            if st.button("Older ▶", disabled=page >= pages - 1, key="history_older"):
+                st.session_state.history_page = page + 1
+                st.rerun()
+
+
+def is_admin() -> bool:
+    """Whether this page was opened with the admin token"""
+    return bool(ADMIN_TOKEN) and get_query_param('admin') == ADMIN_TOKEN
+
+
+def show_admin_controls():
+    """Sidebar section for profiling the next few runs; hidden from parents"""
+    if not is_admin():
+        return
+
+    profiler = get_profiler()
+    with st.sidebar.expander("🔧 Admin: Profiling"):
+        st.caption(f"Runs left to profile: {profiler.remaining}")
+        runs = st.number_input("Profile the next N runs", min_value=1, max_value=100, value=5, key="profile_runs")
+        if st.button("▶️ Start Profiling", key="profile_start"):
+            profiler.arm(int(runs))
+            st.rerun()
+        if profiler.remaining and st.button("⏹️ Stop Profiling", key="profile_stop"):
+            profiler.arm(0)
+            st.rerun()
+        if profiler.reports:
+            st.caption(f"Latest reports in {os.path.abspath(profiler.output_dir)}:")
+            for base in reversed(profiler.reports[-5:]):
+                st.text(os.path.basename(base))
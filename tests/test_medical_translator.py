@@ -0,0 +1,34 @@
+import unittest
+
+from medical_translator import MedicalTranslator
+from transcript_chunker import estimate_tokens
+
+SMALL_TALK = "How was the drive in today? Traffic was fine, we found parking right away. "
+
+
+class CannedFactsTranslator(MedicalTranslator):
+    """Answers every map step with the same reply instead of calling Claude"""
+
+    def __init__(self, reply: str):
+        self.reply = reply
+
+    def _extract_medical_facts(self, chunk: str) -> str:
+        return self.reply
+
+
+class SummarizeTranscriptTest(unittest.TestCase):
+    def setUp(self):
+        self.transcript = SMALL_TALK * 200
+        self.assertGreater(estimate_tokens(self.transcript), 1500)
+
+    def test_facts_are_merged_without_duplicates(self):
+        summary = CannedFactsTranslator("- Strep throat\n- Amoxicillin twice daily").summarize_transcript(self.transcript)
+        self.assertEqual(summary, "- Strep throat\n- Amoxicillin twice daily")
+
+    def test_no_facts_falls_back_to_the_transcript(self):
+        summary = CannedFactsTranslator("None").summarize_transcript(self.transcript)
+        self.assertEqual(summary, self.transcript)
+
+
+if __name__ == "__main__":
+    unittest.main()
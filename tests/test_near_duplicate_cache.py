@@ -0,0 +1,50 @@
+import unittest
+
+from near_duplicate_cache import NearDuplicateCache, normalize_tokens
+
+WRIST_NOTE = ("X-ray of the {side} wrist shows a small buckle fracture. Splint for three weeks, "
+              "ibuprofen for pain, and follow up with orthopedics in ten days.")
+EAR_NOTE = ("Left ear infection with fluid behind the eardrum. Start {drug} twice daily for the "
+            "full course, give acetaminophen for fever, and recheck the ear in two weeks.")
+ANKLE_NOTE = ("Twisted ankle at soccer practice, {findings} on exam. Rest, ice, compression and "
+              "elevation, ibuprofen as needed, and return if it gets worse.")
+
+
+class NormalizeTokensTest(unittest.TestCase):
+    def test_negation_is_bound_to_the_next_word(self):
+        self.assertEqual(normalize_tokens("swelling, no fracture"), {"swelling", "no_fracture"})
+        self.assertEqual(normalize_tokens("fracture, no swelling"), {"fracture", "no_swelling"})
+
+    def test_negation_does_not_cross_a_sentence(self):
+        self.assertEqual(normalize_tokens("Fever? No. Cough"), {"fever", "no", "cough"})
+
+
+class NearDuplicateCacheTest(unittest.TestCase):
+    def assert_misses(self, cached: str, incoming: str):
+        cache = NearDuplicateCache()
+        cache.add(cached, "cached story")
+        self.assertIsNone(cache.lookup(incoming))
+
+    def test_reworded_note_hits(self):
+        cache = NearDuplicateCache()
+        cache.add(WRIST_NOTE.format(side="left"), "cached story")
+        self.assertEqual(cache.lookup(WRIST_NOTE.format(side="left") + " Thanks!"), "cached story")
+
+    def test_swapped_negation_misses(self):
+        self.assert_misses(ANKLE_NOTE.format(findings="swelling, no fracture"),
+                           ANKLE_NOTE.format(findings="fracture, no swelling"))
+
+    def test_different_drug_misses(self):
+        self.assert_misses(EAR_NOTE.format(drug="amoxicillin"), EAR_NOTE.format(drug="azithromycin"))
+
+    def test_brand_name_counts_as_the_same_drug(self):
+        cache = NearDuplicateCache()
+        cache.add(EAR_NOTE.format(drug="azithromycin"), "cached story")
+        self.assertEqual(cache.lookup(EAR_NOTE.format(drug="zithromax")), "cached story")
+
+    def test_other_side_misses(self):
+        self.assert_misses(WRIST_NOTE.format(side="left"), WRIST_NOTE.format(side="right"))
+
+
+if __name__ == "__main__":
+    unittest.main()
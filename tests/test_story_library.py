@@ -0,0 +1,34 @@
+import unittest
+
+from story_library import StoryLibrary
+
+
+class StoryLibraryTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.library = StoryLibrary()
+
+    def condition_for(self, text):
+        match = self.library.lookup(text)
+        return match and match["condition"]
+
+    def test_strep_note_matches(self):
+        text = "Positive rapid strep test. Sore throat and fever. Amoxicillin twice daily for 10 days."
+        self.assertEqual(self.condition_for(text), "strep_throat")
+
+    def test_viral_sore_throat_is_not_strep(self):
+        self.assertIsNone(self.condition_for("Viral sore throat. No antibiotics needed"))
+
+    def test_sore_throat_from_a_cold_is_not_strep(self):
+        self.assertIsNone(self.condition_for("sore throat from a cold virus; antibiotics will not help"))
+
+    def test_negated_treatment_rejects_the_entry(self):
+        self.assertIsNone(self.condition_for("Strep throat. Antibiotics are not needed this time."))
+
+    def test_negated_supporting_keyword_does_not_count(self):
+        self.assertEqual(self.library.score("Lungs and breathing checked; cough")["asthma"], 0.75)
+        self.assertEqual(self.library.score("Lungs and breathing checked; cough ruled out")["asthma"], 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
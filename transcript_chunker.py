@@ -0,0 +1,76 @@
+import re
+from typing import List
+
+# Whisper transcripts have punctuation but rarely paragraph breaks, so we
+# split on sentence endings and fall back to whitespace for run-on speech.
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+')
+WORD_PATTERN = re.compile(r'\S+')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate how many Claude tokens a piece of text will use
+
+    Uses the usual ~4 characters per token rule, bumped up for text with many
+    short words (numbers, dosages, abbreviations) which tokenize less densely.
+
+    Args:
+        text: The text to measure
+
+    Returns:
+        Approximate token count
+    """
+    if not text:
+        return 0
+
+    by_chars = len(text) / 4.0
+    by_words = len(WORD_PATTERN.findall(text)) * 1.3
+    return int(max(by_chars, by_words)) + 1
+
+
+def chunk_transcript(text: str, max_tokens: int = 1200, overlap_sentences: int = 1) -> List[str]:
+    """
+    Split a long transcript into chunks that each fit a token budget
+
+    Args:
+        text: The transcript to split
+        max_tokens: Approximate token budget per chunk
+        overlap_sentences: Sentences repeated at the start of the next chunk
+            so facts spanning a boundary are not lost
+
+    Returns:
+        List of transcript chunks in their original order
+    """
+    sentences = []
+    for sentence in SENTENCE_PATTERN.split(text.strip()):
+        if not sentence:
+            continue
+        if estimate_tokens(sentence) <= max_tokens:
+            sentences.append(sentence)
+            continue
+
+        # Run-on speech with no punctuation: break it up by words
+        words = sentence.split()
+        words_per_piece = max(1, int(max_tokens / 1.3) - 1)
+        for start in range(0, len(words), words_per_piece):
+            sentences.append(' '.join(words[start:start + words_per_piece]))
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for sentence in sentences:
+        sentence_tokens = estimate_tokens(sentence)
+        if current and current_tokens + sentence_tokens > max_tokens:
+            chunks.append(' '.join(current))
+            current = current[-overlap_sentences:] if overlap_sentences else []
+            current_tokens = sum(estimate_tokens(s) for s in current)
+            # Never let the overlap alone push us over budget
+            while current and current_tokens + sentence_tokens > max_tokens:
+                current_tokens -= estimate_tokens(current.pop(0))
+        current.append(sentence)
+        current_tokens += sentence_tokens
+
+    if current:
+        chunks.append(' '.join(current))
+
+    return chunks